@@ -14,6 +14,7 @@ class AssessmentMarkup(markupparser.Markup):
     example = "<!assessment=dtc-exercise-1>"
     inline = False
     allow_inline = False
+    cacheable = False
     is_editable = True
     has_reference = True
 
@@ -1,8 +1,6 @@
-import django.conf
 from django.contrib import admin
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin, GroupAdmin
-from django.core.cache import cache
 from django.db import models, transaction
 from django.db.models import Q, Prefetch
 from django.forms import BaseInlineFormSet, TextInput
@@ -70,7 +68,9 @@ from courses.forms import (
     InstanceForm,
 )
 from courses.widgets import AdminFileWidget, AdminTemplateBackendFileWidget
+from utils.cache import bump_generation
 from utils.management import CourseContentAdmin, CourseMediaAdmin
+from utils.rendering import clear_term_cache
 
 from faq.utils import clone_faq_links
 
@@ -533,22 +533,13 @@ class TermAdmin(TranslationAdmin, VersionAdmin):
             return True
         return False
 
-    def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        lang_list = django.conf.settings.LANGUAGES
-        for instance in CourseInstance.objects.filter(course=obj.origin, frozen=False):
-            instance_slug = instance.slug
-            for lang, __ in lang_list:
-                cache.set(
-                    f"termbank_contents_{instance_slug}_{lang}",
-                    None,
-                    timeout=None,
-                )
-                cache.set(
-                    f"termbank_div_data_{instance_slug}_{lang}",
-                    None,
-                    timeout=None,
-                )
+    def save_related(self, request, form, formsets, change):
+        # Aliases, tabs and links are saved here, after the term itself
+        super().save_related(request, form, formsets, change)
+        term = form.instance
+        for instance in CourseInstance.objects.filter(course=term.origin, frozen=False):
+            clear_term_cache(instance, term)
+            bump_generation(instance, "termbank")
 
 
 class TermTagAdmin(TranslationAdmin):
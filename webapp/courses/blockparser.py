@@ -1,10 +1,22 @@
 # -*- coding: utf-8 -*-
 """Parser for inline wiki markup tags that appear in paragraphs, tables etc."""
 
-import re
 
 class Tag:
-    """One markup tag type."""
+    """
+    One markup tag type.
+
+    If trigger is set, it must be a literal string that every match of the
+    tag's regexp begins with. The parser uses it to skip the tag for strings
+    that cannot contain it.
+
+    Tags whose output depends on database objects or the rendering context
+    set cacheable to False, so that blocks containing them are always
+    rendered again.
+    """
+
+    trigger = None
+    cacheable = True
 
     def __init__(self):
         self.options = None
@@ -47,28 +59,56 @@ class Tag:
         return parsed_string
 
     def parse(self, unparsed_string, context):
-        parsed_string = ""
+        parts = []
         cursor = 0
-        for match in re.finditer(self.regexp, unparsed_string):
-            parsed_string += unparsed_string[cursor:match.start()]
-            parsed_string += self.render_tag(match, context)
+        for match in self.regexp.finditer(unparsed_string):
+            parts.append(unparsed_string[cursor:match.start()])
+            parts.append(self.render_tag(match, context))
             cursor = match.end()
 
-        parsed_string += unparsed_string[cursor:]
-        return parsed_string
+        if not parts:
+            return unparsed_string
+
+        parts.append(unparsed_string[cursor:])
+        return "".join(parts)
 
 
 class BlockParser:
+    """
+    Applies all registered tags to a string, one after another in registration
+    order. Each tag sees the output of the tags before it, which is what makes
+    e.g. bold text nested inside italic text work. Tags that have a trigger are
+    only applied if their trigger appears in the string, so plain text is only
+    scanned for the triggers instead of being matched against every tag.
+    """
 
     tags = {}
+    _pipeline = []
+    _uncacheable_triggers = []
 
     @classmethod
     def register_tag(cls, handle, tag_cls):
         cls.tags[handle] = tag_cls()
+        cls._pipeline = [(tag.trigger, tag) for tag in cls.tags.values()]
+        cls._uncacheable_triggers = [
+            tag.trigger for tag in cls.tags.values() if not tag.cacheable
+        ]
+
+    @classmethod
+    def is_cacheable(cls, blockstring):
+        """
+        Returns False if the string may contain tags that are not cacheable.
+        """
+
+        for trigger in cls._uncacheable_triggers:
+            if trigger is None or trigger in blockstring:
+                return False
+        return True
 
     def parse_block(self, blockstring, context=None):
-        for tag in self.tags.values():
-            blockstring = tag.parse(blockstring, context)
+        for trigger, tag in self._pipeline:
+            if trigger is None or trigger in blockstring:
+                blockstring = tag.parse(blockstring, context)
 
         return blockstring
 
@@ -1,13 +1,11 @@
 import re
 
 import pygments
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name
-from pygments.formatters import HtmlFormatter
 from django.utils.text import slugify
 
 import courses.models as cm
 from courses.blockparser import Tag, BlockParser
+from utils.highlight import highlight_code, lexer_by_name
 from utils.parsing import BrokenLinkWarning, parse_link_url
 
 
@@ -17,6 +15,7 @@ class BoldTag(Tag):
     begin = "'''"
     end = "'''"
     regexp = re.compile(r"[']{3}(?P<bold_italic>[']{2})?.+?(?P=bold_italic)?[']{3}")
+    trigger = "'''"
 
 
 class ItalicTag(Tag):
@@ -25,6 +24,7 @@ class ItalicTag(Tag):
     begin = "''"
     end = "''"
     regexp = re.compile(r"[']{2}.+?[']{2}")
+    trigger = "''"
 
 
 class PreTag(Tag):
@@ -33,6 +33,7 @@ class PreTag(Tag):
     begin = "{{{"
     end = "}}}"
     regexp = re.compile(r"[{]{3}(?P<highlight>\#\![^\s]+ )?.+?[}]{3}")
+    trigger = "{{{"
 
     def render_tag(self, match, context):
         hilite = match.group("highlight") or ""
@@ -44,12 +45,12 @@ class PreTag(Tag):
         parsed_string = self.htmlbegin({"class": "highlight " + hilite})
         if hilite:
             try:
-                lexer = get_lexer_by_name(hilite)
+                lexer_by_name(hilite)
             except pygments.util.ClassNotFound as e:
                 parsed_string += f"no such highlighter: {hilite}; "
                 parsed_string += code_string
             else:
-                parsed_string += highlight(code_string, lexer, HtmlFormatter(nowrap=True)).rstrip("\n")
+                parsed_string += highlight_code(code_string, hilite).rstrip("\n")
         else:
             parsed_string += code_string
 
@@ -63,6 +64,7 @@ class MarkTag(Tag):
     begin = "!!!"
     end = "!!!"
     regexp = re.compile(r"[\!]{3}.+?[\!]{3}")
+    trigger = "!!!"
 
 
 class AnchorTag(Tag):
@@ -71,6 +73,8 @@ class AnchorTag(Tag):
     begin = "[["
     end = "]]"
     regexp = re.compile(r"\[\[(?P<address>.+?)([|](?P<link_text>.+?))?\]\]")
+    trigger = "[["
+    cacheable = False
 
     def render_tag(self, match, context):
         address = match.group("address")
@@ -99,6 +103,7 @@ class KeyboardTag(Tag):
     begin = "`"
     end = "`"
     regexp = re.compile(r"`(?P<kbd>.+?)`")
+    trigger = "`"
 
     def render_tag(self, match, context):
         symbol = match.group("kbd")
@@ -124,6 +129,7 @@ class ColorTag(Tag):
     begin = "[!color=value!]"
     end = "[!color!]"
     regexp = re.compile(r"\[\!color\=(?P<color>[^!]+)\!\](?P<colored_text>.+?)\[\!color\!\]")
+    trigger = "[!color="
 
     def render_tag(self, match, context):
         color = match.group("color")
@@ -140,6 +146,7 @@ class HintTag(Tag):
     begin = "[!hint=hint_id!]"
     end = "[!hint!]"
     regexp = re.compile(r"\[\!hint\=(?P<hint_id>[^!]+)\!\](?P<hint_text>.+?)\[\!hint\!\]")
+    trigger = "[!hint="
 
     def render_tag(self, match, context):
         parsed_string = self.htmlbegin({
@@ -157,6 +164,8 @@ class TermTag(Tag):
     begin = "[!term=term_name!]"
     end = "[!term!]"
     regexp = re.compile(r"\[\!term\=(?P<term_name>[^!]+)\!\](?P<term_text>.+?)\[\!term\!\]")
+    trigger = "[!term="
+    cacheable = False
 
     def render_tag(self, match, context):
         term_name = match.group("term_name")
@@ -191,6 +200,8 @@ class DeadlineTag(Tag):
     begin = "[!dl=page_slug!]"
     end = "[!dl]"
     regexp = re.compile(r"\[\!dl\=(?P<page_slug>[^!]+)\!\]")
+    trigger = "[!dl="
+    cacheable = False
 
     def render_tag(self, match, context):
         parsed_string = self.htmlbegin({"class": "date-display"})
@@ -213,6 +224,8 @@ class GradeThresholdTag(Tag):
     begin = "[!threshold=grade!]"
     end = "[!threshold!]"
     regexp = re.compile(r"\[\!threshold\=(?P<grade>[^!]+)\!\]")
+    trigger = "[!threshold="
+    cacheable = False
 
     def render_tag(self, match, context):
         grade = match.group("grade")
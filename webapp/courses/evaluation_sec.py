@@ -6,12 +6,15 @@ and limiting the OS resources available to the processes to provide a reasonably
 safe environment to run unsafe code in.
 """
 
+import errno
 import logging
 import os
 import pwd
 import resource
+import shutil
 import signal
 import subprocess
+import sys
 
 from django.conf import settings
 
@@ -56,6 +59,70 @@ def get_demote_process_fun(
 default_demote_process = get_demote_process_fun()
 
 
+# Run by a new interpreter between fork and the exec of the actual command.
+# Forking processes that run Python code before exec (e.g. with preexec_fn) can
+# deadlock when the checker runs tests in several threads, so demoting and
+# limiting resources is done after exec instead. The arguments are the user and
+# group ids, the resource limits in the order of _DEMOTE_LIMITS and the command.
+_DEMOTE_SCRIPT = """
+import os, resource, sys
+uid, gid = int(sys.argv[1]), int(sys.argv[2])
+os.setresgid(gid, gid, gid)
+os.setresuid(uid, uid, uid)
+for name, limit in zip(sys.argv[3].split(","), sys.argv[4].split(",")):
+    resource.setrlimit(getattr(resource, name), (int(limit), int(limit)))
+try:
+    os.execvp(sys.argv[5], sys.argv[5:])
+except OSError as e:
+    sys.stderr.write(f"{e}\\n")
+    sys.exit(127)
+"""
+_DEMOTE_LIMITS = ("RLIMIT_NPROC", "RLIMIT_NOFILE", "RLIMIT_FSIZE", "RLIMIT_CPU", "RLIMIT_DATA")
+
+
+def get_demoted_args(
+    args,
+    concurrent_processes=settings.WORKER_CONCURRENCY,
+    number_of_files=settings.WORKER_NO_FILES,
+    file_size=settings.WORKER_FILE_SIZE,
+    cpu_time=settings.WORKER_CPU_TIME,
+    memory=settings.WORKER_MEMORY,
+):
+    """
+    Wraps the arguments of a command so that it is run as the restricted user
+    with the same resource limits as limit_resources sets. The user and group
+    ids are looked up here, before the process is forked. Unlike
+    default_demote_process, this is safe to use in threads.
+    """
+
+    student_uid, student_gid = get_uid_gid(settings.RESTRICTED_USERNAME)
+    limits = (concurrent_processes, number_of_files, file_size, cpu_time, memory)
+    return [
+        sys.executable, "-I", "-S", "-c", _DEMOTE_SCRIPT,
+        str(student_uid),
+        str(student_gid),
+        ",".join(_DEMOTE_LIMITS),
+        ",".join(str(int(limit)) for limit in limits),
+        *args,
+    ]
+
+
+def check_executable(name, cwd, path):
+    """
+    Raises the same errors as Popen would if a command can't be run, since the
+    command is only executed after demoting with get_demoted_args.
+    """
+
+    if os.sep in name:
+        executable = os.path.join(cwd, name)
+        if not os.path.isfile(executable):
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), name)
+        if not os.access(executable, os.X_OK):
+            raise PermissionError(errno.EACCES, os.strerror(errno.EACCES), name)
+    elif shutil.which(name, path=path) is None:
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), name)
+
+
 def close_fds():
     """
     Close all file descriptors (i.e. files, sockets etc.) except the standard
@@ -143,13 +210,12 @@ def chmod_child_files(test_dir):
     """
 
     proc = subprocess.run(
-        ("chmod", "-R", "a+rw", "."),
+        get_demoted_args(["chmod", "-R", "a+rw", "."]),
         bufsize=-1,
         executable=None,
         timeout=5,
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
-        preexec_fn=default_demote_process,  # Demote before fork
         start_new_session=True,
         close_fds=True,  # Don't inherit fds
         shell=False,  # Don't run in shell
@@ -182,13 +248,12 @@ def secure_kill(pid):
     for command in commands:
         try:
             proc = subprocess.run(
-                command,
+                get_demoted_args(command),
                 bufsize=-1,
                 executable=None,
                 timeout=5,
                 stdout=subprocess.DEVNULL,
                 stderr=subprocess.DEVNULL,
-                preexec_fn=default_demote_process,  # Demote before fork
                 start_new_session=True,
                 close_fds=True,  # Don't inherit fds
                 shell=False,  # Don't run in shell
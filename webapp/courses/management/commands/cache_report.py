@@ -0,0 +1,93 @@
+import pickle
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from courses.models import ContentGraph, CourseInstance, EmbeddedLink
+from utils.cache import unpack
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports the approximate size of rendered content in the cache for each course "
+        "instance, both as stored and unpacked"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "instances",
+            nargs="*",
+            help="Slugs of the instances to report (default: all instances)",
+        )
+
+    def handle(self, *args, **options):
+        instances = CourseInstance.objects.order_by("course__name", "name")
+        if options["instances"]:
+            instances = instances.filter(slug__in=options["instances"])
+
+        print(f"{'instance':<40} {'kind':<10} {'keys':>6} {'stored':>12} {'unpacked':>12}")
+        total_stored = total_unpacked = 0
+        for instance in instances:
+            for kind, keys in self._keys_by_kind(instance).items():
+                found, stored, unpacked = self._measure(keys)
+                total_stored += stored
+                total_unpacked += unpacked
+                if found:
+                    print(f"{instance.slug:<40} {kind:<10} {found:>6} {stored:>12} {unpacked:>12}")
+
+        print(f"{'total':<40} {'':<10} {'':>6} {total_stored:>12} {total_unpacked:>12}")
+
+    def _keys_by_kind(self, instance):
+        lang_codes = [lang_code for lang_code, __ in settings.LANGUAGES]
+        page_slugs = list(
+            ContentGraph.objects.filter(instance=instance).values_list("content__slug", flat=True)
+        )
+        embedded_slugs = list(
+            EmbeddedLink.objects.filter(instance=instance).values_list(
+                "embedded_page__slug", flat=True
+            )
+        )
+
+        registry_keys = [
+            f"{slug}_contentkeys_{instance.slug}_{lang_code}"
+            for slug in page_slugs
+            for lang_code in lang_codes
+        ]
+        content_keys = []
+        for keys in cache.get_many(registry_keys).values():
+            content_keys.extend(keys)
+
+        return {
+            "content": content_keys,
+            "blocks": [
+                f"{slug}_blocks_{instance.slug}_{lang_code}"
+                for slug in page_slugs
+                for lang_code in lang_codes
+            ],
+            "tree": [
+                f"{instance.slug}_tree_{lang_code}{suffix}"
+                for lang_code in lang_codes
+                for suffix in ("", "_staff")
+            ],
+            "faq": [
+                f"{slug}_faq_{instance.slug}_{lang_code}"
+                for slug in set(page_slugs + embedded_slugs)
+                for lang_code in lang_codes
+            ],
+            "termbank": [
+                f"termbank_contents_{instance.slug}_{lang_code}" for lang_code in lang_codes
+            ],
+        }
+
+    def _measure(self, keys):
+        found = stored = unpacked = 0
+        for cached in cache.get_many(keys).values():
+            found += 1
+            size = len(pickle.dumps(cached, protocol=pickle.HIGHEST_PROTOCOL))
+            stored += size
+            value = unpack(cached)
+            if value is None:
+                unpacked += size
+            else:
+                unpacked += len(pickle.dumps(value[1], protocol=pickle.HIGHEST_PROTOCOL))
+        return found, stored, unpacked
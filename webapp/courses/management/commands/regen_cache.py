@@ -1,5 +1,8 @@
+import os
+
 from django.core.management.base import BaseCommand
-from courses.models import ContentGraph
+from courses.models import ContentGraph, CourseInstance
+from utils.regeneration import regenerate_locally, regeneration_progress, schedule_regeneration
 
 
 class Command(BaseCommand):
@@ -11,10 +14,37 @@ class Command(BaseCommand):
             action="store_true",
             help="Regenerate for frozen instances as well",
         )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of processes used for regenerating (default: number of CPUs)",
+        )
+        parser.add_argument(
+            "--celery",
+            action="store_true",
+            help="Send the regeneration jobs to Celery workers instead of running them here",
+        )
 
     def handle(self, *args, **options):
-        for cg in ContentGraph.objects.all():
-            if not options["frozen"] and cg.instance.frozen:
-                print(f"Skipping for frozen instance {cg.instance}")
+        instances = CourseInstance.objects.filter(
+            id__in=ContentGraph.objects.values("instance_id")
+        ).order_by("id")
+        for instance in instances:
+            if not options["frozen"] and instance.frozen:
+                print(f"Skipping for frozen instance {instance}")
+                continue
+
+            if options["celery"]:
+                schedule_regeneration(instance)
+                print(f"Scheduled regeneration for {instance}")
                 continue
-            cg.content.regenerate_cache(cg.instance)
+
+            def report(done, total):
+                print(f"\r{instance}: {done} / {total}", end="", flush=True)
+
+            regenerate_locally(instance, workers=options["workers"], report=report)
+            print()
+            failed = regeneration_progress(instance)["failed"]
+            if failed:
+                print(f"{instance}: {failed} jobs failed, see the log for details")
@@ -8,19 +8,82 @@ from django.utils.safestring import mark_safe
 from django.utils.text import slugify
 
 import pygments
-from pygments.lexers import get_lexer_by_name, guess_lexer_for_filename
-from pygments.formatters import HtmlFormatter
 
-from reversion.models import Version
-
-from courses.markupparser import MarkupParser, LinkParser, Markup
+from courses.markupparser import (
+    EmbeddedObjectNotAllowedError,
+    EmbeddedObjectNotFoundError,
+    LinkParser,
+    Markup,
+    MarkupParser,
+)
 from courses import blockparser
 import courses.models as cm
-from utils.archive import get_single_archived
-from utils.content import get_embedded_media_file, get_embedded_media_image
+from utils.content import (
+    get_embedded_media_file,
+    get_embedded_media_image,
+    preload_embedded_media,
+    preload_embedded_pages,
+)
+from utils.highlight import highlight_code, highlight_file, lexer_by_name
+from utils.parsing import get_link_resolver
 from utils import snippets
 
 
+def _page_links(state):
+    """
+    Finds the embedded page and media links of the whole parsed text with
+    LinkParser. The result is stored in the parser state so that the text is
+    only scanned once per parse.
+    """
+
+    if "links" not in state["preloaded"]:
+        state["preloaded"]["links"] = LinkParser().parse(
+            state["text"], state["context"].get("instance")
+        )
+    return state["preloaded"]["links"]
+
+
+def _inline_context(state):
+    """
+    Gets the context for parsing inline markup. The first call during a parse
+    prefetches the targets of all inline links in the parsed text.
+    """
+
+    if "inline_links" not in state["preloaded"]:
+        anchor_re = blockparser.BlockParser.tags["anchor"].regexp
+        get_link_resolver(state["context"]).prefetch(
+            match.group("address") for match in anchor_re.finditer(state["text"])
+        )
+        state["preloaded"]["inline_links"] = True
+    return state["context"]
+
+
+def _get_embedded_media(kind, name, state):
+    """
+    Gets an embedded media object of the given kind ("file", "image" or
+    "video"). All media linked from the parsed text are resolved in bulk when
+    the first one is requested. Media that were not resolved in bulk are
+    looked up individually, which also raises the DoesNotExist exceptions.
+    """
+
+    instance = state["context"].get("instance")
+    parent = state["context"].get("content")
+    if "media" not in state["preloaded"]:
+        __, media_links = _page_links(state)
+        state["preloaded"]["media"] = preload_embedded_media(media_links, instance, parent)
+
+    try:
+        return state["preloaded"]["media"][kind][name]
+    except KeyError:
+        pass
+
+    if kind == "video":
+        return cm.VideoLink.objects.get(name=name)
+    if kind == "image":
+        return get_embedded_media_image(name, instance, parent)
+    return get_embedded_media_file(name, instance, parent)
+
+
 class ParagraphMarkup(Markup):
     name = "Paragraph"
     shortname = "paragraph"
@@ -40,7 +103,7 @@ class ParagraphMarkup(Markup):
         for line in block:
             paragraph_lines.append(escape(line, quote=False))
         paragraph = "<br>\n".join(paragraph_lines)
-        paragraph = blockparser.parseblock(paragraph, state["context"])
+        paragraph = blockparser.parseblock(paragraph, _inline_context(state))
         yield paragraph
         yield "</div>\n"
 
@@ -94,6 +157,7 @@ class CalendarMarkup(Markup):
     example = "<!calendar=course-project-demo-calendar>"
     inline = False
     allow_inline = False
+    cacheable = False
     is_editable = True
     has_reference = True
 
@@ -144,7 +208,7 @@ class CodeMarkup(Markup):
         text = ""
         if highlight:
             try:
-                lexer = get_lexer_by_name(highlight)
+                lexer_by_name(highlight)
             except pygments.util.ClassNotFound as e:
                 yield f"<div class='warning'>{str(e).capitalize()}</div>"
                 highlight = False
@@ -155,7 +219,7 @@ class CodeMarkup(Markup):
             text += line + "\n"
 
         if highlight:
-            highlighted = pygments.highlight(text[:-1], lexer, HtmlFormatter(nowrap=True))
+            highlighted = highlight_code(text[:-1], highlight)
             yield f"{highlighted}</code>"
         else:
             yield text
@@ -194,6 +258,7 @@ class EmbeddedFileMarkup(Markup):
     states = {}
     inline = False
     allow_inline = False
+    cacheable = False
     is_editable = True
     has_reference = True
 
@@ -202,9 +267,7 @@ class EmbeddedFileMarkup(Markup):
         instance = state["context"].get("instance")
 
         try:
-            file_object = get_embedded_media_file(
-                settings["file_slug"], instance, state["context"].get("content")
-            )
+            file_object = _get_embedded_media("file", settings["file_slug"], state)
         except cm.File.DoesNotExist as e:
             yield f"<div>File {settings['file_slug']} not found.</div>"
             return
@@ -223,13 +286,11 @@ class EmbeddedFileMarkup(Markup):
                 return
 
             try:
-                lexer = guess_lexer_for_filename(file_path, file_contents)
+                highlighted = highlight_file(file_path, file_contents)
             except pygments.util.ClassNotFound:
                 yield f"<div>Unable to find lexer for file {settings['file_slug']}.</div>"
                 return
 
-            highlighted = pygments.highlight(file_contents, lexer, HtmlFormatter(nowrap=True))
-
         if file_object.download_as:
             dl_name = file_object.download_as
         else:
@@ -281,6 +342,7 @@ class EmbeddedPageMarkup(Markup):
     example = "<!page=slug-of-some-exercise>"
     inline = False
     allow_inline = False
+    cacheable = False
     is_editable = True
     has_reference = True
 
@@ -292,125 +354,123 @@ class EmbeddedPageMarkup(Markup):
         yield (cls.shortname, settings)
 
     @classmethod
-    def settings(cls, matchobj, state):
-        settings = {"slug": matchobj.group("page_slug")}
-        revision = None
+    def _resolve_page(cls, slug, state):
+        """
+        Gets the page, revision and choices for an embedded page slug. All
+        embedded pages of the parsed text are resolved in bulk when the first
+        one is encountered.
+        """
+
         instance = state["context"].get("instance")
+        parent = state["context"].get("content")
+        preloaded = state["preloaded"].get(cls.shortname)
+        if preloaded is None:
+            page_links, __ = _page_links(state)
+            preloaded = preload_embedded_pages(page_links, instance, parent)
+            state["preloaded"][cls.shortname] = preloaded
+
+        if slug not in preloaded:
+            preloaded.update(preload_embedded_pages([slug], instance, parent))
 
         try:
-            try:
-                link = cm.EmbeddedLink.objects.get(
-                    embedded_page__slug=settings["slug"],
-                    instance=instance,
-                    parent=state["context"]["content"],
-                )
-            except (KeyError, cm.EmbeddedLink.DoesNotExist) as e:
-                # link does not exist yet, get by page slug instead
-                page = cm.ContentPage.objects.get(slug=settings["slug"])
-            else:
-                page = link.embedded_page
-                revision = link.revision
-        except cm.ContentPage.DoesNotExist as e:
+            return preloaded[slug]
+        except KeyError as e:
             raise EmbeddedObjectNotFoundError(
-                f"embedded page '{settings['slug']}' couldn't be found"
+                f"embedded page '{slug}' couldn't be found"
             ) from e
-        else:
-            if revision is not None:
-                try:
-                    page = get_single_archived(page, revision)
-                except Version.DoesNotExist as e:
-                    raise EmbeddedObjectNotFoundError(
-                        f"revision '{revision}' of embedded page '{settings['slug']}' "
-                        "couldn't be found"
-                    ) from e
-
-            state["embedded_pages"].append((settings["slug"], revision))
-
-            choices = page.get_choices(page, revision=revision)
-            c = {
-                "content": page,
-                "course": state["context"].get("course"),
-                "instance": state["context"].get("instance"),
-                "choices": choices,
-                "revision": revision,
-            }
-            embedded_content = page.get_rendered_content(page, c)
-            question = page.get_question(page, c)
-            t = loader.get_template(page.template)
-            rendered_form = t.render(c)
-
-            settings["content"] = embedded_content
-            settings["question"] = question
-            settings["form"] = rendered_form
-            settings["revision"] = revision
-            settings["max_points"] = page.default_points
-            if instance is not None:
-                settings["urls"] = {
-                    "stats_url": reverse("stats:single_exercise", kwargs={"exercise": page}),
-                    "feedback_url": reverse(
-                        "feedback:statistics",
-                        kwargs={"instance": instance, "content": page},
-                    ),
-                    "download_url": reverse(
-                        "teacher_tools:download_answers",
-                        kwargs={
-                            "course": instance.course,
-                            "instance": instance,
-                            "content": page,
-                        },
-                    ),
-                    "summary_url": reverse(
-                        "teacher_tools:answer_summary",
-                        kwargs={
-                            "course": instance.course,
-                            "instance": instance,
-                            "content": page,
-                        },
-                    ),
-                    "batch_url": reverse(
-                        "teacher_tools:batch_grade",
-                        kwargs={
-                            "course": instance.course,
-                            "instance": instance,
-                            "content": page,
-                        },
-                    ),
-                    "reset_url": reverse(
-                        "teacher_tools:reset_completion",
-                        kwargs={
-                            "course": instance.course,
-                            "instance": instance,
-                            "content": page,
-                        },
-                    ),
-                    "edit_url": page.get_admin_change_url(),
-                    "submit_url": reverse(
-                        "courses:check",
-                        kwargs={
-                            "course": instance.course,
-                            "instance": instance,
-                            "content": page,
-                            "revision": revision or "head",
-                        },
-                    ),
-                    "edit_content_url": reverse("courses:content_edit_form", kwargs={
+
+    @classmethod
+    def settings(cls, matchobj, state):
+        settings = {"slug": matchobj.group("page_slug")}
+        instance = state["context"].get("instance")
+
+        page, revision, choices = cls._resolve_page(settings["slug"], state)
+        state["embedded_pages"].append((settings["slug"], revision))
+
+        c = {
+            "content": page,
+            "course": state["context"].get("course"),
+            "instance": state["context"].get("instance"),
+            "choices": choices,
+            "revision": revision,
+        }
+        embedded_content = page.get_rendered_content(page, c)
+        question = page.get_question(page, c)
+        t = loader.get_template(page.template)
+        rendered_form = t.render(c)
+
+        settings["content"] = embedded_content
+        settings["question"] = question
+        settings["form"] = rendered_form
+        settings["revision"] = revision
+        settings["max_points"] = page.default_points
+        if instance is not None:
+            settings["urls"] = {
+                "stats_url": reverse("stats:single_exercise", kwargs={"exercise": page}),
+                "feedback_url": reverse(
+                    "feedback:statistics",
+                    kwargs={"instance": instance, "content": page},
+                ),
+                "download_url": reverse(
+                    "teacher_tools:download_answers",
+                    kwargs={
                         "course": instance.course,
                         "instance": instance,
                         "content": page,
-                        "action": "edit",
-                    }),
-                    "delete_content_url": reverse("courses:content_edit_form", kwargs={
+                    },
+                ),
+                "summary_url": reverse(
+                    "teacher_tools:answer_summary",
+                    kwargs={
                         "course": instance.course,
                         "instance": instance,
                         "content": page,
-                        "action": "delete",
-                    }),
-                    "add_content_url": reverse("courses:content_add_form", kwargs={
+                    },
+                ),
+                "batch_url": reverse(
+                    "teacher_tools:batch_grade",
+                    kwargs={
                         "course": instance.course,
                         "instance": instance,
                         "content": page,
-                    }),
-                }
+                    },
+                ),
+                "reset_url": reverse(
+                    "teacher_tools:reset_completion",
+                    kwargs={
+                        "course": instance.course,
+                        "instance": instance,
+                        "content": page,
+                    },
+                ),
+                "edit_url": page.get_admin_change_url(),
+                "submit_url": reverse(
+                    "courses:check",
+                    kwargs={
+                        "course": instance.course,
+                        "instance": instance,
+                        "content": page,
+                        "revision": revision or "head",
+                    },
+                ),
+                "edit_content_url": reverse("courses:content_edit_form", kwargs={
+                    "course": instance.course,
+                    "instance": instance,
+                    "content": page,
+                    "action": "edit",
+                }),
+                "delete_content_url": reverse("courses:content_edit_form", kwargs={
+                    "course": instance.course,
+                    "instance": instance,
+                    "content": page,
+                    "action": "delete",
+                }),
+                "add_content_url": reverse("courses:content_add_form", kwargs={
+                    "course": instance.course,
+                    "instance": instance,
+                    "content": page,
+                }),
+            }
 
         return settings
 
@@ -439,6 +499,7 @@ class EmbeddedScriptMarkup(Markup):
     states = {}
     inline = False
     allow_inline = False
+    cacheable = False
     is_editable = True
     has_reference = True
 
@@ -447,11 +508,8 @@ class EmbeddedScriptMarkup(Markup):
         if "tooltip" in state["context"] and state["context"]["tooltip"]:
             raise EmbeddedObjectNotAllowedError("embedded scripts are not allowed in tooltips")
 
-        instance = state["context"].get("instance")
-        content = state["context"].get("content")
-
         try:
-            script = get_embedded_media_file(settings["script_slug"], instance, content)
+            script = _get_embedded_media("file", settings["script_slug"], state)
         except cm.File.DoesNotExist as e:
             yield f"<div>File {settings['script_slug']} not found.</div>"
             return
@@ -469,9 +527,9 @@ class EmbeddedScriptMarkup(Markup):
 
             try:
                 if incl_type == "image":
-                    incl_obj = get_embedded_media_image(incl_name, instance, content)
+                    incl_obj = _get_embedded_media("image", incl_name, state)
                 else:
-                    incl_obj = get_embedded_media_file(incl_name, instance, content)
+                    incl_obj = _get_embedded_media("file", incl_name, state)
             except (cm.File.DoesNotExist, cm.Image.DoesNotExist) as e:
                 yield f"<div>{incl_type.capitalize()} {incl_name} not found.</div>"
                 return
@@ -614,6 +672,7 @@ class EmbeddedVideoMarkup(Markup):
     states = {}
     inline = False
     allow_inline = False
+    cacheable = False
     is_editable = True
     has_reference = True
 
@@ -623,7 +682,7 @@ class EmbeddedVideoMarkup(Markup):
             raise EmbeddedObjectNotAllowedError("embedded videos are not allowed in tooltips")
 
         try:
-            videolink = cm.VideoLink.objects.get(name=settings["video_slug"])
+            videolink = _get_embedded_media("video", settings["video_slug"], state)
         except cm.VideoLink.DoesNotExist as e:
             yield f"<div>Video link {settings['video_slug']} not found.</div>"
             return
@@ -744,16 +803,14 @@ class ImageMarkup(Markup):
     example = "<!image=name-of-some-image.png|alt=alternative text|caption=caption text>"
     inline = False
     allow_inline = False
+    cacheable = False
     is_editable = True
     has_reference = True
 
     @classmethod
     def block(cls, block, settings, state):
-        instance = state["context"].get("instance")
         try:
-            image_object = get_embedded_media_image(
-                settings["image_name"], instance, state["context"].get("content")
-            )
+            image_object = _get_embedded_media("image", settings["image_name"], state)
         except cm.Image.DoesNotExist as e:
             yield f"<div>File {settings['image_name']} not found.</div>"
             return
@@ -805,7 +862,7 @@ class ImageMarkup(Markup):
             pass
         try:
             settings["caption_text"] = blockparser.parseblock(
-                escape(matchobj.group("caption_text"), quote=False), state["context"]
+                escape(matchobj.group("caption_text"), quote=False), _inline_context(state)
             )
         except AttributeError:
             pass
@@ -856,7 +913,7 @@ class ListMarkup(Markup):
         for line in block:
             state_level = len(state["storage"]["value"])
             parse_result = blockparser.parseblock(
-                escape(line.strip("*#").strip(), quote=False), state["context"]
+                escape(line.strip("*#").strip(), quote=False), _inline_context(state)
             )
             line_level = re.match(cls.regexp, line).group("list_level")
             tag = "ul" if line_level[-1] == "*" else "ol"
@@ -982,11 +1039,12 @@ class TableMarkup(Markup):
             yield '<table class="content-table">'
             state["storage"] = {"block": "table", "value": True}
 
+        context = _inline_context(state)
         for line in block:
             row = line.split("||")[1:-1]
             yield "<tr>"
             yield "\n".join(
-                f"<td>{blockparser.parseblock(escape(cell, quote=False), state['context'])}</td>"
+                f"<td>{blockparser.parseblock(escape(cell, quote=False), context)}</td>"
                 for cell in row
             )
             yield "</tr>"
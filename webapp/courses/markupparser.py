@@ -1,4 +1,5 @@
 import copy
+import hashlib
 from html import escape
 import itertools
 import re
@@ -55,6 +56,102 @@ class EmbeddedObjectNotFoundError(MarkupError):
     _type = "embedded object not found"
 
 
+_GROUP_DEF_RE = re.compile(r"\(\?P<(?P<name>\w+)>")
+_GROUP_REF_RE = re.compile(r"\(\?(?:P=|\()(?P<name>\w+)\)")
+_NUMBERED_REF_RE = re.compile(r"\\[1-9]|\(\?\([0-9]+\)")
+
+
+def _prefix_groups(pattern, prefix):
+    """
+    Renames all named groups and named backreferences in a regexp pattern by
+    adding a prefix to them. This allows patterns that share group names to be
+    combined into one alternation.
+    """
+
+    pattern = _GROUP_DEF_RE.sub(lambda m: f"(?P<{prefix}{m.group('name')}>", pattern)
+    return _GROUP_REF_RE.sub(
+        lambda m: m.group(0).replace(m.group("name"), prefix + m.group("name")),
+        pattern
+    )
+
+
+def _compile_classifier(block_markups):
+    """
+    Compiles the line classifier for a list of block markups. Consecutive
+    mergeable markups are combined into a single regexp where each markup's
+    pattern is an alternative inside its own named group. Because alternatives
+    are tried in order, the first matching alternative is always the same
+    markup that would be found by trying each regexp one by one.
+
+    Markups that are not mergeable (opted out, compiled with flags, or using
+    numbered backreferences) are kept as separate entries in their original
+    position. Returns a list of (regexp, members) tuples where members is
+    either a dictionary of group name to markup class, or a single markup
+    class for unmerged entries.
+    """
+
+    classifier = []
+    alternatives = []
+    members = {}
+
+    def flush():
+        if alternatives:
+            classifier.append((re.compile("|".join(alternatives)), dict(members)))
+            alternatives.clear()
+            members.clear()
+
+    for i, markup_cls in enumerate(block_markups):
+        regexp = markup_cls.regexp
+        mergeable = (
+            markup_cls.mergeable
+            and isinstance(regexp.pattern, str)
+            and regexp.flags == re.UNICODE
+            and not _NUMBERED_REF_RE.search(regexp.pattern)
+        )
+        if mergeable:
+            group = f"_m{i}"
+            alternative = f"(?P<{group}>{_prefix_groups(regexp.pattern, group + '_')})"
+            try:
+                re.compile(alternative)
+            except re.error:
+                mergeable = False
+
+        if mergeable:
+            alternatives.append(alternative)
+            members[group] = markup_cls
+        else:
+            flush()
+            classifier.append((regexp, markup_cls))
+
+    flush()
+    return classifier
+
+
+class BlockCache:
+    """
+    Rendered blocks of one page, keyed by a hash of the block's lines and the
+    parser state at the start of the block. Passed to MarkupParser.parse to
+    only render the blocks that have changed since the previous parse.
+
+    Entries that are read or written during a parse are collected into the
+    blocks attribute, so blocks that no longer exist in the page are dropped
+    when the blocks are stored again.
+    """
+
+    def __init__(self, blocks=None):
+        self._previous = blocks or {}
+        self.blocks = {}
+
+    def get(self, key):
+        entry = self.blocks.get(key, self._previous.get(key))
+        if entry is not None:
+            self.blocks[key] = entry
+        return entry
+
+    def set(self, key, entry):
+        self.blocks[key] = entry
+
+
 class MarkupParser:
     """
     Static parser class for generating HTML from the used markup block types.
@@ -69,6 +166,7 @@ class MarkupParser:
     include_forms = {}
     _block_markups = []
     _inline_markups = []
+    _block_classifier = []
 
     def __init__(self):
         self._current_matchobj = None
@@ -82,6 +180,7 @@ class MarkupParser:
                 cls._inline_markups.append(markup_cls)
             else:
                 cls._block_markups.append(markup_cls)
+                cls._block_classifier = _compile_classifier(cls._block_markups)
 
     @classmethod
     def register_form(cls, markup, action, form):
@@ -113,12 +212,19 @@ class MarkupParser:
         The match object is returned for use in the settings function of the
         markup.
 
-        TODO: The state selection could be implemented here; just have a class-
-        wide object point to the current regex-state instead of _block_re.
+        The line is classified against the combined classifier built in
+        register_markup, so usually only one regexp is tried per line. When a
+        combined regexp matches, the matching markup's own regexp is run once
+        more to obtain a match object with the markup's original group names.
         """
 
-        for block_markup in self._block_markups:
-            if matchobj := block_markup.regexp.match(line):
+        for regexp, members in self._block_classifier:
+            if matchobj := regexp.match(line):
+                if isinstance(members, dict):
+                    block_markup = members[matchobj.lastgroup]
+                    matchobj = block_markup.regexp.match(line)
+                else:
+                    block_markup = members
                 self._current_matchobj = matchobj
                 block_type = block_markup.shortname
                 break
@@ -138,11 +244,23 @@ class MarkupParser:
 
         return block_type
 
-    def parse(self, text, request=None, context=None, embedded_pages=None, editable=False):
+    def _block_key(self, block_type, block):
+        key_data = repr((block_type, block, self._state["storage"]))
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    def parse(
+        self, text, request=None, context=None, embedded_pages=None, editable=False,
+        block_cache=None
+    ):
         """
         A generator that gets the text written in the markup language, splits
         it at newlines and yields the parsed text until the whole text has
         been parsed.
+
+        If a BlockCache is given, blocks of cacheable markups are taken from
+        it when their lines and the parser state are unchanged, and newly
+        rendered blocks are added to it. Blocks that contain inline tags that
+        are not cacheable, such as links and deadlines, are always rendered.
         """
         self._current_matchobj = None
 
@@ -157,6 +275,7 @@ class MarkupParser:
         lines = iter(text.splitlines())
 
         self._state = {
+            "text": text,
             "lines": lines,
             "request": request,
             "context": context,
@@ -166,6 +285,7 @@ class MarkupParser:
             "open_block": "paragraph",
             "open": False,
             "storage": {},
+            "preloaded": {},
         }
 
         line_idx = 0
@@ -187,21 +307,51 @@ class MarkupParser:
                 #yield ("cleanup", "</table>\n", line_idx, 1)
                 #self._state["table"] = False
 
+            # The match object needs to be stored before the group is consumed
+            # because classifying the lines replaces it.
+            matchobj = self._current_matchobj
+            group = list(group)
+            line_count = len(group)
+
+            block_key = None
+            if (
+                block_cache is not None
+                and block_markup.cacheable
+                and blockparser.BlockParser.is_cacheable("\n".join(group))
+            ):
+                block_key = self._block_key(block_type, group)
+                cached_block = block_cache.get(block_key)
+                if cached_block is not None:
+                    results, block_content, storage = cached_block
+                    self._state["storage"] = copy.deepcopy(storage)
+                    for result in results:
+                        yield (*result, line_idx, line_count)
+                    if block_content:
+                        yield (block_type, block_content, line_idx, line_count)
+                    line_idx += line_count
+                    continue
+
+            results = []
             block_content = ""
             try:
-                settings = self._markups[block_type].settings(self._current_matchobj, self._state)
-                group = list(group)
-                line_count = len(group)
+                settings = block_markup.settings(matchobj, self._state)
                 for result in block_func(group, settings, self._state):
                     if isinstance(result, str):
                         block_content += result
                     else:
+                        results.append(result)
                         yield (*result, line_idx, line_count)
                 if block_content:
                     yield (block_type, block_content, line_idx, line_count)
             except MarkupError as e:
                 yield ("error", e.html(), line_idx, 1)
                 line_count = 1
+            else:
+                if block_key is not None:
+                    block_cache.set(
+                        block_key,
+                        (results, block_content, copy.deepcopy(self._state["storage"]))
+                    )
 
             line_idx += line_count
 
@@ -274,6 +424,7 @@ class LinkParser(MarkupParser):
     _markups = {}
     _block_markups = []
     _inline_markups = []
+    _block_classifier = []
 
     def parse(self, text, instance=None):
         page_links = []
@@ -300,6 +451,10 @@ class LinkParser(MarkupParser):
 
 # inline = this markup is inline
 # allow_inline = if use of inline markup, such as <b> is allowed
+# mergeable = if the regexp can be combined into the parser's line classifier
+# cacheable = if the rendered block only depends on its own lines and can be
+#             reused by incremental rendering, unless it contains inline tags
+#             that are not cacheable
 class Markup:
     """
     Base class for the markups.
@@ -320,6 +475,8 @@ class Markup:
     is_editable = False
     is_open = False
     has_reference = False
+    mergeable = True
+    cacheable = True
 
     @classmethod
     def block(cls, block, settings, state):
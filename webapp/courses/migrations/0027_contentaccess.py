@@ -0,0 +1,81 @@
+# Generated by Django 4.1 on 2026-10-18 07:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_content_access(apps, schema_editor):
+    ContentAccess = apps.get_model("courses", "ContentAccess")
+    ContentGraph = apps.get_model("courses", "ContentGraph")
+    EmbeddedLink = apps.get_model("courses", "EmbeddedLink")
+    ContentPage = apps.get_model("courses", "ContentPage")
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    Version = apps.get_model("reversion", "Version")
+
+    courses = set(
+        ContentGraph.objects.exclude(content=None).values_list("content_id", "instance__course_id")
+    )
+    courses.update(
+        EmbeddedLink.objects.filter(parent__contentgraph__isnull=False).values_list(
+            "embedded_page_id", "parent__contentgraph__instance__course_id"
+        )
+    )
+    ContentAccess.objects.bulk_create(
+        [
+            ContentAccess(content_id=content_id, course_id=course_id)
+            for content_id, course_id in courses
+        ],
+        ignore_conflicts=True,
+    )
+
+    content_type = ContentType.objects.filter(app_label="courses", model="contentpage").first()
+    if content_type is None:
+        return
+
+    page_ids = set(ContentPage.objects.values_list("id", flat=True))
+    authors = set(
+        (int(object_id), user_id) for object_id, user_id in
+        Version.objects.filter(content_type=content_type, revision__user__isnull=False)
+        .values_list("object_id", "revision__user_id")
+        .distinct()
+    )
+    ContentAccess.objects.bulk_create(
+        [
+            ContentAccess(content_id=content_id, author_id=user_id)
+            for content_id, user_id in authors
+            if content_id in page_ids
+        ],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("reversion", "0002_add_index_on_version_for_content_type_and_db"),
+        ("courses", "0026_calendar_lock_cancel_calendar_lock_period"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ContentAccess",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("author", models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ("content", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="courses.contentpage")),
+                ("course", models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to="courses.course")),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="contentaccess",
+            constraint=models.UniqueConstraint(condition=models.Q(("course__isnull", False)), fields=("content", "course"), name="unique_content_access_course"),
+        ),
+        migrations.AddConstraint(
+            model_name="contentaccess",
+            constraint=models.UniqueConstraint(condition=models.Q(("author__isnull", False)), fields=("content", "author"), name="unique_content_access_author"),
+        ),
+        migrations.RunPython(build_content_access, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0027_contentaccess'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileexercisetestcommand',
+            name='deterministic',
+            field=models.BooleanField(default=True, help_text="The command gives the same output every time it's run with the reference files, so the reference results can be reused. Uncheck for commands with random or time dependent output.", verbose_name='Deterministic output'),
+        ),
+    ]
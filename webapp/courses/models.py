@@ -13,10 +13,10 @@ from html import escape
 from django.conf import settings
 from django.core import serializers
 from django.core.files.base import ContentFile
-from django.db import models, transaction
+from django.db import connection, models, transaction
 from django.db.models import Q, Max, JSONField
 from django.contrib.auth.models import User, Group
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.urls import reverse
 from django.core.cache import cache
 from django.template import loader
@@ -29,6 +29,7 @@ import django.conf
 
 from model_utils.managers import InheritanceManager
 from reversion.models import Version
+from reversion.signals import post_revision_commit
 
 import pygments
 import magic
@@ -49,6 +50,15 @@ from utils.files import (
     upload_storage,
 )
 from utils.archive import get_archived_field, get_single_archived
+from utils.cache import (
+    bump_generation,
+    cached_render,
+    delete_rendered,
+    pack,
+    refresh_render,
+    store_rendered,
+    unpack,
+)
 from utils.management import (
     ExportImportMixin,
     freeze_context_link,
@@ -351,6 +361,95 @@ class CourseEnrollment(models.Model):
         return enrollments
 
 
+def clear_enrollment_access_cache(sender, instance, **kwargs):
+    from utils.access import clear_access_cache
+
+    clear_access_cache(instance.student_id, instance.instance_id)
+
+
+post_save.connect(
+    clear_enrollment_access_cache,
+    sender=CourseEnrollment,
+    dispatch_uid="clear_enrollment_access_cache_save",
+)
+post_delete.connect(
+    clear_enrollment_access_cache,
+    sender=CourseEnrollment,
+    dispatch_uid="clear_enrollment_access_cache_delete",
+)
+
+
+def store_previous_course_staff(sender, instance, **kwargs):
+    instance._previous_staff = None
+    if instance.pk is not None:
+        instance._previous_staff = (
+            Course.objects.filter(pk=instance.pk)
+            .values_list("main_responsible_id", "staff_group_id")
+            .first()
+        )
+
+
+def clear_course_staff_access_cache(sender, instance, created, **kwargs):
+    from utils.access import clear_course_access_cache
+
+    previous = getattr(instance, "_previous_staff", None) or (None, None)
+    current = (instance.main_responsible_id, instance.staff_group_id)
+    if created or previous == current:
+        return
+
+    user_ids = {previous[0], current[0]} - {None}
+    group_ids = {previous[1], current[1]} - {None}
+    user_ids.update(
+        User.objects.filter(groups__in=group_ids).values_list("id", flat=True)
+    )
+    instance_ids = list(instance.courseinstance_set.values_list("id", flat=True))
+    clear_course_access_cache(user_ids, instance_ids)
+
+
+def clear_group_access_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    from utils.access import clear_course_access_cache
+
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+
+    if reverse:
+        group_ids = [instance.pk]
+        if pk_set is None:
+            user_ids = list(instance.user_set.values_list("id", flat=True))
+        else:
+            user_ids = list(pk_set)
+    else:
+        user_ids = [instance.pk]
+        if pk_set is None:
+            group_ids = list(instance.groups.values_list("id", flat=True))
+        else:
+            group_ids = list(pk_set)
+
+    instance_ids = list(
+        CourseInstance.objects.filter(course__staff_group_id__in=group_ids).values_list(
+            "id", flat=True
+        )
+    )
+    clear_course_access_cache(user_ids, instance_ids)
+
+
+pre_save.connect(
+    store_previous_course_staff,
+    sender=Course,
+    dispatch_uid="store_previous_course_staff",
+)
+post_save.connect(
+    clear_course_staff_access_cache,
+    sender=Course,
+    dispatch_uid="clear_course_staff_access_cache",
+)
+m2m_changed.connect(
+    clear_group_access_cache,
+    sender=User.groups.through,
+    dispatch_uid="clear_group_access_cache",
+)
+
+
 class CourseInstance(models.Model):
     """
     A running instance of a course. Contains details about the start and end
@@ -414,13 +513,11 @@ class CourseInstance(models.Model):
         return get_prefixed_slug(self, self.course, "name")
 
     def user_enroll_status(self, user):
+        from utils.access import get_course_access
+
         if not user.is_active:
             return None
-        try:
-            status = self.courseenrollment_set.get(student=user).enrollment_state
-            return status
-        except CourseEnrollment.DoesNotExist as e:
-            return None
+        return get_course_access(user, self)["enrollment"]
 
     def save(self, *args, **kwargs):
         self.slug = self.get_url_name()
@@ -447,16 +544,17 @@ class CourseInstance(models.Model):
         if staff:
             cache_key += "_staff"
 
-        cached_tree = cache.get(cache_key)
-        if cached_tree:
-            return cached_tree
+        tree = cached_render(cache_key, self, "tree", lambda generation: self._build_tree(staff))
+        translation.activate(current_lang)
+        return tree
 
+    def _build_tree(self, staff):
         if staff:
             nodes = ContentGraph.objects.filter(instance=self, ordinal_number__gt=0)
         else:
             nodes = ContentGraph.objects.filter(instance=self, ordinal_number__gt=0, visible=True)
 
-        nodes = nodes.select_related("parentnode", "content").defer("content__content")
+        nodes = nodes.select_related("content").defer("content__content")
         embed_links = (
             EmbeddedLink.objects.filter(instance=self)
             .select_related("embedded_page")
@@ -474,18 +572,10 @@ class CourseInstance(models.Model):
                     (link.embedded_page_id, link.embedded_page.default_points)
                 ]
 
-        nodes = list(nodes.order_by("parentnode"))
-        ordered = []
-        for node in nodes:
-            ordinals = [node.ordinal_number]
-            parent_node = node.parentnode
-            while parent_node is not None:
-                ordinals.insert(0, parent_node.ordinal_number)
-                parent_node = parent_node.parentnode
-
-            ordered.append((ordinals, node))
-
-        ordered.sort()
+        paths = ContentGraph.objects.ordinal_paths(self)
+        ordered = sorted(
+            ((paths[node.id], node) for node in nodes), key=operator.itemgetter(0)
+        )
         tree = []
         level = 0
         for ordinals, node in ordered:
@@ -526,20 +616,13 @@ class CourseInstance(models.Model):
             tree.append({"content": mark_safe("<")})
             level -= 1
 
-        cache.set(cache_key, tree, timeout=None)
-
-        if lang_code is not None:
-            translation.activate(current_lang)
-
         return tree
 
     def clear_content_tree_cache(self, regen_frozen=False):
         if self.frozen and not regen_frozen:
             return
 
-        for lang_code, _ in settings.LANGUAGES:
-            cache.delete(f"{self.slug}_tree_{lang_code}")
-            cache.delete(f"{self.slug}_tree_{lang_code}_staff")
+        bump_generation(self, "tree")
 
     def freeze(self, freeze_to=None):
         """
@@ -549,6 +632,12 @@ class CourseInstance(models.Model):
         are also updated in a similar way.
         """
 
+        # Rendered content of the unfrozen pages is marked stale once the freeze
+        # has been committed, so that it isn't rendered again from the rows of
+        # the unfrozen instance, and regenerated in the background after that.
+        from utils.regeneration import invalidate_instance_cache, schedule_regeneration
+
+        transaction.on_commit(lambda: invalidate_instance_cache(self))
         contents = ContentGraph.objects.filter(instance=self)
 
         for content_link in contents:
@@ -584,9 +673,9 @@ class CourseInstance(models.Model):
             link.freeze(freeze_to)
 
         contents = ContentGraph.objects.filter(instance=self)
+        transaction.on_commit(lambda: schedule_regeneration(self))
         frontpage = None
         for content_link in contents:
-            content_link.content.regenerate_cache(self)
             if content_link.ordinal_number == 0:
                 frontpage = content_link.content
 
@@ -681,6 +770,36 @@ class ContextLinkManager(models.Manager):
         return self.get(instance__slug=instance_slug, content__slug=content_slug)
 
 
+class ContentGraphManager(ContextLinkManager):
+
+    def ordinal_paths(self, instance):
+        """
+        Returns the ordinal path of each node in the course instance as a dictionary of node ids
+        and lists of ordinal numbers from the top level node down to the node itself. Sorting
+        nodes by their paths puts them in the order of the content tree. The paths are built with
+        one recursive query instead of following the parent node links one node at a time.
+        """
+
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH RECURSIVE ancestry(node_id, parent_id, path) AS (
+                    SELECT id, parentnode_id, ARRAY[ordinal_number::integer]
+                    FROM {table}
+                    WHERE instance_id = %s
+                  UNION ALL
+                    SELECT ancestry.node_id, parent.parentnode_id,
+                           parent.ordinal_number::integer || ancestry.path
+                    FROM ancestry JOIN {table} parent ON parent.id = ancestry.parent_id
+                )
+                SELECT node_id, path FROM ancestry WHERE parent_id IS NULL
+                """,
+                [instance.id],
+            )
+            return dict(cursor.fetchall())
+
+
 class ContentGraph(models.Model):
     """A node in the course tree/graph. Links content into a course."""
 
@@ -689,7 +808,7 @@ class ContentGraph(models.Model):
         verbose_name = "content to course link"
         verbose_name_plural = "content to course links"
 
-    objects = ContextLinkManager()
+    objects = ContentGraphManager()
 
     parentnode = models.ForeignKey("self", null=True, blank=True, on_delete=models.SET_NULL)
     content = models.ForeignKey("ContentPage", null=True, blank=True, on_delete=models.RESTRICT)
@@ -1184,6 +1303,141 @@ class EmbeddedLink(models.Model, ExportImportMixin):
         self.instance = instance
 
 
+class ContentAccess(models.Model):
+    """
+    Index of the staff access to content pages. A row either links a page to a course whose
+    staff can access it, directly or through a page that embeds it, or to a user who has edited
+    the page. The index is maintained by the signal handlers below and used by
+    utils.access.determine_access and CourseContentAdmin.content_access_list.
+    """
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["content", "course"],
+                condition=Q(course__isnull=False),
+                name="unique_content_access_course",
+            ),
+            models.UniqueConstraint(
+                fields=["content", "author"],
+                condition=Q(author__isnull=False),
+                name="unique_content_access_author",
+            ),
+        ]
+
+    content = models.ForeignKey("ContentPage", on_delete=models.CASCADE)
+    course = models.ForeignKey("Course", null=True, on_delete=models.CASCADE)
+    author = models.ForeignKey(User, null=True, on_delete=models.CASCADE)
+
+
+def _update_page_access(content_ids):
+    from utils.access import update_content_access
+
+    content_ids = set(content_ids) - {None}
+    embedded_ids = EmbeddedLink.objects.filter(parent_id__in=content_ids).values_list(
+        "embedded_page_id", flat=True
+    )
+    update_content_access([*content_ids, *embedded_ids])
+
+
+def store_previous_node_content(sender, instance, **kwargs):
+    instance._previous_content_id = None
+    if instance.pk is not None:
+        instance._previous_content_id = (
+            ContentGraph.objects.filter(pk=instance.pk).values_list("content_id", flat=True).first()
+        )
+
+
+def update_node_access(sender, instance, **kwargs):
+    # The page that the node linked to before also loses access from this course
+    _update_page_access([instance.content_id, getattr(instance, "_previous_content_id", None)])
+
+
+def clear_node_content_cache(sender, instance, **kwargs):
+    try:
+        page, course_instance = instance.content, instance.instance
+    except (ContentPage.DoesNotExist, CourseInstance.DoesNotExist):
+        return
+    page.clear_rendered_content(course_instance)
+
+
+def store_previous_embedded_page(sender, instance, **kwargs):
+    instance._previous_embedded_page_id = None
+    if instance.pk is not None:
+        instance._previous_embedded_page_id = (
+            EmbeddedLink.objects.filter(pk=instance.pk)
+            .values_list("embedded_page_id", flat=True)
+            .first()
+        )
+
+
+def update_embedded_access(sender, instance, **kwargs):
+    from utils.access import update_content_access
+
+    content_ids = {
+        instance.embedded_page_id, getattr(instance, "_previous_embedded_page_id", None)
+    }
+    update_content_access(content_ids - {None})
+
+
+def store_previous_instance_course(sender, instance, **kwargs):
+    instance._previous_course_id = None
+    if instance.pk is not None:
+        instance._previous_course_id = (
+            CourseInstance.objects.filter(pk=instance.pk)
+            .values_list("course_id", flat=True)
+            .first()
+        )
+
+
+def update_instance_access(sender, instance, created, **kwargs):
+    previous_course_id = getattr(instance, "_previous_course_id", None)
+    if created or previous_course_id in (None, instance.course_id):
+        return
+
+    _update_page_access(
+        ContentGraph.objects.filter(instance=instance).values_list("content_id", flat=True)
+    )
+
+
+def add_revision_authors(sender, revision, versions, **kwargs):
+    from utils.access import add_content_authors
+
+    add_content_authors(revision, versions)
+
+
+pre_save.connect(
+    store_previous_node_content, sender=ContentGraph, dispatch_uid="store_previous_node_content"
+)
+post_save.connect(update_node_access, sender=ContentGraph, dispatch_uid="update_node_access_save")
+post_delete.connect(
+    update_node_access, sender=ContentGraph, dispatch_uid="update_node_access_delete"
+)
+post_delete.connect(
+    clear_node_content_cache, sender=ContentGraph, dispatch_uid="clear_node_content_cache"
+)
+pre_save.connect(
+    store_previous_embedded_page,
+    sender=EmbeddedLink,
+    dispatch_uid="store_previous_embedded_page",
+)
+post_save.connect(
+    update_embedded_access, sender=EmbeddedLink, dispatch_uid="update_embedded_access_save"
+)
+post_delete.connect(
+    update_embedded_access, sender=EmbeddedLink, dispatch_uid="update_embedded_access_delete"
+)
+pre_save.connect(
+    store_previous_instance_course,
+    sender=CourseInstance,
+    dispatch_uid="store_previous_instance_course",
+)
+post_save.connect(
+    update_instance_access, sender=CourseInstance, dispatch_uid="update_instance_access"
+)
+post_revision_commit.connect(add_revision_authors, dispatch_uid="add_revision_authors")
+
+
 class ContentPage(models.Model, ExportImportMixin):
     """
     This class determines the base for all content in Lovelace. All pages that can be displayed
@@ -1337,7 +1591,10 @@ class ContentPage(models.Model, ExportImportMixin):
         setattr(self, field, "\n".join(lines))
         self.save()
 
-    def rendered_markup(self, request=None, context=None, revision=None, lang_code=None, page=None):
+    def rendered_markup(
+        self, request=None, context=None, revision=None, lang_code=None, page=None,
+        incremental=False, refresh=False
+    ):
         """
         Uses the included MarkupParser library to render the page content into
         a data format that can be used by templates and safely cached. If a rendered version
@@ -1345,38 +1602,55 @@ class ContentPage(models.Model, ExportImportMixin):
         paginated and full versions of the content, but only returns the requested markup (either
         1 page or full content).
 
+        Cached content that is older than the instance's content generation is rendered again
+        by one request while others are still served the older version. If refresh is set to
+        True, the content is rendered again even if the cached version is current.
+
+        The rendered blocks are also cached individually. If incremental is set to True, blocks
+        whose markup has not changed since the previous render are taken from this cache instead
+        of rendering them again.
+
         This version of rendering is only used for top-level pages.
         """
 
         # This import needs to be here until circular import issues are fully sorted out.
         # from courses import markupparser
 
-        parser = markupparser.MarkupParser()
-
-        blocks = []
-        embedded_pages = []
         instance = context["instance"]
 
         if lang_code is None:
             lang_code = translation.get_language()
 
-        # Check cache
+        content_key = f"{self.slug}_contents_{instance.slug}_{lang_code}"
         if page is not None:
-            cached_content = cache.get(f"{self.slug}_contents_{instance.slug}_{lang_code}_{page}")
+            requested_key = f"{content_key}_{page}"
         else:
-            cached_content = cache.get(f"{self.slug}_contents_{instance.slug}_{lang_code}")
+            requested_key = content_key
+
+        def render(generation):
+            parser = markupparser.MarkupParser()
+            blocks = []
+            embedded_pages = []
 
-        if cached_content is None:
             if revision is None:
                 content = self.content
             else:
                 content = get_single_archived(self, revision).content
 
+            blocks_key = self._blocks_key(instance, lang_code)
+            previous_blocks = None
+            if incremental:
+                cached_blocks = unpack(cache.get(blocks_key))
+                if cached_blocks is not None and cached_blocks[0] == revision:
+                    previous_blocks = cached_blocks[1]
+            block_cache = markupparser.BlockCache(previous_blocks)
+
             # Render the page
             context["content"] = self
             context["lang_code"] = lang_code
-            markup_gen = parser.parse(content, request, context, embedded_pages)
-            segment = ""
+            markup_gen = parser.parse(
+                content, request, context, embedded_pages, block_cache=block_cache
+            )
             pages = []
             for chunk in markup_gen:
                 if chunk[0] == "pagebreak":
@@ -1387,26 +1661,36 @@ class ContentPage(models.Model, ExportImportMixin):
 
             pages.append(blocks)
 
+            rendered = {}
             if len(pages) > 1:
                 for i, blocks in enumerate(pages, start=1):
-                    cache.set(
-                        f"{self.slug}_contents_{instance.slug}_{lang_code}_{i}",
-                        blocks,
-                        timeout=None,
-                    )
+                    rendered[f"{content_key}_{i}"] = blocks
 
             full = [block for page in pages for block in page]
+            rendered[content_key] = full
+
+            # The requested key is stored by the caller
+            content_keys_key = self._content_keys_key(instance, lang_code)
+            previous_keys = cache.get(content_keys_key, [])
+            store_rendered(
+                {key: blocks for key, blocks in rendered.items() if key != requested_key},
+                generation,
+            )
+            cache.set(content_keys_key, list(rendered), timeout=None)
+            delete_rendered([key for key in previous_keys if key not in rendered])
             cache.set(
-                f"{self.slug}_contents_{instance.slug}_{lang_code}",
-                full,
-                timeout=None,
+                blocks_key,
+                pack(revision, block_cache.blocks),
+                timeout=getattr(settings, "BLOCK_CACHE_TIMEOUT", 60 * 60 * 24 * 7),
             )
 
             if page is not None:
                 return pages[page - 1]
             return full
 
-        return cached_content
+        if refresh:
+            return refresh_render(requested_key, instance, "content", render)
+        return cached_render(requested_key, instance, "content", render)
 
     def _get_rendered_content(self, context):
         """
@@ -1444,15 +1728,42 @@ class ContentPage(models.Model, ExportImportMixin):
         question = blockparser.parseblock(escape(self.question, quote=False), context)
         return question
 
+    def _content_keys_key(self, instance, lang_code):
+        """
+        Returns the cache key of the list of cache keys that the rendered content of the page
+        has been stored to. The list is written by rendered_markup, and it is used for counting
+        pages and deleting the rendered content without scanning the cache for keys.
+        """
+
+        return f"{self.slug}_contentkeys_{instance.slug}_{lang_code}"
+
+    def _blocks_key(self, instance, lang_code):
+        """
+        Returns the cache key of the rendered blocks of the page that incremental rendering
+        reuses.
+        """
+
+        return f"{self.slug}_blocks_{instance.slug}_{lang_code}"
+
+    def clear_rendered_content(self, instance):
+        """
+        Deletes the rendered content of the page in the given course instance from the cache in
+        all languages, together with the list of its keys and the rendered blocks.
+        """
+
+        for lang_code, __ in settings.LANGUAGES:
+            content_keys_key = self._content_keys_key(instance, lang_code)
+            delete_rendered(cache.get(content_keys_key, []))
+            cache.delete_many([content_keys_key, self._blocks_key(instance, lang_code)])
+
     def count_pages(self, instance):
         """
-        Counts the number of pages the content has been paginated to. Uses cache keys to avoid
-        needing to read the content for page breaks.
+        Counts the number of pages the content has been paginated to. Uses the cached list of
+        rendered content keys to avoid needing to read the content for page breaks.
         """
 
         lang_code = translation.get_language()
-        content_key = f"{self.slug}_contents_{instance.slug}_{lang_code}"
-        keys = cache.keys(content_key + "*")
+        keys = cache.get(self._content_keys_key(instance, lang_code), [])
 
         # Return -1 because the full page is cached separately.
         return len(keys) - 1
@@ -1538,10 +1849,15 @@ class ContentPage(models.Model, ExportImportMixin):
                 link_obj.save()
                 link_obj.embedded_page.update_embedded_links(instance)
 
-    def regenerate_cache(self, instance, active_only=False):
+    def regenerate_cache(self, instance, active_only=False, incremental=False, lang_codes=None):
         """
         Forcibly regenerates content page's cache for the given course instance. If active_only
-        is set to true, the process will be skipped if the page is archived.
+        is set to true, the process will be skipped if the page is archived. If incremental is
+        set to true, only blocks that have changed since the previous render are rendered again.
+        This should only be used after editing the page's markup, because blocks are not
+        rendered again when the data they refer to changes. If lang_codes is given, only the
+        cache of those languages is regenerated. The previous content is served to other
+        requests until the new content has been stored.
         """
 
         context = {"instance": instance, "course": instance.course, "content_page": self}
@@ -1553,19 +1869,21 @@ class ContentPage(models.Model, ExportImportMixin):
         if active_only and revision is not None:
             return
 
+        if lang_codes is None:
+            lang_codes = [lang_code for lang_code, _ in settings.LANGUAGES]
+
         current_lang = translation.get_language()
 
-        for lang_code, _ in settings.LANGUAGES:
+        for lang_code in lang_codes:
             translation.activate(lang_code)
-            content_key = f"{self.slug}_contents_{instance.slug}_{lang_code}"
-            for key in cache.keys(content_key + "*"):
-                cache.delete(key)
-
-            self.rendered_markup(instance, context, lang_code=lang_code, revision=revision)
+            self.rendered_markup(
+                instance, context, lang_code=lang_code, revision=revision,
+                incremental=incremental, refresh=True
+            )
         translation.activate(current_lang)
 
         from faq.utils import regenerate_cache
-        regenerate_cache(instance, self)
+        regenerate_cache(instance, self, lang_codes)
 
     def get_human_readable_type(self):
         humanized_type = self.content_type.replace("_", " ").lower()
@@ -2849,6 +3167,15 @@ class FileExerciseTestCommand(models.Model, ExportImportMixin):
         default=False,
         help_text="The checker provides test results as JSON",
     )
+    deterministic = models.BooleanField(
+        verbose_name="Deterministic output",
+        default=True,
+        help_text=(
+            "The command gives the same output every time it's run with the reference files,"
+            " so the reference results can be reused. Uncheck for commands with random or"
+            " time dependent output."
+        ),
+    )
     timeout = models.DurationField(
         default=default_fue_timeout,
         help_text="How long is the command allowed to run before termination?",
@@ -71,6 +71,11 @@ from utils.management import (
     clone_content_graphs,
     clone_grades,
 )
+from utils.regeneration import (
+    regeneration_progress,
+    regeneration_running,
+    schedule_regeneration,
+)
 from faq.utils import clone_faq_links
 from assessment.utils import clone_assessment_links
 
@@ -255,13 +260,27 @@ def regen_instance_cache(request, course, instance):
             errors = form.errors.as_json()
             return JsonResponse({"errors": errors}, status=400)
 
+        progress_url = reverse(
+            "courses:regen_instance_cache_progress",
+            kwargs={"course": course, "instance": instance},
+        )
+        if regeneration_running(instance):
+            return JsonResponse({
+                "status": "running",
+                "status_string": _("Regeneration is already running"),
+                "progress": progress_url,
+            })
+
         nodes = ContentGraph.objects.filter(instance=instance)
         if not form.cleaned_data["regen_archived"]:
             nodes = nodes.filter(revision=None)
-        for node in nodes:
-            node.content.regenerate_cache(instance)
+        schedule_regeneration(instance, nodes)
         instance.clear_content_tree_cache()
-        return JsonResponse({"status": "ok"})
+        return JsonResponse({
+            "status": "ok",
+            "status_string": _("Regeneration started"),
+            "progress": progress_url,
+        })
 
     form = CacheRegenForm()
     form_t = loader.get_template("courses/base-edit-form.html")
@@ -272,11 +291,28 @@ def regen_instance_cache(request, course, instance):
         "html_class": "toc-form staff-only",
         "disclaimer": _("Regenerate cache for all pages in the course. Please use sparingly."),
         "submit_label": _("Execute"),
-        "submit_override": "toc.submit_form",
+        "submit_override": "toc.submit_regen_form",
     }
     return HttpResponse(form_t.render(form_c, request))
 
 
+@ensure_responsible
+def regen_instance_cache_progress(request, course, instance):
+    progress = regeneration_progress(instance)
+    running = regeneration_running(instance)
+    if progress is None or running:
+        status_string = ""
+    elif progress["failed"]:
+        status_string = _("Regeneration finished, %(failed)d of %(total)d pages failed") % progress
+    else:
+        status_string = _("Regeneration finished")
+    return JsonResponse({
+        "metadata": progress,
+        "running": running,
+        "status_string": status_string,
+    })
+
+
 @ensure_staff
 def termify(request, course, instance):
     terms = Term.objects.filter(course=course)
@@ -697,7 +733,7 @@ def edit_form(request, course, instance, content, action):
             save_form(form)
             place_into_content(content, form)
             reversion.set_user(request.user)
-        regenerate_nearest_cache(content)
+        regenerate_nearest_cache(content, incremental=True)
         instance.clear_content_tree_cache()
         squash_revisions(content, 1)
         return JsonResponse({"status": "ok"})
@@ -261,6 +261,21 @@ function hide_tooltip (div_id) {
     desc_div.hide()
 }
 
+function load_termbank (placeholder) {
+    if (placeholder.length === 0) {
+        return
+    }
+    $.get(placeholder.attr("data-url"), function (html) {
+        const termbank = $("<div>").html(html)
+        placeholder.replaceWith(termbank.children("#termbank"))
+        $("#term-descriptions").append(termbank.find("div.term-description"))
+        filter_termbank_contents($("#termbank-search").val() || "")
+        $("#termbank-contents > div.list-div").slimScroll({
+            height: "400px"
+        })
+    })
+}
+
 function filter_termbank_contents (search_str) {
     $("li.term-list-item").each(function () {
         if ($(this).find("span.term").text().toLowerCase().indexOf(search_str.toLowerCase()) > -1 ||
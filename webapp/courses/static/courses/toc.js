@@ -56,6 +56,52 @@ const toc = {
         submit_ajax_form(form, process_success)
     },
 
+    submit_regen_form: function (event) {
+        event.preventDefault()
+        const form = $(this)
+
+        process_success = function (data) {
+            form.find("input[type='submit']").prop("disabled", true)
+            toc.poll_regen_progress(form, data.progress)
+        }
+
+        submit_ajax_form(form, process_success)
+    },
+
+    poll_regen_progress: function (form, url) {
+        $.ajax({
+            type: "GET",
+            url,
+            success: function (data, status, jqxhr) {
+                let progress_div = form.children("div.regen-progress")
+                if (!progress_div.length) {
+                    progress_div = $("<div class='regen-progress'></div>")
+                    form.append(progress_div)
+                }
+
+                if (data.metadata) {
+                    const current = data.metadata.current
+                    const total = data.metadata.total
+                    progress_div.html("<progress value=\"" + current + "\" max=\"" + total +
+                                      "\" title=\"" + current + "/" + total + "\">" + current +
+                                      "/" + total + "</progress>")
+                }
+
+                if (data.running) {
+                    setTimeout(function () {
+                        toc.poll_regen_progress(form, url)
+                    }, 1000)
+                } else {
+                    progress_div.append($("<span></span>").text(data.status_string))
+                    form.find("input[type='submit']").prop("disabled", false)
+                }
+            },
+            error: function (jqxhr, status, type) {
+                form.find("input[type='submit']").prop("disabled", false)
+            }
+        })
+    },
+
     remove_node: function (event, caller, node_id) {
         event.preventDefault()
         event.stopPropagation()
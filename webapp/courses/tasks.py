@@ -5,6 +5,8 @@ replace exercises.
 from __future__ import absolute_import
 
 import base64
+import concurrent.futures
+import hashlib
 import json
 import logging
 import os
@@ -31,7 +33,8 @@ from prettydiff import difflib
 from courses import models as cm
 from courses import evaluation_sec as sec
 from courses.evaluation_utils import *
-from utils.files import chmod_parse
+from utils.files import CheckerFileMissing, chmod_parse, get_checker_cache, get_checker_file
+from utils.regeneration import finish_regeneration, run_regeneration_job
 
 
 JSON_INCORRECT = 0
@@ -78,17 +81,41 @@ def run_tests(self, payload):
     reference_results = {}
 
     # Run all the tests for both the returned and reference code
-    for i, test in enumerate(tests):
-        self.update_state(state="PROGRESS", meta={"current": i, "total": len(tests)})
-
-        results, all_json = run_test(test, resources, student=True)
-        student_results.update(results)
-
-        if not all_json:
-            results, all_json = run_test(test, resources)
-
-        # if reference is not needed just put the student results there
-        reference_results.update(results)
+    parallelism = get_test_parallelism()
+    try:
+        if parallelism > 1:
+            student_results, reference_results = run_tests_concurrently(
+                self, tests, resources, parallelism
+            )
+        else:
+            # Reference runs are finished before student code is run, like in
+            # run_tests_concurrently, so that their results can be cached
+            reference_runs = [
+                run_reference_test(test, resources, cache_results=True)
+                if needs_reference(test) else None
+                for test in tests
+            ]
+            for i, (test, reference_run) in enumerate(zip(tests, reference_runs)):
+                self.update_state(state="PROGRESS", meta={"current": i, "total": len(tests)})
+
+                results, all_json = run_test(test, resources, student=True)
+                student_results.update(results)
+
+                if not all_json:
+                    if reference_run is None:
+                        reference_run = run_reference_test(test, resources)
+                    results, all_json = reference_run
+
+                # if reference is not needed just put the student results there
+                reference_results.update(results)
+    except CheckerFileMissing as e:
+        # The answer is sent again with the contents of the checker files
+        logger.warning(str(e))
+        return {
+            "task": "check",
+            "status": "missing_files",
+            "data": {"missing": [e.digest]},
+        }
 
     results = {"student": student_results, "reference": reference_results}
     evaluation = generate_results(results)
@@ -104,6 +131,155 @@ def run_tests(self, payload):
     }
 
 
+def get_test_parallelism():
+    """
+    Gets the number of tests of one submission to run at the same time. At
+    most one test is run per available CPU, so that tests that are run at the
+    same time don't slow each other down into their wall-clock timeouts.
+    """
+
+    parallelism = getattr(django_settings, "CHECKER_TEST_PARALLELISM", 1)
+    return max(1, min(parallelism, len(os.sched_getaffinity(0))))
+
+
+def needs_reference(test):
+    """
+    Tells whether the reference code may need to be run for a test, i.e. if
+    any of its commands has output that is compared to the reference output.
+    """
+
+    return any(
+        not command["json_output"]
+        for stage in test["stages"]
+        for command in stage["commands"]
+    )
+
+
+def run_tests_concurrently(task, tests, resources, parallelism):
+    """
+    Runs the tests of a payload in a pool of threads, at most parallelism
+    tests at a time. The reference runs of the tests that need one are run
+    first, and the student runs are only started after all of them have
+    finished, so that reference code and its files are never exposed to
+    student code that is run as the same user. A reference result is only
+    used if the student run had output that wasn't JSON. Each run has its own
+    test directory, and the results are merged in the same order as when the
+    tests are run one by one. Commands are demoted after exec with
+    get_demoted_args, since running Python code between fork and exec isn't
+    safe in threads.
+    """
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallelism) as executor:
+        reference_runs = [
+            executor.submit(run_reference_test, test, resources, cache_results=True)
+            if needs_reference(test) else None
+            for test in tests
+        ]
+        reference_runs = [
+            None if reference_run is None else reference_run.result()
+            for reference_run in reference_runs
+        ]
+
+        student_runs = [
+            executor.submit(run_test, test, resources, student=True) for test in tests
+        ]
+        for i, __ in enumerate(concurrent.futures.as_completed(student_runs)):
+            task.update_state(state="PROGRESS", meta={"current": i, "total": len(tests)})
+
+        student_results = {}
+        reference_results = {}
+        for test, student_run, reference_run in zip(tests, student_runs, reference_runs):
+            results, all_json = student_run.result()
+            student_results.update(results)
+
+            if not all_json:
+                if reference_run is None:
+                    reference_run = run_reference_test(test, resources)
+                results, all_json = reference_run
+
+            # if reference is not needed just put the student results there
+            reference_results.update(results)
+
+    return student_results, reference_results
+
+
+def _reference_results_key(test, resources):
+    definition = {
+        "test": test,
+        "files": {
+            handle: {
+                key: value
+                for key, value in resources["checker_files"][handle].items()
+                if key != "contents"
+            }
+            for handle in test["required_files"]
+        },
+    }
+    digest = hashlib.sha256(json.dumps(definition, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"reference_results_{digest}"
+
+
+def is_deterministic(test):
+    """
+    Tells whether all commands of a test are marked deterministic, i.e. if
+    its reference results can be cached.
+    """
+
+    return all(
+        command.get("deterministic", False)
+        for stage in test["stages"]
+        for command in stage["commands"]
+    )
+
+
+def run_reference_test(test, resources, cache_results=False):
+    """
+    Runs a test with the reference files. If all commands of the test are
+    marked deterministic, the results are cached in the checker cache by a
+    hash of the test definition and the checker files it uses, and reused
+    until either of them changes. Results are only cached with cache_results,
+    which must only be given for runs that no student code was run alongside.
+    Runs that timed out or failed to start are not cached.
+    """
+
+    checker_cache = get_checker_cache()
+    if checker_cache is None or not is_deterministic(test):
+        return run_test(test, resources)
+
+    key = _reference_results_key(test, resources)
+    cached = checker_cache.get(key)
+    if cached is not None:
+        return cached
+
+    results, all_json = run_test(test, resources)
+    reusable = cache_results and not any(
+        command_results["timedout"] or command_results.get("error")
+        for stage_results in results[test["test_id"]]["stages"].values()
+        for command_results in stage_results["commands"].values()
+    )
+    if reusable:
+        checker_cache.set(
+            key,
+            (results, all_json),
+            timeout=getattr(django_settings, "REFERENCE_RESULT_TIMEOUT", 60 * 60 * 24 * 7),
+        )
+    return results, all_json
+
+
+@shared_task(name="courses.warm-reference-results")
+def warm_reference_results(plan):
+    """
+    Runs the reference files of a compiled test plan so that the results of
+    its deterministic tests are already cached when answers are checked.
+    Other tests are skipped, since their results would not be cached.
+    """
+
+    resources = {"files_to_check": {}, "checker_files": plan["checker_files"]}
+    for test in plan["tests"]:
+        if needs_reference(test) and is_deterministic(test):
+            run_reference_test(test, resources, cache_results=True)
+
+
 def generate_results(results):
     evaluation = {}
     correct = True
@@ -298,6 +474,18 @@ def generate_results(results):
     return evaluation
 
 
+def checker_file_contents(file_info):
+    """
+    Gets the contents of a checker file of the payload. The contents are only
+    included in the payload when an answer is sent again because the checker
+    file store had dropped some of its files.
+    """
+
+    if "contents" in file_info:
+        return base64.b64decode(file_info["contents"])
+    return get_checker_file(file_info["hash"])
+
+
 @shared_task(name="courses.run-test", bind=True)
 def run_test(self, test, resources, student=False):
     """
@@ -306,15 +494,19 @@ def run_test(self, test, resources, student=False):
 
     required_files = test["required_files"]
 
-    # Note: requires a shared/cloned file system!
+    # Student files are sent in the payload, checker files are referred to by
+    # their hash and read from the worker's checker file directory
     if student:
-        files_to_check = resources["files_to_check"]
+        files_to_check = {
+            name: base64.b64decode(contents)
+            for name, contents in resources["files_to_check"].items()
+        }
     else:
         files_to_check = {}
         for req_file_handle in required_files:
             file_info = resources["checker_files"][req_file_handle]
             if file_info["purpose"] == "REFERENCE":
-                files_to_check[file_info["name"]] = file_info["content"]
+                files_to_check[file_info["name"]] = checker_file_contents(file_info)
 
     temp_dir_prefix = os.path.join("/", "tmp")
 
@@ -323,10 +515,10 @@ def run_test(self, test, resources, student=False):
         os.chmod(test_dir, 0o777)
         # Write the files under test
         # Do this first to prevent overwriting of included/instance files
-        for name, contents in files_to_check.items():
+        for name, source in files_to_check.items():
             fpath = os.path.join(test_dir, name)
             with open(fpath, "wb") as fd:
-                fd.write(base64.b64decode(contents))
+                fd.write(source)
             logger.info(f"Wrote file under test {fpath}")
             os.chmod(fpath, 0o664)
 
@@ -338,7 +530,7 @@ def run_test(self, test, resources, student=False):
 
             fpath = os.path.join(test_dir, f_resource["name"])
             with open(fpath, "wb") as fd:
-                fd.write(base64.b64decode(f_resource["content"]))
+                fd.write(checker_file_contents(f_resource))
             logger.info(f"Wrote required exercise file {fpath} from {f_handle}")
             os.chmod(fpath, chmod_parse(f_resource["chmod"]))
 
@@ -470,7 +662,8 @@ def run_command(command, stdin, stdout, stderr, test_dir, files_to_check):
         .replace("$CWD", test_dir)
     )
     timeout = command["timeout"]
-    env = django_settings.CHECKING_ENV
+    # Copied because tests can be run concurrently in different directories
+    env = dict(django_settings.CHECKING_ENV)
     env["PWD"] = test_dir
 
     args = shlex.split(cmd)
@@ -488,19 +681,21 @@ def run_command(command, stdin, stdout, stderr, test_dir, files_to_check):
     }
     logger.info(f"Running: {shell_like_cmd}")
 
-    demote_process = sec.default_demote_process
+    # The restricted user's process limit is shared by the tests that are run
+    # at the same time, so it is raised to give each of them the usual amount
+    concurrent_processes = int(django_settings.WORKER_CONCURRENCY) * get_test_parallelism()
 
     start_rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
     start_time = time.time()
     try:
+        sec.check_executable(args[0], test_dir, env.get("PATH", os.defpath))
         proc = subprocess.Popen(
-            args=args,
+            args=sec.get_demoted_args(args, concurrent_processes=concurrent_processes),
             bufsize=-1,
             executable=None,
             stdin=stdin,
             stdout=stdout,
             stderr=stderr,  # Standard fds
-            preexec_fn=demote_process,  # Demote before fork
             start_new_session=True,
             close_fds=True,  # Don't inherit fds
             shell=False,  # Don't run in shell
@@ -778,6 +973,26 @@ def deploy_backend(self, course, instance, source_path, target_name, lang, exerc
         f.write(file_contents)
 
 
+@shared_task(name="courses.regenerate-content-cache")
+def regenerate_content_cache(instance_id, content_id, lang_code, embedded):
+    """
+    Regenerates the cached content of one page in one language. These tasks
+    are created by utils.regeneration.schedule_regeneration.
+    """
+
+    run_regeneration_job(instance_id, content_id, lang_code, embedded)
+
+
+@shared_task(name="courses.finish-regeneration")
+def finish_regeneration_task(instance_id):
+    """
+    Releases the regeneration of an instance when its Celery chain fails, so
+    that the instance can be regenerated again.
+    """
+
+    finish_regeneration(instance_id)
+
+
 def get_celery_worker_status():
     ERROR_KEY = "errors"
     try:
@@ -102,7 +102,9 @@ def preview_escape(block):
 @register.inclusion_tag("courses/embed-frame.html", takes_context=True)
 def embed_frame(context, content_data):
     page = context["embedded_pages"][content_data["slug"]]
-    if context["user"].is_active:
+    if content_data["slug"] in context.get("embedded_progress", {}):
+        answer_count, evaluation, quotient = context["embedded_progress"][content_data["slug"]]
+    elif context["user"].is_active:
         answer_count = page.get_user_answers(page, context["user"], context["instance"]).count()
         evaluation, quotient = page.get_user_evaluation(context["user"], context["instance"])
     else:
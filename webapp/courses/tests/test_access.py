@@ -0,0 +1,308 @@
+"""
+Tests for the cached course access checks and their invalidation, and for the
+content access index that staff permission checks use.
+"""
+
+from types import SimpleNamespace
+
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from reversion import revisions as reversion
+from reversion.models import Version
+
+import courses.models as cm
+import courses.tests.testhelpers as helpers
+from utils.access import (
+    determine_access,
+    ensure_enrolled_or_staff,
+    get_course_access,
+    is_course_staff,
+    is_enrolled,
+)
+from utils.management import CourseContentAdmin
+
+
+@ensure_enrolled_or_staff
+def enrolled_view(request, course, instance):
+    return HttpResponse("ok")
+
+
+@override_settings(ACCESS_CACHE_TIMEOUT=60)
+class CourseAccessTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.course, cls.instance = helpers.create_course_with_instance()
+        cls.staff_group = Group.objects.create(name="test staff")
+        cls.course.staff_group = cls.staff_group
+        cls.course.save()
+        cls.student = User.objects.create_user("student", is_active=True)
+        cls.teacher = User.objects.create_user("teacher", is_staff=True, is_active=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def _request_user(self, user):
+        # A fresh user object, like the one of a new request
+        return User.objects.get(id=user.id)
+
+    def _enroll(self, state="ACCEPTED"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return cm.CourseEnrollment.objects.create(
+                instance=self.instance, student=self.student, enrollment_state=state
+            )
+
+    def _get_view(self, user):
+        request = RequestFactory().get("/")
+        request.user = user
+        return enrolled_view(request, self.course, self.instance)
+
+    def test_get_course_access(self):
+        self._enroll("WAITING")
+        self.teacher.groups.add(self.staff_group)
+
+        self.assertEqual(
+            get_course_access(self._request_user(self.student), self.instance),
+            {"staff_group": False, "responsible": False, "enrollment": "WAITING"},
+        )
+        self.assertEqual(
+            get_course_access(self._request_user(self.teacher), self.instance),
+            {"staff_group": True, "responsible": False, "enrollment": None},
+        )
+
+        teacher = self._request_user(self.teacher)
+        other_request_teacher = self._request_user(self.teacher)
+        get_course_access(teacher, self.instance)
+        with self.assertNumQueries(0):
+            get_course_access(teacher, self.instance)
+            get_course_access(other_request_teacher, self.instance)
+
+    def test_enrollment_change_is_seen_in_same_request(self):
+        enrollment = self._enroll()
+        student = self._request_user(self.student)
+        self.assertTrue(is_enrolled(student, self.instance))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            enrollment.enrollment_state = "EXPELLED"
+            enrollment.save()
+
+        self.assertFalse(is_enrolled(student, self.instance))
+        self.assertEqual(self.instance.user_enroll_status(student), "EXPELLED")
+        self.assertFalse(is_enrolled(self._request_user(self.student), self.instance))
+
+    def test_enrollment_cache_cleared_on_commit(self):
+        enrollment = self._enroll()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            enrollment.enrollment_state = "EXPELLED"
+            enrollment.save()
+            # Another request caches the enrollment before the change is committed
+            cache.set(
+                f"{self.student.id}_{self.instance.id}_access",
+                {"staff_group": False, "responsible": False, "enrollment": "ACCEPTED"},
+            )
+
+        self.assertTrue(callbacks)
+        for callback in callbacks:
+            callback()
+        self.assertFalse(is_enrolled(self._request_user(self.student), self.instance))
+
+    def test_staff_group_changes(self):
+        teacher = self._request_user(self.teacher)
+        self.assertFalse(is_course_staff(teacher, self.instance))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.teacher.groups.add(self.staff_group)
+        self.assertTrue(is_course_staff(teacher, self.instance))
+        self.assertTrue(is_course_staff(self._request_user(self.teacher), self.instance))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.staff_group.user_set.remove(self.teacher)
+        self.assertFalse(is_course_staff(self._request_user(self.teacher), self.instance))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.staff_group.user_set.add(self.teacher)
+        self.assertTrue(is_course_staff(self._request_user(self.teacher), self.instance))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.teacher.groups.clear()
+        self.assertFalse(is_course_staff(self._request_user(self.teacher), self.instance))
+
+    def test_main_responsible_changes(self):
+        self.assertFalse(is_course_staff(self._request_user(self.teacher), self.instance, True))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.main_responsible = self.teacher
+            self.course.save()
+        self.assertTrue(is_course_staff(self._request_user(self.teacher), self.instance, True))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.main_responsible = None
+            self.course.save()
+        self.assertFalse(is_course_staff(self._request_user(self.teacher), self.instance, True))
+
+    def test_staff_group_replaced(self):
+        self.teacher.groups.add(self.staff_group)
+        self.assertTrue(is_course_staff(self._request_user(self.teacher), self.instance))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.staff_group = Group.objects.create(name="other staff")
+            self.course.save()
+        self.assertFalse(is_course_staff(self._request_user(self.teacher), self.instance))
+
+    def test_ensure_enrolled_or_staff(self):
+        self.assertEqual(self._get_view(self._request_user(self.student)).status_code, 403)
+        self.assertEqual(self._get_view(self._request_user(self.teacher)).status_code, 403)
+
+        self._enroll("WAITING")
+        self.assertEqual(self._get_view(self._request_user(self.student)).status_code, 403)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cm.CourseEnrollment.objects.filter(student=self.student).delete()
+        self._enroll()
+        self.assertEqual(self._get_view(self._request_user(self.student)).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.teacher.groups.add(self.staff_group)
+        self.assertEqual(self._get_view(self._request_user(self.teacher)).status_code, 200)
+
+
+def joined_access(user, content, responsible_only=False):
+    """
+    Access check with the joins that were used before the content access
+    index, used as the reference for the index.
+    """
+
+    if Version.objects.get_for_object(content).filter(revision__user=user).exists():
+        return True
+
+    courses = cm.Course.objects.filter(
+        Q(courseinstance__contentgraph__content=content)
+        | Q(courseinstance__contentgraph__content__embedded_pages=content)
+    )
+    if courses.filter(main_responsible=user).exists():
+        return True
+
+    return not responsible_only and courses.filter(staff_group__user=user).exists()
+
+
+def joined_access_list(user):
+    edited = (
+        Version.objects.get_for_model(cm.ContentPage)
+        .filter(revision__user=user)
+        .values_list("object_id", flat=True)
+    )
+    return cm.ContentPage.objects.filter(
+        Q(id__in=[int(object_id) for object_id in edited])
+        | Q(contentgraph__instance__course__staff_group__user=user)
+        | Q(emb_embedded__parent__contentgraph__instance__course__staff_group__user=user)
+        | Q(contentgraph__instance__course__main_responsible=user)
+        | Q(emb_embedded__parent__contentgraph__instance__course__main_responsible=user)
+    ).distinct()
+
+
+class ContentAccessIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.course_a, cls.instance_a = helpers.create_course_with_instance()
+        cls.course_b = cm.Course.objects.create(name="other course", prefix="oth")
+        cls.instance_b = cm.CourseInstance.objects.create(name="other", course=cls.course_b)
+
+        cls.users = []
+        for course in (cls.course_a, cls.course_b):
+            group = Group.objects.create(name=f"{course.name} staff")
+            member = User.objects.create_user(f"{course.prefix}-staff", is_staff=True)
+            member.groups.add(group)
+            responsible = User.objects.create_user(f"{course.prefix}-resp", is_staff=True)
+            course.staff_group = group
+            course.main_responsible = responsible
+            course.save()
+            cls.users.extend([member, responsible])
+
+        cls.author = User.objects.create_user("author", is_staff=True)
+        cls.users.append(cls.author)
+
+        cls.page = cm.Lecture.objects.create(name="access page", content="page")
+        cls.other_page = cm.Lecture.objects.create(name="other access page", content="other")
+        with reversion.create_revision():
+            cls.embedded = cm.Lecture.objects.create(name="embedded page", content="embedded")
+            reversion.set_user(cls.author)
+
+    def assertIndexMatchesJoins(self):
+        pages = [self.page, self.other_page, self.embedded]
+        for user in self.users:
+            for page in pages:
+                for responsible_only in (False, True):
+                    self.assertEqual(
+                        determine_access(user, page, responsible_only),
+                        joined_access(user, page, responsible_only),
+                        f"{user} {page} {responsible_only}",
+                    )
+
+            request = SimpleNamespace(user=user)
+            self.assertEqual(
+                set(CourseContentAdmin.content_access_list(request, cm.ContentPage)),
+                set(joined_access_list(user)),
+                str(user),
+            )
+
+    def test_link_reassign_and_unlink(self):
+        self.assertIndexMatchesJoins()
+
+        node = cm.ContentGraph.objects.create(
+            content=self.page, instance=self.instance_a, ordinal_number=1
+        )
+        cm.EmbeddedLink.objects.create(
+            parent=self.page, embedded_page=self.embedded, instance=self.instance_a,
+            ordinal_number=0,
+        )
+        self.assertTrue(determine_access(self.users[0], self.embedded))
+        self.assertIndexMatchesJoins()
+
+        node.content = self.other_page
+        node.save()
+        self.assertFalse(determine_access(self.users[0], self.page))
+        self.assertFalse(determine_access(self.users[0], self.embedded))
+        self.assertIndexMatchesJoins()
+
+        node.content = self.page
+        node.save()
+        self.assertIndexMatchesJoins()
+
+        node.delete()
+        self.assertIndexMatchesJoins()
+
+    def test_instance_moved_to_other_course(self):
+        cm.ContentGraph.objects.create(
+            content=self.page, instance=self.instance_a, ordinal_number=1
+        )
+        cm.EmbeddedLink.objects.create(
+            parent=self.page, embedded_page=self.embedded, instance=self.instance_a,
+            ordinal_number=0,
+        )
+        self.assertIndexMatchesJoins()
+
+        self.instance_a.course = self.course_b
+        self.instance_a.save()
+        self.assertFalse(determine_access(self.users[0], self.page))
+        self.assertTrue(determine_access(self.users[2], self.embedded))
+        self.assertIndexMatchesJoins()
+
+    def test_embedded_link_changed(self):
+        cm.ContentGraph.objects.create(
+            content=self.page, instance=self.instance_b, ordinal_number=1
+        )
+        link = cm.EmbeddedLink.objects.create(
+            parent=self.page, embedded_page=self.embedded, instance=self.instance_b,
+            ordinal_number=0,
+        )
+        self.assertIndexMatchesJoins()
+
+        link.embedded_page = self.other_page
+        link.save()
+        self.assertFalse(determine_access(self.users[2], self.embedded))
+        self.assertIndexMatchesJoins()
+
+        link.delete()
+        self.assertIndexMatchesJoins()
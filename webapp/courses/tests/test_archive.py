@@ -0,0 +1,113 @@
+"""
+Tests for getting archived object graphs from a revision without reverting the
+database.
+"""
+
+from django.test import TestCase
+from reversion import revisions as reversion
+from reversion.models import Version
+
+import courses.models as cm
+from routine_exercise.models import RoutineExercise, RoutineExerciseBackendCommand
+from utils.archive import get_archived_instances
+
+
+def latest_revision(obj):
+    return Version.objects.get_for_object(obj).latest("revision__date_created").revision_id
+
+
+class ArchivedInstancesTests(TestCase):
+    def _create_include_file(self, exercise, name):
+        file_settings = cm.IncludeFileSettings.objects.create(name=name, purpose="INPUT")
+        return cm.FileExerciseTestIncludeFile.objects.create(
+            exercise=exercise, file_settings=file_settings, default_name=name
+        )
+
+    def test_reverse_foreign_key_and_one_to_one(self):
+        routine = RoutineExercise.objects.create(name="archived routine", content="old content")
+        page = cm.ContentPage.objects.get(id=routine.id)
+        hint = cm.Hint.objects.create(exercise=page, hint="old hint")
+        command = RoutineExerciseBackendCommand.objects.create(
+            exercise=routine, command="python3 old.py"
+        )
+        with reversion.create_revision():
+            page.save()
+        revision = latest_revision(page)
+
+        page.content = "new content"
+        page.save()
+        hint.hint = "new hint"
+        hint.save()
+        cm.Hint.objects.create(exercise=page, hint="added hint")
+        command.command = "python3 new.py"
+        command.save()
+
+        archived = get_archived_instances(page, revision)
+        self.assertEqual(archived["self"].content, "old content")
+        self.assertEqual([h.hint for h in archived["hint_set"]], ["old hint"])
+        self.assertEqual(archived["routineexercisebackendcommand"].command, "python3 old.py")
+        self.assertEqual(archived["fileexercisetest_set"], [])
+
+        command.delete()
+        archived = get_archived_instances(page, revision)
+        self.assertEqual(archived["routineexercisebackendcommand"].command, "python3 old.py")
+
+    def test_missing_reverse_one_to_one(self):
+        page = cm.Lecture.objects.create(name="archived lecture", content="content")
+        with reversion.create_revision():
+            page.save()
+        revision = latest_revision(page)
+
+        RoutineExerciseBackendCommand.objects.create(exercise_id=page.id, command="python3 a.py")
+        page = cm.ContentPage.objects.get(id=page.id)
+        self.assertIsNone(get_archived_instances(page, revision)["routineexercisebackendcommand"])
+
+    def test_many_to_many_and_ordering(self):
+        exercise = cm.FileUploadExercise.objects.create(
+            name="archived exercise", content="content"
+        )
+        old_file = self._create_include_file(exercise, "old.txt")
+        new_file = self._create_include_file(exercise, "new.txt")
+        test = cm.FileExerciseTest.objects.create(exercise=exercise, name="archived test")
+        test.required_files.set([old_file])
+        for ordinal in (2, 3, 1):
+            cm.FileExerciseTestStage.objects.create(
+                test=test, name=f"stage {ordinal}", ordinal_number=ordinal
+            )
+        with reversion.create_revision():
+            test.save()
+            old_file.save()
+            new_file.save()
+        revision = latest_revision(test)
+
+        test.name = "renamed test"
+        test.save()
+        test.required_files.set([new_file])
+        old_file.default_name = "renamed.txt"
+        old_file.save()
+        stage = test.fileexerciseteststage_set.get(ordinal_number=1)
+        stage.name = "renamed stage"
+        stage.ordinal_number = 4
+        stage.save()
+        cm.FileExerciseTestStage.objects.create(test=test, name="added stage", ordinal_number=0)
+
+        archived = get_archived_instances(test, revision)
+        self.assertEqual(archived["self"].name, "archived test")
+        self.assertEqual(
+            [(f.id, f.default_name) for f in archived["required_files"]],
+            [(old_file.id, "old.txt")],
+        )
+        self.assertEqual(archived["required_instance_files"], [])
+        self.assertEqual(
+            [(s.ordinal_number, s.name) for s in archived["fileexerciseteststage_set"]],
+            [(1, "stage 1"), (2, "stage 2"), (3, "stage 3")],
+        )
+
+    def test_missing_version(self):
+        page = cm.Lecture.objects.create(name="unversioned lecture", content="content")
+        with reversion.create_revision():
+            other_page = cm.Lecture.objects.create(name="other lecture", content="content")
+        revision = latest_revision(other_page)
+
+        with self.assertRaises(Version.DoesNotExist):
+            get_archived_instances(cm.ContentPage.objects.get(id=page.id), revision)
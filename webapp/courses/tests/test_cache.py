@@ -0,0 +1,233 @@
+"""
+Tests for rendered content in the shared cache: generations, render locks and
+serving stale values.
+"""
+
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.utils import translation
+from django.utils.safestring import SafeString, mark_safe
+
+import courses.models as cm
+import courses.tests.testhelpers as helpers
+import utils.cache as shared
+from utils.cache import (
+    LRUCache,
+    bump_generation,
+    cached_render,
+    current_generation,
+    generation_key,
+    pack,
+    store_rendered,
+    unpack,
+)
+from utils.rendering import termbank_version
+
+
+class PackTests(SimpleTestCase):
+    def test_round_trip(self):
+        urls = {"page": "/page/", "answer": "/answer/"}
+        value = [
+            ("paragraph", mark_safe("<p>text</p>"), 0, 1),
+            ("paragraph", "<p>text</p>", 1, 1),
+            {"urls": urls, "same_urls": dict(urls), "safe": {key: mark_safe(url) for key, url in urls.items()}},
+            [None, 1, 2.5, ("nested", ["list"])],
+        ]
+        tag, unpacked = unpack(pack(12, value))
+        self.assertEqual(tag, 12)
+        self.assertEqual(unpacked, value)
+        self.assertIsInstance(unpacked[0][1], SafeString)
+        self.assertNotIsInstance(unpacked[1][1], SafeString)
+        self.assertIsInstance(unpacked[2]["safe"]["page"], SafeString)
+        self.assertNotIsInstance(unpacked[2]["urls"]["page"], SafeString)
+
+        unpacked[2]["urls"]["page"] = "/changed/"
+        self.assertEqual(unpacked[2]["same_urls"]["page"], "/page/")
+
+    def test_other_formats_are_missing(self):
+        packed = pack(1, "value")
+        self.assertIsNone(unpack(None))
+        self.assertIsNone(unpack("value"))
+        self.assertIsNone(unpack((shared.PACK_VERSION + 1, *packed[1:])))
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_least_recently_used_is_evicted(self):
+        lru = LRUCache(2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        self.assertEqual(lru.get("a"), 1)
+        lru.set("c", 3)
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual((lru.get("a"), lru.get("c"), len(lru)), (1, 3, 2))
+
+        lru.delete("a")
+        self.assertEqual(lru.get("a", "missing"), "missing")
+
+    def test_zero_size_keeps_nothing(self):
+        lru = LRUCache(0)
+        lru.set("a", 1)
+        self.assertEqual(len(lru), 0)
+
+
+class CachedRenderTests(SimpleTestCase):
+    key = "cache_test_rendered"
+
+    def setUp(self):
+        cache.clear()
+        shared._local_renders.clear()
+        self.instance = SimpleNamespace(slug="cache-test")
+        self.gen_key = generation_key(self.instance, "content")
+        self.renders = []
+
+    def _render(self, generation):
+        self.renders.append(generation)
+        return f"rendered {len(self.renders)}"
+
+    def _get(self):
+        return cached_render(self.key, self.instance, "content", self._render)
+
+    def test_value_is_rendered_once(self):
+        self.assertEqual(self._get(), "rendered 1")
+        self.assertEqual(self._get(), "rendered 1")
+        self.assertEqual(self.renders, [current_generation(self.gen_key)])
+
+    def test_bump_renders_again(self):
+        self._get()
+        bump_generation(self.instance, "content")
+        self.assertEqual(self._get(), "rendered 2")
+        self.assertEqual(self._get(), "rendered 2")
+
+    def test_stale_value_is_served_while_rendering(self):
+        self._get()
+        bump_generation(self.instance, "content")
+        cache.add(f"{self.key}_lock", 1)
+        self.assertEqual(self._get(), "rendered 1")
+        self.assertEqual(len(self.renders), 1)
+
+        cache.delete(f"{self.key}_lock")
+        self.assertEqual(self._get(), "rendered 2")
+
+    def test_evicted_generation_does_not_repeat(self):
+        self._get()
+        first = current_generation(self.gen_key)
+        bump_generation(self.instance, "content")
+        self._get()
+
+        cache.delete(self.gen_key)
+        shared._local_renders.clear()
+        self.assertEqual(self._get(), "rendered 3")
+        self.assertNotIn(current_generation(self.gen_key), (first, first + 1))
+
+        cache.delete(self.gen_key)
+        bump_generation(self.instance, "content")
+        self.assertEqual(self._get(), "rendered 4")
+
+    def test_local_copy_is_used_while_stamp_matches(self):
+        self._get()
+        with mock.patch.object(shared, "unpack") as unpack_mock:
+            self.assertEqual(self._get(), "rendered 1")
+        unpack_mock.assert_not_called()
+
+        # Another process stores a new value, which changes the stamp
+        local = shared._local_renders.get(self.key)
+        store_rendered({self.key: "rendered elsewhere"}, current_generation(self.gen_key))
+        shared._local_renders.set(self.key, local)
+        self.assertEqual(self._get(), "rendered elsewhere")
+        self.assertEqual(len(self.renders), 1)
+
+    def test_value_from_other_generation_is_not_current(self):
+        generation = current_generation(self.gen_key)
+        store_rendered({self.key: "newer"}, generation + 1)
+        self.assertEqual(self._get(), "rendered 1")
+
+    def test_waits_for_render_in_progress(self):
+        generation = current_generation(self.gen_key)
+        cache.add(f"{self.key}_lock", 1)
+
+        # The other request finishes rendering while this one waits
+        def finish_render(seconds):
+            store_rendered({self.key: "rendered elsewhere"}, generation)
+
+        with mock.patch("utils.cache.time.sleep", side_effect=finish_render):
+            self.assertEqual(self._get(), "rendered elsewhere")
+        self.assertEqual(self.renders, [])
+
+    def test_renders_when_wait_runs_out(self):
+        cache.add(f"{self.key}_lock", 1)
+        with mock.patch.object(shared, "RENDER_LOCK_WAIT", 0.2):
+            self.assertEqual(self._get(), "rendered 1")
+
+
+class FreezeGenerationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        __, cls.instance = helpers.create_course_with_instance()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_content_is_invalidated_on_commit(self):
+        gen_key = generation_key(self.instance, "content")
+        generation = current_generation(gen_key)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.instance.freeze()
+            self.instance.save()
+        self.assertEqual(current_generation(gen_key), generation)
+
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(current_generation(gen_key), generation)
+
+
+class PageContentCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        __, cls.instance = helpers.create_course_with_instance()
+        cls.page = helpers.create_plain_page()
+        helpers.add_content_graph(cls.page, cls.instance, 1)
+
+    def setUp(self):
+        cache.clear()
+        shared._local_renders.clear()
+
+    def test_removed_page_content_is_deleted(self):
+        context = {"instance": self.instance, "course": self.instance.course}
+        with translation.override("en"):
+            self.page.rendered_markup(None, context, lang_code="en")
+        content_keys = cache.get(self.page._content_keys_key(self.instance, "en"))
+        blocks_key = self.page._blocks_key(self.instance, "en")
+        self.assertTrue(content_keys)
+        self.assertIsNotNone(cache.get(blocks_key))
+        self.assertIsNotNone(cache.ttl(blocks_key))
+
+        cm.ContentGraph.objects.get(content=self.page, instance=self.instance).delete()
+        self.assertEqual(cache.get_many([*content_keys, blocks_key]), {})
+
+
+class TermbankVersionTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.instance = SimpleNamespace(slug="cache-test")
+
+    def test_versions_do_not_repeat(self):
+        with translation.override("en"):
+            versions = [termbank_version(self.instance)]
+            bump_generation(self.instance, "termbank")
+            versions.append(termbank_version(self.instance))
+            self.assertEqual(termbank_version(self.instance), versions[-1])
+
+            cache.delete(generation_key(self.instance, "termbank"))
+            versions.append(termbank_version(self.instance))
+            cache.delete(generation_key(self.instance, "termbank"))
+            bump_generation(self.instance, "termbank")
+            versions.append(termbank_version(self.instance))
+
+            self.assertEqual(len(set(versions)), len(versions))
+            self.assertTrue(versions[-1].endswith(".en"))
+            self.assertNotEqual(
+                termbank_version(self.instance, staff=True), termbank_version(self.instance)
+            )
@@ -0,0 +1,261 @@
+"""
+Tests for running the tests of a file upload exercise answer in the checker.
+"""
+
+import base64
+import json
+import os
+import pwd
+import re
+import sys
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+import courses.tasks as tasks
+from utils.files import get_checker_cache
+
+
+def encode(code):
+    return base64.b64encode(code.encode("utf-8")).decode("utf-8")
+
+
+def make_test(test_id, command_line, json_output=False, timeout=5, deterministic=False):
+    return {
+        "test_id": test_id,
+        "name": f"test {test_id}",
+        "required_files": ["ex-1"],
+        "stages": [{
+            "id": test_id,
+            "ordinal": 1,
+            "name": "stage",
+            "commands": [{
+                "input_text": "",
+                "return_value": None,
+                "cmd": command_line,
+                "ordinal": 1,
+                "timeout": timeout,
+                "json_output": json_output,
+                "deterministic": deterministic,
+                "stdout": True,
+                "stderr": True,
+            }],
+        }],
+    }
+
+
+ANSWER_CODE = """
+import sys
+print("answer output")
+print(sys.argv[1:])
+"""
+
+REFERENCE_CODE = """
+import sys
+print("reference output")
+print(sys.argv[1:])
+"""
+
+JSON_CODE = """
+import json
+print(json.dumps({"tests": [{"title": "json", "runs": [{"output": [{"msg": "ok", "flag": 1}]}]}]}))
+"""
+
+PAYLOAD = {
+    "tests": [
+        make_test(1, f"{sys.executable} answer.py $RETURNABLES"),
+        make_test(2, f"{sys.executable} -c 'print(\"same output\")'"),
+        make_test(3, f"{sys.executable} -c '{JSON_CODE}'", json_output=True),
+        make_test(4, f"{sys.executable} -c 'import time; time.sleep(10)'", timeout=0.5),
+        make_test(5, "missing-command"),
+    ],
+    "resources": {
+        "files_to_check": {"answer.py": encode(ANSWER_CODE)},
+        "checker_files": {
+            "ex-1": {
+                "hash": "",
+                "contents": encode(REFERENCE_CODE),
+                "purpose": "REFERENCE",
+                "name": "answer.py",
+                "chmod": "",
+            },
+        },
+    },
+}
+
+
+def without_times(commands):
+    for command in commands:
+        for key in ("runtime", "usermodetime", "kernelmodetime"):
+            command.pop(key, None)
+
+
+def comparable(evaluation):
+    """
+    Removes the run times and the numbering of the diff tables, which are
+    different for each run.
+    """
+
+    for test in evaluation["test_tree"]["tests"]:
+        for stage in test["stages"]:
+            without_times(stage["commands"])
+    evaluation_json = json.dumps(evaluation, sort_keys=True)
+    return re.sub(r"difflib_chg_to\d+__", "difflib_chg_to__", evaluation_json)
+
+
+@override_settings(RESTRICTED_USERNAME=pwd.getpwuid(os.getuid()).pw_name)
+class ConcurrentTestsTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(tasks.run_tests, "update_state")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _check(self, parallelism):
+        with mock.patch.object(tasks, "get_test_parallelism", return_value=parallelism):
+            return tasks.run_tests.run(PAYLOAD)["data"]
+
+    def test_concurrent_results_match_sequential(self):
+        sequential = self._check(1)
+        tests = sequential["test_tree"]["tests"]
+        self.assertEqual([test["correct"] for test in tests], [False, True, True, False, False])
+        self.assertTrue(sequential["timedout"])
+        self.assertIn("missing-command", tests[4]["stages"][0]["commands"][0]["error"])
+
+        with mock.patch.object(
+            tasks, "run_tests_concurrently", wraps=tasks.run_tests_concurrently
+        ) as concurrent:
+            concurrent_results = self._check(3)
+        self.assertEqual(concurrent.call_count, 1)
+        self.assertEqual(comparable(concurrent_results), comparable(sequential))
+
+
+SNOOPING_CODE = """
+import glob, os, time
+time.sleep(0.5)
+for path in glob.glob("/tmp/*/reference.py"):
+    try:
+        with open(path) as f:
+            print(f.read())
+    except OSError:
+        pass
+"""
+
+SLOW_REFERENCE_CODE = """
+import time
+print("reference secret")
+time.sleep(2)
+"""
+
+
+@override_settings(RESTRICTED_USERNAME=pwd.getpwuid(os.getuid()).pw_name)
+class ReferenceIsolationTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(tasks.run_tests, "update_state")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_student_runs_cannot_see_reference_runs(self):
+        payload = {
+            "tests": [
+                make_test(1, f"{sys.executable} reference.py"),
+                make_test(2, f"{sys.executable} reference.py"),
+            ],
+            "resources": {
+                "files_to_check": {"reference.py": encode(SNOOPING_CODE)},
+                "checker_files": {
+                    "ex-1": {
+                        "hash": "",
+                        "contents": encode(SLOW_REFERENCE_CODE),
+                        "purpose": "REFERENCE",
+                        "name": "reference.py",
+                        "chmod": "",
+                    },
+                },
+            },
+        }
+        with mock.patch.object(tasks, "get_test_parallelism", return_value=4):
+            evaluation = tasks.run_tests.run(payload)["data"]
+
+        for test in evaluation["test_tree"]["tests"]:
+            command = test["stages"][0]["commands"][0]
+            self.assertNotIn("reference secret", command["stdout"])
+            self.assertFalse(test["correct"])
+
+
+@override_settings(RESTRICTED_USERNAME=pwd.getpwuid(os.getuid()).pw_name)
+class ReferenceResultTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.resources = PAYLOAD["resources"]
+        patcher = mock.patch.object(tasks, "run_test", wraps=tasks.run_test)
+        self.run_test = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _cached(self, test):
+        return get_checker_cache().get(tasks._reference_results_key(test, self.resources))
+
+    def _comparable(self, results):
+        results = json.loads(json.dumps(results))
+        for test in results[0].values():
+            for stage in test["stages"].values():
+                without_times(stage["commands"].values())
+        return results
+
+    def test_cache_hit_matches_fresh_run(self):
+        test = make_test(1, f"{sys.executable} answer.py", deterministic=True)
+        fresh = tasks.run_reference_test(test, self.resources, cache_results=True)
+        self.assertIsNotNone(self._cached(test))
+
+        cached = tasks.run_reference_test(test, self.resources)
+        self.assertEqual(self.run_test.call_count, 1)
+        self.assertEqual(cached, fresh)
+        self.assertEqual(
+            self._comparable(cached), self._comparable(tasks.run_test(test, self.resources))
+        )
+
+    def test_failed_runs_are_not_cached(self):
+        timed_out = make_test(
+            1, f"{sys.executable} -c 'import time; time.sleep(10)'", timeout=0.5,
+            deterministic=True,
+        )
+        errored = make_test(2, "missing-command", deterministic=True)
+        for test in (timed_out, errored):
+            tasks.run_reference_test(test, self.resources, cache_results=True)
+            self.assertIsNone(self._cached(test))
+            tasks.run_reference_test(test, self.resources, cache_results=True)
+        self.assertEqual(self.run_test.call_count, 4)
+
+    def test_only_isolated_runs_are_cached(self):
+        test = make_test(1, f"{sys.executable} answer.py", deterministic=True)
+        tasks.run_reference_test(test, self.resources)
+        self.assertIsNone(self._cached(test))
+
+        # Answers are checked with the reference runs finished before student code is run
+        with mock.patch.object(tasks.run_tests, "update_state"):
+            tasks.run_tests.run({"tests": [test], "resources": self.resources})
+        self.assertIsNotNone(self._cached(test))
+        tasks.run_reference_test(test, self.resources)
+        self.assertEqual(self.run_test.call_count, 3)
+
+    def test_nothing_is_cached_without_checker_cache(self):
+        test = make_test(1, f"{sys.executable} answer.py", deterministic=True)
+        with mock.patch.object(tasks, "get_checker_cache", return_value=None):
+            tasks.run_reference_test(test, self.resources, cache_results=True)
+            tasks.run_reference_test(test, self.resources, cache_results=True)
+        self.assertEqual(self.run_test.call_count, 2)
+        self.assertIsNone(self._cached(test))
+
+    def test_warmup_skips_nondeterministic_tests(self):
+        deterministic = make_test(1, f"{sys.executable} answer.py", deterministic=True)
+        nondeterministic = make_test(2, f"{sys.executable} answer.py")
+        json_output = make_test(3, f"{sys.executable} answer.py", json_output=True)
+        tasks.warm_reference_results(
+            {
+                "tests": [deterministic, nondeterministic, json_output],
+                "checker_files": self.resources["checker_files"],
+            }
+        )
+        self.assertEqual(self.run_test.call_count, 1)
+        self.assertIsNotNone(self._cached(deterministic))
@@ -0,0 +1,148 @@
+"""
+Tests for the cached test plans of file upload exercises, and for sending
+answers again when the checker is missing checker files.
+"""
+
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from django.utils import translation
+
+import courses.models as cm
+import courses.tests.testhelpers as helpers
+import courses.views as views
+import utils.exercise as exercise_utils
+from courses.tests.test_tasks import create_answerable_exercise
+from utils.files import _checker_file_key, get_checker_cache
+
+
+class TestPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.exercise, cls.revision = create_answerable_exercise()
+        __, cls.instance = helpers.create_course_with_instance()
+        stage = cm.FileExerciseTestStage.objects.get(test__exercise=cls.exercise)
+        stage.name_en = "english stage"
+        stage.name_fi = "finnish stage"
+        stage.save()
+
+    def setUp(self):
+        cache.clear()
+        compile_test_plan = exercise_utils.compile_test_plan
+        patcher = mock.patch.object(
+            exercise_utils, "compile_test_plan", side_effect=compile_test_plan
+        )
+        self.compile_test_plan = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get_plan(self, lang_code="en"):
+        with translation.override(lang_code):
+            return exercise_utils.get_test_plan(self.exercise, self.instance)
+
+    def test_plan_is_cached(self):
+        plan = self._get_plan()
+        self.assertEqual(self._get_plan(), plan)
+        self.assertEqual(self.compile_test_plan.call_count, 1)
+
+    def test_generation_bump_recompiles(self):
+        self._get_plan()
+        stage = cm.FileExerciseTestStage.objects.get(test__exercise=self.exercise)
+        stage.name_en = "renamed stage"
+        stage.save()
+        self.assertEqual(self._get_plan()["tests"][0]["stages"][0]["name"], "english stage")
+
+        exercise_utils.invalidate_test_plans(self.exercise.id)
+        self.assertEqual(self._get_plan()["tests"][0]["stages"][0]["name"], "renamed stage")
+        self.assertEqual(self.compile_test_plan.call_count, 2)
+
+        self._get_plan()
+        self.assertEqual(self.compile_test_plan.call_count, 2)
+
+    def test_evicted_checker_file_recompiles(self):
+        plan = self._get_plan()
+        (file_info,) = plan["checker_files"].values()
+        get_checker_cache().delete(_checker_file_key(file_info["hash"]))
+
+        self.assertEqual(self._get_plan(), plan)
+        self.assertEqual(self.compile_test_plan.call_count, 2)
+        self.assertIsNotNone(get_checker_cache().get(_checker_file_key(file_info["hash"])))
+
+    def test_contents_are_included_without_checker_cache(self):
+        (file_info,) = self._get_plan()["checker_files"].values()
+        self.assertNotIn("contents", file_info)
+
+        exercise_utils.invalidate_test_plans(self.exercise.id)
+        with mock.patch("utils.files.get_checker_cache", return_value=None), mock.patch.object(
+            exercise_utils, "get_checker_cache", return_value=None
+        ):
+            (uncached_info,) = self._get_plan()["checker_files"].values()
+        self.assertEqual(uncached_info["hash"], file_info["hash"])
+        self.assertIn("contents", uncached_info)
+
+    def test_plans_are_kept_per_language(self):
+        english = self._get_plan("en")
+        finnish = self._get_plan("fi")
+        self.assertEqual(english["tests"][0]["stages"][0]["name"], "english stage")
+        self.assertEqual(finnish["tests"][0]["stages"][0]["name"], "finnish stage")
+        self.assertEqual(self.compile_test_plan.call_count, 2)
+
+        self.assertEqual(self._get_plan("en"), english)
+        self.assertEqual(self._get_plan("fi"), finnish)
+        self.assertEqual(self.compile_test_plan.call_count, 2)
+
+    def test_evicted_generation_recompiles(self):
+        self._get_plan()
+        cache.delete(exercise_utils._test_plan_generation_key(self.exercise.id))
+        self._get_plan()
+        self.assertEqual(self.compile_test_plan.call_count, 2)
+
+        exercise_utils.invalidate_test_plans(self.exercise.id)
+        cache.delete(exercise_utils._test_plan_generation_key(self.exercise.id))
+        self._get_plan()
+        self.assertEqual(self.compile_test_plan.call_count, 3)
+
+
+class ResendAnswerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.exercise, cls.revision = create_answerable_exercise()
+        cls.course, cls.instance = helpers.create_course_with_instance()
+        cls.user = User.objects.create_user(username="resend", password="resend")
+        cls.answer = cm.UserFileUploadExerciseAnswer.objects.create(
+            exercise=cls.exercise, instance=cls.instance, user=cls.user, revision=cls.revision,
+            language_code="en", answerer_ip="127.0.0.1", task_id="missing-files-task",
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.request = RequestFactory().get("/")
+        self.request.user = self.user
+        patcher = mock.patch.object(views, "check_progress")
+        self.check_progress = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _resend(self, task):
+        with translation.override("en"):
+            return views.resend_file_exercise_answer(
+                self.request, self.course, self.instance, self.exercise, None,
+                "missing-files-task", task,
+            )
+
+    @mock.patch("courses.views.rpc_tasks.run_tests.delay")
+    def test_answer_is_sent_again_once(self, delay):
+        delay.return_value.task_id = "resent-task"
+        task = mock.Mock()
+        self._resend(task)
+        self._resend(task)
+
+        self.assertEqual(delay.call_count, 1)
+        (file_info,) = delay.call_args.kwargs["payload"]["resources"]["checker_files"].values()
+        self.assertIn("contents", file_info)
+        self.answer.refresh_from_db()
+        self.assertEqual(self.answer.task_id, "resent-task")
+        self.assertEqual(
+            [call.args[-1] for call in self.check_progress.call_args_list],
+            ["resent-task", "resent-task"],
+        )
@@ -0,0 +1,120 @@
+"""
+Tests for the worker's local copies of checker files.
+"""
+
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+import utils.files as files
+from courses.tasks import checker_file_contents, run_tests
+
+
+class CheckerFileTests(SimpleTestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        self.checker_dir = os.path.join(self.base_dir, "checker-files")
+        patcher = mock.patch.object(files, "CHECKER_FILE_DIR", self.checker_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _store(self, contents):
+        digest = hashlib.sha256(contents).hexdigest()
+        files.get_checker_cache().set(files._checker_file_key(digest), contents)
+        self.addCleanup(files.get_checker_cache().delete, files._checker_file_key(digest))
+        return digest
+
+    def _local_path(self, digest):
+        return os.path.join(self.checker_dir, digest)
+
+    def test_file_is_copied_from_store(self):
+        digest = self._store(b"print('hello')\n")
+        self.assertEqual(files.get_checker_file(digest), b"print('hello')\n")
+        self.assertEqual(os.stat(self.checker_dir).st_mode & 0o777, 0o700)
+
+        files.get_checker_cache().delete(files._checker_file_key(digest))
+        self.assertEqual(files.get_checker_file(digest), b"print('hello')\n")
+
+    def test_missing_file(self):
+        with self.assertRaises(files.CheckerFileMissing) as raised:
+            files.get_checker_file(hashlib.sha256(b"missing").hexdigest())
+        self.assertEqual(raised.exception.digest, hashlib.sha256(b"missing").hexdigest())
+
+    def test_changed_copy_is_not_used(self):
+        digest = self._store(b"original")
+        files.get_checker_file(digest)
+        with open(self._local_path(digest), "wb") as f:
+            f.write(b"changed")
+
+        self.assertEqual(files.get_checker_file(digest), b"original")
+        with open(self._local_path(digest), "rb") as f:
+            self.assertEqual(f.read(), b"original")
+
+    def test_unsafe_directory_is_not_used(self):
+        digest = self._store(b"contents")
+        os.makedirs(self.checker_dir, mode=0o777)
+        os.chmod(self.checker_dir, 0o777)
+        with open(self._local_path(digest), "wb") as f:
+            f.write(b"planted")
+
+        with self.assertLogs("utils.files", level="WARNING"):
+            self.assertEqual(files.get_checker_file(digest), b"contents")
+        with open(self._local_path(digest), "rb") as f:
+            self.assertEqual(f.read(), b"planted")
+
+    def test_symlinked_directory_is_not_used(self):
+        target = os.path.join(self.base_dir, "elsewhere")
+        os.makedirs(target, mode=0o700)
+        os.symlink(target, self.checker_dir)
+        digest = self._store(b"contents")
+
+        with self.assertLogs("utils.files", level="WARNING"):
+            self.assertEqual(files.get_checker_file(digest), b"contents")
+        self.assertEqual(os.listdir(target), [])
+
+    def test_least_recently_used_copies_are_evicted(self):
+        digests = [self._store(bytes([i]) * 100) for i in range(4)]
+        for i, digest in enumerate(digests[:3]):
+            files.get_checker_file(digest)
+            os.utime(self._local_path(digest), (time.time() - 100 + i,) * 2)
+
+        # Reading a copy marks it as recently used
+        files.get_checker_file(digests[0])
+        with mock.patch.object(files, "CHECKER_FILE_DIR_SIZE", 250):
+            files.get_checker_file(digests[3])
+
+        self.assertEqual(
+            sorted(os.listdir(self.checker_dir)), sorted([digests[0], digests[3]])
+        )
+
+    def test_contents_in_payload(self):
+        file_info = {
+            "hash": hashlib.sha256(b"resent").hexdigest(),
+            "contents": base64.b64encode(b"resent").decode("utf-8"),
+        }
+        self.assertEqual(checker_file_contents(file_info), b"resent")
+
+    def test_missing_file_is_reported(self):
+        digest = hashlib.sha256(b"evicted").hexdigest()
+        payload = {
+            "tests": [{"test_id": 1, "name": "test", "required_files": ["ex-1"], "stages": []}],
+            "resources": {
+                "files_to_check": {},
+                "checker_files": {
+                    "ex-1": {"hash": digest, "purpose": "INPUT", "name": "in.txt", "chmod": ""},
+                },
+            },
+        }
+        with mock.patch.object(run_tests, "update_state"):
+            with self.assertLogs("courses.tasks", level="WARNING"):
+                result = run_tests.run(payload)
+
+        self.assertEqual(result["status"], "missing_files")
+        self.assertEqual(result["data"]["missing"], [digest])
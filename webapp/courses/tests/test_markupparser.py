@@ -0,0 +1,241 @@
+"""
+Tests for the markup parser internals that do not need database access.
+"""
+
+import re
+import unittest.mock
+from django.test import SimpleTestCase
+from courses import blockparser, markupparser
+
+
+SAMPLE_LINES = [
+    "",
+    "   ",
+    "}}}",
+    "~~",
+    "= Heading =",
+    "=== Heading ===",
+    "= Broken heading",
+    "<!page=some-exercise>",
+    "<!file=some-file|link_only=True>",
+    "<!image=some-image.png|alt=alt text|caption=[[link|text]]|align=center>",
+    "<!video=some-video|width=100|height=200>",
+    "<!script=some-script|width=1|height=2|include=head:script=a.js>",
+    "<!calendar=some-calendar>",
+    "* list item",
+    "## ordered item",
+    "|| a || b ||",
+    "--",
+    "{{{",
+    "{{{highlight=python",
+    "{{{math",
+    "{{{svg|width=10|height=20",
+    "just a paragraph line",
+]
+
+
+def sequential_kind(block_markups, line):
+    for markup_cls in block_markups:
+        if matchobj := markup_cls.regexp.match(line):
+            return markup_cls, matchobj
+    return None, None
+
+
+class LineClassifierTests(SimpleTestCase):
+
+    def classify(self, classifier, line):
+        for regexp, members in classifier:
+            if matchobj := regexp.match(line):
+                if isinstance(members, dict):
+                    markup_cls = members[matchobj.lastgroup]
+                    return markup_cls, markup_cls.regexp.match(line)
+                return members, matchobj
+        return None, None
+
+    def assert_same_as_sequential(self, block_markups):
+        classifier = markupparser._compile_classifier(block_markups)
+        for line in SAMPLE_LINES:
+            expected_cls, expected_match = sequential_kind(block_markups, line)
+            markup_cls, matchobj = self.classify(classifier, line)
+            self.assertIs(markup_cls, expected_cls, line)
+            if expected_match is not None:
+                self.assertEqual(matchobj.groupdict(), expected_match.groupdict(), line)
+
+    def test_registered_markups(self):
+        self.assert_same_as_sequential(markupparser.MarkupParser._block_markups)
+        self.assertEqual(len(markupparser.MarkupParser._block_classifier), 1)
+
+    def test_link_parser_markups(self):
+        self.assert_same_as_sequential(markupparser.LinkParser._block_markups)
+
+    def test_unmergeable_markups_keep_their_position(self):
+        class OptOutMarkup(markupparser.Markup):
+            shortname = "optout"
+            regexp = re.compile(r"^= Heading =$")
+            mergeable = False
+
+        class FlagMarkup(markupparser.Markup):
+            shortname = "flagged"
+            regexp = re.compile(r"^JUST A", re.IGNORECASE)
+
+        class BackrefMarkup(markupparser.Markup):
+            shortname = "backref"
+            regexp = re.compile(r"^([*#])\1")
+
+        block_markups = [OptOutMarkup, FlagMarkup, BackrefMarkup] + list(
+            markupparser.MarkupParser._block_markups
+        )
+        classifier = markupparser._compile_classifier(block_markups)
+        self.assertEqual(
+            [members for __, members in classifier[:3]],
+            [OptOutMarkup, FlagMarkup, BackrefMarkup],
+        )
+        self.assert_same_as_sequential(block_markups)
+
+    def test_shared_group_names(self):
+        class FirstMarkup(markupparser.Markup):
+            shortname = "first"
+            regexp = re.compile(r"^(?P<level>[*]{3})(?P<text>.+)(?P=level)$")
+
+        class SecondMarkup(markupparser.Markup):
+            shortname = "second"
+            regexp = re.compile(r"^(?P<level>[*#]+)(?P<text>.+)$")
+
+        block_markups = [FirstMarkup, SecondMarkup]
+        classifier = markupparser._compile_classifier(block_markups)
+        self.assertEqual(len(classifier), 1)
+        for line in ("***bold***", "***bold", "## item", "text"):
+            self.assertEqual(
+                self.classify(classifier, line)[0],
+                sequential_kind(block_markups, line)[0],
+            )
+
+
+INLINE_SAMPLES = [
+    "plain text without any tags",
+    "'''bold''' and ''italic'' and '''''both'''''",
+    "''italic with '''bold''' inside''",
+    "{{{code with '''quotes'''}}} and !!!mark!!!",
+    "[[#anchor|link text]] and `{enter}` and [!color=red!]red[!color!]",
+    "[!hint=a!]hint[!hint!] [!term=Term!]term[!term!]",
+    "''' unclosed and '' half {{{ and [[ and [! and `",
+    "[[!color=red!]text[!color!]]]",
+]
+
+
+class BlockParserTests(SimpleTestCase):
+
+    def test_matches_start_with_trigger(self):
+        for tag in blockparser.BlockParser.tags.values():
+            if tag.trigger is None:
+                continue
+            for sample in INLINE_SAMPLES:
+                for match in tag.regexp.finditer(sample):
+                    self.assertTrue(match.group(0).startswith(tag.trigger))
+
+    def test_same_as_applying_every_tag(self):
+        context = {"instance": None}
+        for sample in INLINE_SAMPLES:
+            expected = sample
+            for tag in blockparser.BlockParser.tags.values():
+                expected = tag.parse(expected, context)
+            self.assertEqual(blockparser.parseblock(sample, context), expected, sample)
+
+
+class HighlightTests(SimpleTestCase):
+
+    def test_lexer_for_filename(self):
+        from pygments.lexers import guess_lexer_for_filename
+        from utils.highlight import lexer_for_filename
+
+        samples = {
+            "main.py": "print('hello')\n",
+            "header.h": "int f(void);\n",
+            "Makefile": "all:\n\tcc main.c\n",
+            "page.html": "<html></html>\n",
+            "script.pl": "use strict;\n",
+            "query.sql": "SELECT 1;\n",
+        }
+        for filename, contents in samples.items():
+            self.assertIs(
+                type(lexer_for_filename(filename, contents)),
+                type(guess_lexer_for_filename(filename, contents)),
+                filename,
+            )
+
+    def test_highlight_code(self):
+        import pygments
+        from pygments.formatters import HtmlFormatter
+        from pygments.lexers import get_lexer_by_name
+        from utils.highlight import highlight_code
+
+        code = "def f(x):\n    return x\n"
+        expected = pygments.highlight(code, get_lexer_by_name("python"), HtmlFormatter(nowrap=True))
+        self.assertEqual(highlight_code(code, "python"), expected)
+        self.assertEqual(highlight_code(code, "python"), expected)
+
+
+INCREMENTAL_TEXT = """= Heading =
+
+First paragraph with '''bold''' text
+that continues here.
+
+* list item
+** nested item
+# ordered item
+
+|| a || b ||
+|| c || d ||
+
+{{{highlight=python
+def f(x):
+    return x
+}}}
+
+--
+Last paragraph."""
+
+
+class BlockCacheTests(SimpleTestCase):
+
+    def render(self, text, block_cache=None):
+        parser = markupparser.MarkupParser()
+        return list(parser.parse(text, context={"instance": None}, block_cache=block_cache))
+
+    def test_incremental_parse_matches_full_parse(self):
+        block_cache = markupparser.BlockCache()
+        self.assertEqual(self.render(INCREMENTAL_TEXT, block_cache), self.render(INCREMENTAL_TEXT))
+
+        lines = INCREMENTAL_TEXT.splitlines()
+        edits = [
+            lines[:2] + ["Inserted paragraph", ""] + lines[2:],
+            lines[:6] + ["*** deeper item"] + lines[6:],
+            lines[:9] + lines[10:],
+            [line.replace("return x", "return x + 1") for line in lines],
+        ]
+        for edited in edits:
+            text = "\n".join(edited)
+            incremental_cache = markupparser.BlockCache(block_cache.blocks)
+            self.assertEqual(self.render(text, incremental_cache), self.render(text), text)
+
+    def test_only_changed_blocks_are_rendered(self):
+        block_cache = markupparser.BlockCache()
+        self.render(INCREMENTAL_TEXT, block_cache)
+
+        text = INCREMENTAL_TEXT.replace("Last paragraph.", "Edited paragraph.")
+        incremental_cache = markupparser.BlockCache(block_cache.blocks)
+        incremental_cache.set = unittest.mock.Mock(wraps=incremental_cache.set)
+        self.render(text, incremental_cache)
+        self.assertEqual(incremental_cache.set.call_count, 1)
+        self.assertEqual(len(incremental_cache.blocks), len(block_cache.blocks))
+
+    def test_blocks_with_uncacheable_tags_are_rendered(self):
+        text = "Plain paragraph.\n\nSee [[http://example.com|link]].\n\n[!term=a!]term[!term!]"
+        block_cache = markupparser.BlockCache()
+        self.render(text, block_cache)
+        self.assertEqual(len(block_cache.blocks), 2)
+
+        incremental_cache = markupparser.BlockCache(block_cache.blocks)
+        incremental_cache.set = unittest.mock.Mock(wraps=incremental_cache.set)
+        self.assertEqual(self.render(text, incremental_cache), self.render(text))
+        self.assertEqual(incremental_cache.set.call_count, 0)
@@ -0,0 +1,66 @@
+import datetime
+import threading
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+import utils.notify as notify
+
+
+LOCAL_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "notify": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "notify-tests",
+    },
+}
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class NotificationIndexTests(SimpleTestCase):
+    def setUp(self):
+        notify.caches["notify"].clear()
+        self.expiry = datetime.datetime.now() + datetime.timedelta(hours=1)
+
+        # Reading the index is made slow so that concurrent updates overlap
+        load_notifications = notify._load_notifications
+
+        def slow_load(*args):
+            notifications = load_notifications(*args)
+            time.sleep(0.01)
+            return notifications
+
+        patcher = mock.patch.object(notify, "_load_notifications", slow_load)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _run_concurrently(self, jobs):
+        threads = [threading.Thread(target=job) for job in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _create(self, i):
+        content = {f"content_{settings.LANGUAGE_CODE}": f"message {i}"}
+        return lambda: notify.create_notifications(
+            content, self.expiry, timestamp=f"2024-01-01T00:00:{i:02}"
+        )
+
+    def test_concurrent_creates_are_kept(self):
+        self._run_concurrently([self._create(i) for i in range(10)])
+        messages = notify.get_notifications("system", None, settings.LANGUAGE_CODE)
+        self.assertEqual(messages, [f"message {i}" for i in range(10)])
+
+    def test_concurrent_deletes_are_kept(self):
+        for i in range(10):
+            self._create(i)()
+
+        self._run_concurrently([
+            lambda i=i: notify.delete_notification("system", f"2024-01-01T00:00:{i:02}")
+            for i in range(0, 10, 2)
+        ])
+        messages = notify.get_notifications("system", None, settings.LANGUAGE_CODE)
+        self.assertEqual(messages, [f"message {i}" for i in range(1, 10, 2)])
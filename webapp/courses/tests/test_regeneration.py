@@ -0,0 +1,96 @@
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase
+
+import courses.models as cm
+import courses.tests.testhelpers as helpers
+import utils.regeneration as regeneration
+
+
+class RegenerationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_frontpage = helpers.create_frontpage()
+        test_page_plain = helpers.create_plain_page()
+        __, test_instance = helpers.create_course_with_instance()
+        helpers.add_content_graph(test_frontpage, test_instance, 0)
+        helpers.add_content_graph(test_page_plain, test_instance, 1)
+        cls.instance = test_instance
+        cls.broken_page = test_page_plain
+
+    def setUp(self):
+        cache.clear()
+
+    def test_failed_jobs_are_counted_as_finished(self):
+        regenerate_cache = cm.ContentPage.regenerate_cache
+        broken_page = self.broken_page
+
+        def regenerate_or_fail(page, *args, **kwargs):
+            if page.id == broken_page.id:
+                raise ValueError("broken page")
+            return regenerate_cache(page, *args, **kwargs)
+
+        reports = []
+        with mock.patch.object(cm.ContentPage, "regenerate_cache", regenerate_or_fail):
+            with self.assertLogs("utils.regeneration", level="ERROR"):
+                regeneration.regenerate_locally(
+                    self.instance, report=lambda done, total: reports.append((done, total))
+                )
+
+        progress = regeneration.regeneration_progress(self.instance)
+        self.assertEqual(progress["current"], progress["total"])
+        self.assertEqual(progress["failed"], len(settings.LANGUAGES))
+        self.assertEqual(reports[-1], (progress["total"], progress["total"]))
+
+    def _run_jobs(self, count):
+        for __ in range(count):
+            regeneration.run_regeneration_job(self.instance.id, self.broken_page.id, "en", False)
+
+    @mock.patch("celery.chain")
+    def test_running_regeneration_is_not_restarted(self, chain):
+        regeneration.schedule_regeneration(self.instance)
+        self.assertTrue(regeneration.regeneration_running(self.instance))
+        self.assertEqual(chain.call_count, 1)
+
+        total = regeneration.regeneration_progress(self.instance)["total"]
+        self._run_jobs(1)
+        self.assertEqual(regeneration.regeneration_progress(self.instance)["current"], 1)
+
+        self._run_jobs(total - 1)
+        self.assertFalse(regeneration.regeneration_running(self.instance))
+        regeneration.schedule_regeneration(self.instance)
+        self.assertEqual(chain.call_count, 2)
+        self.assertEqual(regeneration.regeneration_progress(self.instance)["current"], 0)
+
+    @mock.patch("celery.chain")
+    def test_regeneration_requested_while_running_is_pending(self, chain):
+        regeneration.schedule_regeneration(self.instance)
+        total = regeneration.regeneration_progress(self.instance)["total"]
+        self._run_jobs(1)
+
+        with self.assertLogs("utils.regeneration", level="INFO"):
+            self.assertIsNone(regeneration.schedule_regeneration(self.instance))
+            regeneration.schedule_regeneration(self.instance)
+        self.assertEqual(chain.call_count, 1)
+        self.assertEqual(regeneration.regeneration_progress(self.instance)["current"], 1)
+
+        # The pending regeneration starts once the running one has finished
+        self._run_jobs(total - 1)
+        self.assertEqual(chain.call_count, 2)
+        self.assertTrue(regeneration.regeneration_running(self.instance))
+        self.assertEqual(regeneration.regeneration_progress(self.instance)["current"], 0)
+
+        self._run_jobs(total)
+        self.assertEqual(chain.call_count, 2)
+        self.assertFalse(regeneration.regeneration_running(self.instance))
+
+    @mock.patch("celery.chain")
+    def test_failed_chain_releases_regeneration(self, chain):
+        regeneration.schedule_regeneration(self.instance)
+        errback = chain.return_value.on_error.call_args.args[0]
+        self.assertEqual(errback.task, "courses.finish-regeneration")
+
+        errback.apply()
+        self.assertFalse(regeneration.regeneration_running(self.instance))
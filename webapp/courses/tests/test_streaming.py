@@ -0,0 +1,63 @@
+"""
+Tests that content pages streamed block by block are identical to pages that
+are rendered as a whole within the view.
+"""
+
+import re
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+import courses.tests.testhelpers as helpers
+
+
+def normalize(html):
+    """
+    Removes whitespace differences and the CSRF tokens, which are different
+    for each response.
+    """
+
+    html = re.sub(r"\s+", " ", html)
+    return re.sub(r'(csrfmiddlewaretoken" value="|data-csrf=")[^"]+', r"\1CSRF", html)
+
+
+class StreamingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = helpers.create_admin_user()
+        test_frontpage = helpers.create_frontpage()
+        test_page_plain = helpers.create_plain_page()
+        test_course, test_instance = helpers.create_course_with_instance()
+        helpers.add_content_graph(test_frontpage, test_instance, 0)
+        helpers.add_content_graph(test_page_plain, test_instance, 1)
+        test_instance.frontpage = test_frontpage
+        test_instance.save()
+        cls.page_url = reverse("courses:content", kwargs={
+            "course": test_course,
+            "instance": test_instance,
+            "content": test_page_plain,
+        })
+
+    def _compare_streamed(self):
+        cache.clear()
+        with override_settings(STREAM_CONTENT_PAGES=False):
+            response = self.client.get(self.page_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.streaming)
+
+        with override_settings(STREAM_CONTENT_PAGES=True):
+            streamed = self.client.get(self.page_url)
+        self.assertEqual(streamed.status_code, 200)
+        self.assertTrue(streamed.streaming)
+        streamed_content = b"".join(streamed.streaming_content).decode("utf-8")
+
+        self.assertIn("There is some text here", streamed_content)
+        self.assertEqual(
+            normalize(streamed_content), normalize(response.content.decode("utf-8"))
+        )
+
+    def test_streamed_page_anonymous(self):
+        self._compare_streamed()
+
+    def test_streamed_page_staff(self):
+        self.client.force_login(self.user)
+        self._compare_streamed()
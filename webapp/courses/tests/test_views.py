@@ -231,8 +231,20 @@ class ViewTests(TestCase):
         course instance termbank.
         """
 
-        response = self.client.get(helpers.TestUrls.course_url)
+        response = self.client.get(helpers.TestUrls.termbank_url)
         self.assertIn("termbank_contents", response.context)
         termbank = dict(response.context["termbank_contents"])
         self.assertEqual(len(termbank["P"]), 1)
         self.assertEqual(len(termbank["T"]), 2)
+
+    def test_termbank_not_modified(self):
+        """
+        Tests that the termbank is not sent again while its ETag is current.
+        """
+
+        response = self.client.get(helpers.TestUrls.termbank_url)
+        self.assertIn("private", response["Cache-Control"])
+        response = self.client.get(
+            helpers.TestUrls.termbank_url, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
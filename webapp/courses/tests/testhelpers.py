@@ -16,6 +16,7 @@ class TestUrls:
     plain_term_page_url = "/testcourse/testinstance/plain-term-page/"
     tab_term_page_url = "/testcourse/testinstance/tab-term-page/"
     link_term_page_url = "/testcourse/testinstance/link-term-page/"
+    termbank_url = "/termbank/testcourse/testinstance/"
 
 
 PLAIN_CONTENT = """
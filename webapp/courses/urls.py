@@ -66,6 +66,11 @@ urlpatterns = [
         user_views.cancel_invitation,
         name="cancel_invitation",
     ),
+    path(
+        "termbank/<course:course>/<instance:instance>/",
+        views.termbank,
+        name="termbank",
+    ),
     # For viewing and changing user information
     path(
         "answers/<user:user>/<course:course>/<instance:instance>/"
@@ -185,6 +190,11 @@ urlpatterns = [
         staff_views.regen_instance_cache,
         name="regen_instance_cache",
     ),
+    path(
+        "staff/<course:course>/<instance:instance>/regen_cache/progress/",
+        staff_views.regen_instance_cache_progress,
+        name="regen_instance_cache_progress",
+    ),
     path(
         "staff/<course:course>/<instance:instance>/termify/",
         staff_views.termify,
@@ -5,6 +5,7 @@ import datetime
 import json
 import logging
 import os
+import uuid
 from html import escape
 from collections import namedtuple
 from operator import attrgetter
@@ -12,6 +13,7 @@ from operator import attrgetter
 import redis
 from django.http import (
     HttpResponse,
+    StreamingHttpResponse,
     JsonResponse,
     HttpResponseNotFound,
     HttpResponseForbidden,
@@ -20,11 +22,15 @@ from django.http import (
 )
 from django.db import transaction
 from django.template import loader, engines
+from django.template.context import make_context
 from django.conf import settings
-from django.core.files.base import File
+from django.core.cache import cache
+from django.core.files.base import ContentFile, File
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.utils import translation
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django.utils.text import slugify
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext as _
@@ -62,6 +68,7 @@ from courses.models import (
 import faq.utils as faq_utils
 from utils.access import (
     is_course_staff,
+    is_enrolled,
     determine_media_access,
     ensure_enrolled_or_staff,
     ensure_owner_or_staff,
@@ -75,11 +82,12 @@ from utils.content import (
     first_title_from_content,
     get_answer_count_meta,
     get_embedded_parent,
+    preload_embedded_progress,
 )
-from utils.exercise import compile_evaluation_data
+from utils.exercise import compile_evaluation_data, file_upload_payload
 from utils.files import generate_download_response
 from utils.notify import send_error_report, send_welcome_email
-from utils.rendering import render_terms
+from utils.rendering import render_terms, termbank_version
 
 JSON_INCORRECT = 0
 JSON_CORRECT = 1
@@ -178,7 +186,9 @@ def course(request, course, instance):
         )
         exemptions = dict(
             (entry["contentgraph_id"], entry["new_deadline"]) for entry in
-            DeadlineExemption.objects.filter(user=request.user).values()
+            DeadlineExemption.objects.filter(
+                user=request.user, contentgraph__instance=instance
+            ).values()
         )
     else:
         user_results = {}
@@ -229,13 +239,8 @@ def _page_context(request, course, instance, content, pagenum=None):
                 evaluation = content.get_user_evaluation(request.user, instance)
             except NotImplementedError:
                 evaluation = None
-        try:
-            if CourseEnrollment.objects.get(instance=instance, student=request.user).is_enrolled():
-                enrolled = True
-        except CourseEnrollment.DoesNotExist:
-            pass
-        if is_course_staff(request.user, instance):
-            course_staff = True
+        enrolled = is_enrolled(request.user, instance)
+        course_staff = is_course_staff(request.user, instance)
 
     if not content_graph.visible and not course_staff:
         return HttpResponseNotFound(_("This content is (currently) only available to course staff"))
@@ -258,13 +263,16 @@ def _page_context(request, course, instance, content, pagenum=None):
     question = blockparser.parseblock(escape(content.question, quote=False), {"course": course})
     choices = content.get_choices(content, revision=revision)
     rendered_content = content.rendered_markup(request, context, revision, page=pagenum)
-    termbank_contents, term_div_data = render_terms(request, instance, context)
     embedded_links = EmbeddedLink.objects.filter(parent=content, instance=instance).select_related(
         "embedded_page"
     )
     embed_dict = {}
     for link in embedded_links:
         embed_dict[link.embedded_page.slug] = link.embedded_page
+    if request.user.is_active:
+        embedded_progress = preload_embedded_progress(embed_dict.values(), request.user, instance)
+    else:
+        embedded_progress = {}
 
     c = {
         "course": course,
@@ -276,6 +284,7 @@ def _page_context(request, course, instance, content, pagenum=None):
         "content": content,
         "content_blocks": rendered_content,
         "embedded_pages": embed_dict,
+        "embedded_progress": embedded_progress,
         "rendered_content": rendered_content,
         "embedded": False,
         "content_name": content.name,
@@ -285,8 +294,10 @@ def _page_context(request, course, instance, content, pagenum=None):
         "evaluation": evaluation,
         "answer_count": answer_count,
         "sandboxed": False,
-        "termbank_contents": sorted(list(termbank_contents.items())),
-        "term_div_data": term_div_data,
+        "termbank_url": reverse("courses:termbank", kwargs={
+            "course": course,
+            "instance": instance,
+        }) + f"?v={termbank_version(instance, course_staff)}",
         "revision": revision,
         "enrolled": enrolled,
         "course_staff": course_staff,
@@ -318,7 +329,70 @@ def content(request, course, instance, content, pagenum=None):
     if not isinstance(c, dict):
         return c
     t = loader.get_template("courses/contentpage.html")
-    return HttpResponse(t.render(c, request))
+    if not getattr(settings, "STREAM_CONTENT_PAGES", False) or content.is_answerable():
+        return HttpResponse(t.render(c, request))
+
+    # The page shell is rendered before returning the response so that
+    # messages, session and CSRF cookie are handled normally by the
+    # middleware. Content blocks are rendered while the response is sent.
+    c["streamed_blocks_marker"] = marker = uuid.uuid4().hex
+    head, tail = t.render(c, request).split(marker, 1)
+    return StreamingHttpResponse(_stream_content_blocks(request, c, head, tail))
+
+
+def termbank(request, course, instance):
+    """
+    Returns the termbank of a course instance as an HTML fragment that content
+    pages load separately. Pages link to it with the current termbank version
+    in the URL, so browsers can keep it as long as the version stays the same.
+    """
+
+    course_staff = is_course_staff(request.user, instance)
+    etag = quote_etag(termbank_version(instance, course_staff))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        context = {
+            "course": course,
+            "course_slug": course.slug,
+            "instance": instance,
+            "instance_slug": instance.slug,
+            "course_staff": course_staff,
+        }
+        termbank_contents, term_div_data = render_terms(request, instance, context)
+        t = loader.get_template("courses/termbank.html")
+        response = HttpResponse(t.render({
+            "termbank_contents": sorted(list(termbank_contents.items())),
+            "term_div_data": term_div_data,
+            "course_staff": course_staff,
+        }, request))
+    response["ETag"] = etag
+    patch_cache_control(
+        response, private=True, max_age=getattr(settings, "TERMBANK_MAX_AGE", 0)
+    )
+    return response
+
+
+def _stream_content_blocks(request, context, head, tail):
+    """
+    Yields a content page in pieces: the page shell up to the content, each
+    content block separately, and the rest of the page. The context is
+    created once and shared by all blocks, so that context processors are
+    only run once.
+    """
+
+    yield head
+    block_template = loader.get_template("courses/content-block.html").template
+    context = make_context(context, request)
+    with context.bind_template(block_template):
+        for block_type, block_data, line_idx, line_count in context["content_blocks"]:
+            with context.push(
+                block_type=block_type,
+                block_data=block_data,
+                line_idx=line_idx,
+                line_count=line_count,
+            ):
+                yield block_template.render(context)
+    yield tail
 
 
 @ensure_owner_or_staff
@@ -616,6 +690,10 @@ def check_progress(request, course, instance, content, revision, task_id):
     task = celery_app.AsyncResult(id=task_id)
     info = task.info
     if task.ready():
+        if isinstance(info, dict) and info.get("status") == "missing_files":
+            return resend_file_exercise_answer(
+                request, course, instance, content, revision, task_id, task
+            )
         return file_exercise_evaluation(request, course, instance, content, revision, task_id, task)
 
     celery_status = rpc_tasks.get_celery_worker_status()
@@ -638,6 +716,53 @@ def check_progress(request, course, instance, content, revision, task_id):
     return JsonResponse(data)
 
 
+def _resent_task_key(task_id):
+    return f"{task_id}_resent_as"
+
+
+def resend_file_exercise_answer(request, course, instance, content, revision, task_id, task):
+    """
+    Sends a file upload answer to be checked again with the contents of the
+    checker files included, when the checker could not find some of them in
+    the checker file store. The answer is locked while it is sent, so that
+    only one of concurrent progress checks sends it, and the others follow
+    the progress of the new task.
+    """
+
+    if revision in (None, "head"):
+        exercise = content
+        payload_revision = None
+    else:
+        exercise = get_single_archived(content, revision)
+        payload_revision = revision
+
+    with transaction.atomic():
+        answer_object = (
+            UserFileUploadExerciseAnswer.objects.select_for_update()
+            .filter(user=request.user, task_id=task_id)
+            .first()
+        )
+        if answer_object is None:
+            resent_task_id = cache.get(_resent_task_key(task_id))
+        else:
+            files = [
+                ContentFile(contents, name=name)
+                for name, contents in answer_object.get_returned_files_raw().items()
+            ]
+            payload = file_upload_payload(
+                exercise, files, instance, payload_revision, include_contents=True
+            )
+            resent_task_id = rpc_tasks.run_tests.delay(payload=payload).task_id
+            answer_object.task_id = resent_task_id
+            answer_object.save()
+            cache.set(_resent_task_key(task_id), resent_task_id, timeout=60 * 60)
+
+    task.forget()
+    if resent_task_id is None:
+        return HttpResponseNotFound(_("The answer has already been sent to be checked again"))
+    return check_progress(request, course, instance, content, revision, resent_task_id)
+
+
 def file_exercise_evaluation(request, course, instance, content, revision, task_id, task=None):
     if task is None:
         task = celery_app.AsyncResult(task_id)
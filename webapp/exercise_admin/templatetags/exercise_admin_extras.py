@@ -141,6 +141,7 @@ def test_tab(test_obj, stages_list, instance_files, exercise_files, jstemplate=F
         ordinal_number = "SAMPLE_COMMAND_ORDINAL_NUMBER"
         # command_line = "New command"
         timeout = default_fue_timeout()
+        deterministic = True
 
         def __init__(self):
             for lang_code, lang_name in lang_list:
@@ -49,6 +49,7 @@ from feedback.models import (
 )
 from utils.access import determine_access
 from utils.content import regenerate_nearest_cache
+from utils.exercise import invalidate_test_plans, schedule_reference_warmup
 from utils.files import generate_download_response
 
 # Forms
@@ -351,6 +352,7 @@ def save_file_upload_exercise(
         c_significant_stdout = form_data[f"command_{command_id}_significant_stdout"]
         c_significant_stderr = form_data[f"command_{command_id}_significant_stderr"]
         c_json_output = form_data[f"command_{command_id}_json_output"]
+        c_deterministic = form_data[f"command_{command_id}_deterministic"]
         c_return_value = form_data[f"command_{command_id}_return_value"]
         c_timeout = form_data[f"command_{command_id}_timeout"]
 
@@ -369,6 +371,7 @@ def save_file_upload_exercise(
         current_command.significant_stdout = c_significant_stdout
         current_command.significant_stderr = c_significant_stderr
         current_command.json_output = c_json_output
+        current_command.deterministic = c_deterministic
         current_command.return_value = c_return_value
         current_command.timeout = c_timeout
         current_command.ordinal_number = command_info.ordinal_number + command_count + 1  # Note
@@ -574,6 +577,9 @@ def file_upload_exercise(request, exercise_id=None, action=None):
         except IntegrityError as e:
             raise e
 
+        invalidate_test_plans(exercise.id)
+        schedule_reference_warmup(exercise)
+
         if action == "add":
             redirect_url = reverse(
                 "exercise_admin:file_upload_change",
@@ -896,6 +902,12 @@ def edit_instance_files(request):
                 if file_changed:
                     instance_file.save()
 
+            if file_changed:
+                for exercise_id in InstanceIncludeFileToExerciseLink.objects.filter(
+                    include_file=instance_file
+                ).values_list("exercise_id", flat=True):
+                    invalidate_test_plans(exercise_id)
+
         new_instance_files = {}
 
         # Create new instance files
@@ -1,5 +1,4 @@
 from django.conf import settings
-from django.core.cache import cache
 from django.db import IntegrityError
 from django.http import HttpResponseNotFound
 from django.template import loader
@@ -11,6 +10,7 @@ from faq.models import FaqQuestion, FaqToInstanceLink
 from faq.forms import FaqQuestionForm, FaqLinkForm
 from utils.access import is_course_staff
 from utils.archive import get_single_archived
+from utils.cache import cached_render, refresh_render
 
 
 def has_faq(instance, exercise, triggers):
@@ -21,7 +21,7 @@ def has_faq(instance, exercise, triggers):
     ).exists()
 
 
-def cache_panel(instance, exercise, lang_code):
+def _render_faq(instance, exercise, lang_code):
     faq_links = FaqToInstanceLink.objects.filter(
         instance=instance,
         exercise=exercise,
@@ -47,30 +47,37 @@ def cache_panel(instance, exercise, lang_code):
 
             exercise_faq.append((faq.hook, faq.question, answer_body))
 
-    cache.set(
+    return exercise_faq
+
+
+def cache_panel(instance, exercise, lang_code):
+    return refresh_render(
         f"{exercise.slug}_faq_{instance.slug}_{lang_code}",
-        exercise_faq,
-        timeout=None,
+        instance,
+        "faq",
+        lambda generation: _render_faq(instance, exercise, lang_code),
     )
 
-    return exercise_faq
 
+def regenerate_cache(instance, exercise, lang_codes=None):
+    if lang_codes is None:
+        lang_codes = [lang_code for lang_code, _ in settings.LANGUAGES]
 
-def regenerate_cache(instance, exercise):
-    for lang_code, _ in settings.LANGUAGES:
-        faq_key = f"{exercise.slug}_faq_{instance.slug}_{lang_code}"
-        cache.delete(faq_key)
+    for lang_code in lang_codes:
         cache_panel(instance, exercise, lang_code)
 
 
 def render_panel(request, course, instance, exercise, preopened=tuple()):
     lang_code = translation.get_language()
-    faq_list = cache.get(f"{exercise.slug}_faq_{instance.slug}_{lang_code}")
-    if not faq_list:
-        try:
-            faq_list = cache_panel(instance, exercise, lang_code)
-        except ValueError:
-            return HttpResponseNotFound(_("FAQ for this exercise was not found"))
+    try:
+        faq_list = cached_render(
+            f"{exercise.slug}_faq_{instance.slug}_{lang_code}",
+            instance,
+            "faq",
+            lambda generation: _render_faq(instance, exercise, lang_code),
+        )
+    except ValueError:
+        return HttpResponseNotFound(_("FAQ for this exercise was not found"))
 
     is_staff = is_course_staff(request.user, instance)
     t = loader.get_template("faq/faq_panel.html")
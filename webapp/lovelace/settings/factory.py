@@ -338,7 +338,12 @@ CELERY_ROUTES = {
         "queue": "privileged",
         "exchange": "privileged",
         "routing_key": "privileged"
-    }
+    },
+    "courses.regenerate-*": {
+        "queue": "privileged",
+        "exchange": "privileged",
+        "routing_key": "privileged"
+    },
 }
 
 # Cache settings
@@ -376,6 +381,53 @@ CACHES = {
     },
 }
 
+# Checker files and reference results are shared with the checker workers through
+# this cache. Use a Redis DB of its own that only the web server and the workers
+# can access, and set the same location for the workers. If it's not set, the
+# contents of checker files are sent with each answer and reference results are
+# not cached.
+if os.getenv("LOVELACE_CHECKER_CACHE"):
+    CACHES["checker"] = {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": os.environ["LOVELACE_CHECKER_CACHE"],
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "CONNECTION_POOL_KWARGS": _CACHE_CONNECTION_POOL_KWARGS,
+        },
+    }
+
+# Highlighted code is cached in each process for this many code blocks.
+# Set HIGHLIGHT_SHARED_CACHE to the name of a cache defined above to also share
+# highlighted code between processes. Shared entries expire after REDIS_LONG_EXPIRE.
+HIGHLIGHT_CACHE_SIZE = int(os.getenv("LOVELACE_HIGHLIGHT_CACHE_SIZE", 256))
+HIGHLIGHT_SHARED_CACHE = os.getenv("LOVELACE_HIGHLIGHT_SHARED_CACHE") or None
+
+# A cache regeneration of a course instance blocks new regenerations of the same
+# instance until it has finished or this many seconds have passed.
+REGENERATION_TIMEOUT = int(os.getenv("LOVELACE_REGENERATION_TIMEOUT", 60 * 60))
+
+# Rendered content (pages, content trees, term banks) is also kept in each
+# process for this many cache keys, so that unchanged values are not fetched
+# from the cache and unpacked on every request.
+RENDER_LOCAL_CACHE_SIZE = int(os.getenv("LOVELACE_RENDER_LOCAL_CACHE_SIZE", 256))
+
+# Rendered blocks of content pages that incremental rendering reuses after inline
+# edits are kept for this many seconds.
+BLOCK_CACHE_TIMEOUT = int(os.getenv("LOVELACE_BLOCK_CACHE_TIMEOUT", 60 * 60 * 24 * 7))
+
+# Course roles and enrollment states of users are cached for this many seconds.
+# Changes to enrollments, staff groups and course responsibles clear the cache.
+ACCESS_CACHE_TIMEOUT = int(os.getenv("LOVELACE_ACCESS_CACHE_TIMEOUT", 60))
+
+# Browsers keep the termbank of a course instance for this many seconds. Pages
+# link to the termbank with its version in the URL, so changes to terms are
+# shown regardless.
+TERMBANK_MAX_AGE = int(os.getenv("LOVELACE_TERMBANK_MAX_AGE", 60 * 60 * 24 * 7))
+
+# Content pages are sent in pieces so that the beginning of long pages is shown
+# before all of their content blocks have been rendered.
+STREAM_CONTENT_PAGES = not os.getenv("LOVELACE_DISABLE_CONTENT_STREAMING")
+
 # Stats generation is a time-consuming task. This configuration key allows you
 # to determine what hour of the day stats runs start
 STAT_GENERATION_HOUR = None
@@ -396,6 +448,32 @@ WORKER_FILE_SIZE = os.getenv("LOVELACE_WORKER_FILE_SIZE", 4 * (1024 ** 2))
 WORKER_CPU_TIME = os.getenv("LOVELACE_WORKER_CPU_TIME", 20)
 WORKER_MEMORY = int(os.getenv("LOVELACE_WORKER_MEMORY", 100 * (1024 ** 2)))
 
+# Number of tests of one submission that the checker runs at the same time, each
+# in its own directory, at most one per available CPU. With 1 the tests are run
+# one after another.
+CHECKER_TEST_PARALLELISM = int(os.getenv("LOVELACE_CHECKER_TEST_PARALLELISM", 1))
+
+# Exercise and instance files needed by the checker are sent to workers by their
+# content hash through the shared cache, where they are kept for this many
+# seconds after last use. Workers keep their own copies in CHECKER_FILE_DIR,
+# which must be owned by the worker user and have mode 0700, otherwise it is not
+# used. The least recently used copies are removed when the directory grows over
+# CHECKER_FILE_DIR_SIZE bytes.
+CHECKER_FILE_TIMEOUT = int(os.getenv("LOVELACE_CHECKER_FILE_TIMEOUT", 60 * 60 * 24 * 7))
+CHECKER_FILE_DIR = os.getenv("LOVELACE_CHECKER_FILE_DIR", "/var/cache/lovelace/checker-files")
+CHECKER_FILE_DIR_SIZE = int(os.getenv("LOVELACE_CHECKER_FILE_DIR_SIZE", 512 * 1024 ** 2))
+
+# Compiled test plans of file upload exercises are cached for this many seconds.
+# Saving an exercise in the exercise admin invalidates its plans immediately.
+TEST_PLAN_TIMEOUT = int(os.getenv("LOVELACE_TEST_PLAN_TIMEOUT", 60 * 60 * 24))
+
+# Reference results of tests whose commands are all deterministic are kept in the
+# checker cache for this many seconds, keyed by the test definition and the
+# checker files it uses.
+REFERENCE_RESULT_TIMEOUT = int(
+    os.getenv("LOVELACE_REFERENCE_RESULT_TIMEOUT", 60 * 60 * 24 * 7)
+)
+
 # Set PRIVATE_STORAGE_FS_PATH outside www root to make uploaded files
 # inaccessible through URLs
 # Set PRIVATE_STORAGE_X_SENDFILE to True if your configuration supports
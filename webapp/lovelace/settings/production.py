@@ -55,6 +55,7 @@ _PROTECTED_KEYS = [
     "LOVELACE_CELERY_RESULT",
     "LOVELACE_SECRET_KEY",
     "LOVELACE_REDIS_CACHE",
+    "LOVELACE_CHECKER_CACHE",
     "LOVELACE_DB_PASS",
     "LOVELACE_DB_HOST",
     "LOVELACE_DB_PORT",
@@ -2,6 +2,12 @@ from lovelace.settings.factory import *
 
 TEST_SETTINGS = True
 
+# Template assertions need the whole page to be rendered within the view
+STREAM_CONTENT_PAGES = False
+
+# Tests change staff groups between requests
+ACCESS_CACHE_TIMEOUT = 0
+
 INSTALLED_APPS = (
     'modeltranslation',
     'django.contrib.admin',
@@ -72,7 +78,23 @@ CACHES = {
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
-    }
+    },
+    "notify": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://localhost:6379/11",
+        "KEY_PREFIX": "lovelace_notify",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        }
+    },
+    "checker": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://localhost:6379/11",
+        "KEY_PREFIX": "lovelace_checker",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        }
+    },
 }
 
 WORKER_USERNAME = "enk"
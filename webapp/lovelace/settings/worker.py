@@ -58,6 +58,39 @@ CELERY_ROUTES = {
     }
 }
 
+# The checker gets exercise and instance files from the checker cache, and keeps
+# reference results there. It must have the same location as the checker cache
+# of the web server, see the main settings. Workers don't have access to the
+# web server's default cache.
+if os.getenv("LOVELACE_CACHE_USE_SSL"):
+    _CACHE_CONNECTION_POOL_KWARGS = {
+        "ssl_cert_reqs": "required",
+        "ssl_ca_certs": os.environ["LOVELACE_CLIENT_CA"],
+        "ssl_certfile": os.environ["LOVELACE_CLIENT_CERT"],
+        "ssl_keyfile": os.environ["LOVELACE_CLIENT_KEY"],
+    }
+else:
+    _CACHE_CONNECTION_POOL_KWARGS = {}
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+}
+if os.getenv("LOVELACE_CHECKER_CACHE"):
+    CACHES["checker"] = {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": os.environ["LOVELACE_CHECKER_CACHE"],
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "CONNECTION_POOL_KWARGS": _CACHE_CONNECTION_POOL_KWARGS,
+        },
+    }
+
+# Local copies of checker files, see the main settings for details
+CHECKER_FILE_DIR = os.getenv("LOVELACE_CHECKER_FILE_DIR", "/var/cache/lovelace/checker-files")
+CHECKER_FILE_DIR_SIZE = int(os.getenv("LOVELACE_CHECKER_FILE_DIR_SIZE", 512 * 1024 ** 2))
+
 TMP_PATH = "/tmp"
 CHECKING_ENV = json.loads(os.environ["LOVELACE_CHECKER_ENV"])
 WORKER_USERNAME = os.getenv("LOVELACE_WORKER_USER", "nobody")
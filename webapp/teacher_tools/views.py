@@ -22,7 +22,9 @@ from django.urls import reverse
 from django.utils import translation
 from lovelace.celery import app as celery_app
 
-from utils.access import determine_access, is_course_staff, ensure_responsible, ensure_staff
+from utils.access import (
+    clear_access_cache, determine_access, is_course_staff, ensure_responsible, ensure_staff
+)
 from utils.archive import get_single_archived
 from utils.content import get_course_instance_tasks, get_embedded_parent
 from utils.notify import send_welcome_email
@@ -241,6 +243,7 @@ def transfer_records(request, course, instance, user):
         CourseEnrollment.objects.filter(student=user, instance=instance).update(
             enrollment_state="TRANSFERED"
         )
+        clear_access_cache(user.id, instance.id)
         try:
             new_enrollment = CourseEnrollment.objects.get(student=user, instance=target_instance)
             new_enrollment.enrolled_state = "ACCEPTED"
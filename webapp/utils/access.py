@@ -1,8 +1,11 @@
 from functools import wraps
 
 
+from django.db import transaction
 from django.db.models import Q
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.http import HttpResponseForbidden
 from django.utils.translation import gettext as _
 from reversion.models import Version
@@ -18,6 +21,8 @@ def determine_access(user, content, responsible_only=False):
     * the user is the main responsible of a course the content is found in
     * the user is a member of the staff group of a course the content is found
       in (can be disabled by setting responsible_only to True)
+
+    The check is done with one query from the content access index.
     """
 
     if not user.is_authenticated:
@@ -27,23 +32,86 @@ def determine_access(user, content, responsible_only=False):
         return True
 
     if user.is_staff:
-        if Version.objects.get_for_object(content).filter(revision__user=user).exists():
-            return True
+        return (
+            cm.ContentAccess.objects.filter(content=content)
+            .filter(access_filter(user, responsible_only))
+            .exists()
+        )
 
-        if cm.Course.objects.filter(
-            Q(courseinstance__contentgraph__content=content)
-            | Q(courseinstance__contentgraph__content__embedded_pages=content)
-        ).filter(main_responsible=user):
-            return True
+    return False
 
-        if not responsible_only:
-            if cm.Course.objects.filter(
-                Q(courseinstance__contentgraph__content=content)
-                | Q(courseinstance__contentgraph__content__embedded_pages=content)
-            ).filter(staff_group__user=user):
-                return True
 
-    return False
+def access_filter(user, responsible_only=False):
+    """
+    Returns a Q object that matches the content access index rows that give
+    the user access to their content. See determine_access for the rules.
+    """
+
+    condition = Q(author=user) | Q(course__main_responsible=user)
+    if not responsible_only:
+        condition |= Q(course__staff_group__user=user)
+    return condition
+
+
+def update_content_access(content_ids):
+    """
+    Updates the course rows of the content access index for the given content
+    pages. This needs to be done when the pages are linked to or unlinked from
+    course instances, either directly or through a page that embeds them. The
+    signal handlers in courses.models call this when content graph nodes and
+    embedded links are saved or deleted.
+    """
+
+    content_ids = set(
+        cm.ContentPage.objects.filter(id__in=content_ids).values_list("id", flat=True)
+    )
+    if not content_ids:
+        return
+
+    courses = set(
+        cm.ContentGraph.objects.filter(content_id__in=content_ids)
+        .values_list("content_id", "instance__course_id")
+    )
+    courses.update(
+        cm.EmbeddedLink.objects.filter(
+            embedded_page_id__in=content_ids, parent__contentgraph__isnull=False
+        ).values_list("embedded_page_id", "parent__contentgraph__instance__course_id")
+    )
+
+    with transaction.atomic():
+        cm.ContentAccess.objects.filter(content_id__in=content_ids, course__isnull=False).delete()
+        cm.ContentAccess.objects.bulk_create(
+            [
+                cm.ContentAccess(content_id=content_id, course_id=course_id)
+                for content_id, course_id in courses
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def add_content_authors(revision, versions):
+    """
+    Adds the user of a revision to the content access index as an author of
+    the content pages that have versions in the revision.
+    """
+
+    if revision.user_id is None:
+        return
+
+    content_type = ContentType.objects.get_for_model(cm.ContentPage)
+    content_ids = cm.ContentPage.objects.filter(
+        id__in=[
+            int(version.object_id) for version in versions
+            if version.content_type_id == content_type.id
+        ]
+    ).values_list("id", flat=True)
+    cm.ContentAccess.objects.bulk_create(
+        [
+            cm.ContentAccess(content_id=content_id, author_id=revision.user_id)
+            for content_id in content_ids
+        ],
+        ignore_conflicts=True,
+    )
 
 
 def determine_media_access(user, media):
@@ -77,6 +145,100 @@ def determine_media_access(user, media):
     return False
 
 
+# Access facts kept on user objects are only used while this stays the same. It's
+# changed whenever cached facts are cleared, so that a request doesn't keep using
+# facts that it has changed itself.
+_memo_generation = 0
+
+
+def _access_cache_key(user_id, instance_id):
+    return f"{user_id}_{instance_id}_access"
+
+
+def _invalidate_memos():
+    global _memo_generation
+    _memo_generation += 1
+
+
+def get_course_access(user, instance):
+    """
+    Returns the facts that access checks need about an authenticated user in a
+    course instance as a dictionary with the keys:
+    * staff_group: whether the user is in the staff group of the course
+    * responsible: whether the user is the main responsible of the course
+    * enrollment: the enrollment state of the user, or None if not enrolled
+
+    The facts are kept on the user object for the rest of the request, and in
+    the cache for ACCESS_CACHE_TIMEOUT seconds. Changes to enrollments, staff
+    groups and course responsibles clear the cached facts when they are
+    committed.
+    """
+
+    if getattr(user, "_course_access_generation", None) != _memo_generation:
+        user._course_access_cache = {}
+        user._course_access_generation = _memo_generation
+
+    try:
+        return user._course_access_cache[instance.id]
+    except KeyError:
+        pass
+
+    key = _access_cache_key(user.id, instance.id)
+    facts = cache.get(key)
+    if facts is None:
+        course = instance.course
+        facts = {
+            "staff_group": (
+                course.staff_group_id is not None
+                and user.groups.filter(id=course.staff_group_id).exists()
+            ),
+            "responsible": course.main_responsible_id == user.id,
+            "enrollment": (
+                cm.CourseEnrollment.objects.filter(instance=instance, student=user)
+                .values_list("enrollment_state", flat=True)
+                .first()
+            ),
+        }
+        cache.set(key, facts, timeout=getattr(settings, "ACCESS_CACHE_TIMEOUT", 60))
+
+    user._course_access_cache[instance.id] = facts
+    return facts
+
+
+def clear_access_cache(user_id, instance_id):
+    """
+    Clears the cached access facts of a user in a course instance. This needs
+    to be called when the enrollment of the user is changed without saving or
+    deleting the enrollment object, e.g. with QuerySet.update.
+    """
+
+    clear_course_access_cache([user_id], [instance_id])
+
+
+def clear_course_access_cache(user_ids, instance_ids):
+    """
+    Clears the cached access facts of the users in the course instances. Facts
+    kept on user objects are not used after this. The cache is cleared again
+    when the current transaction is committed, because other requests may have
+    cached the previous facts before that.
+    """
+
+    keys = [
+        _access_cache_key(user_id, instance_id)
+        for user_id in user_ids
+        for instance_id in instance_ids
+    ]
+    if not keys:
+        return
+
+    def clear():
+        cache.delete_many(keys)
+        _invalidate_memos()
+
+    clear()
+    transaction.on_commit(clear)
+
+
 def is_course_staff(user, instance, responsible_only=False):
     """
     Determines whether the user is part of the staff of a course.
@@ -92,15 +254,27 @@ def is_course_staff(user, instance, responsible_only=False):
         return True
 
     if user.is_staff:
-        if not responsible_only:
-            if user in instance.course.staff_group.user_set.get_queryset():
-                return True
+        access = get_course_access(user, instance)
+        if not responsible_only and access["staff_group"]:
+            return True
 
-        return user == instance.course.main_responsible
+        return access["responsible"]
 
     return False
 
 
+def is_enrolled(user, instance):
+    """
+    Determines whether the user has an accepted enrollment in a course
+    instance.
+    """
+
+    if not user.is_authenticated:
+        return False
+
+    return get_course_access(user, instance)["enrollment"] == "ACCEPTED"
+
+
 
 # ^
 # |
@@ -166,17 +340,7 @@ def ensure_enrolled_or_staff(function):
 
     @wraps(function)
     def wrap(request, course, instance, *args, **kwargs):
-        try:
-            if cm.CourseEnrollment.objects.get(
-                instance=instance, student=request.user
-            ).is_enrolled():
-                return function(request, course, instance, *args, **kwargs)
-        except cm.CourseEnrollment.DoesNotExist:
-            pass
-        except TypeError:
-            return HttpResponseForbidden(_("You must be enrolled to perform this action."))
-
-        if is_course_staff(request.user, instance):
+        if is_enrolled(request.user, instance) or is_course_staff(request.user, instance):
             return function(request, course, instance, *args, **kwargs)
 
         return HttpResponseForbidden(_("You must be enrolled to perform this action."))
@@ -1,54 +1,127 @@
 import datetime
 import os.path
 from collections import defaultdict
-from django.core.exceptions import ObjectDoesNotExist
-from django.db import models, transaction
-from django.db.models.query import QuerySet
+from django.contrib.contenttypes.models import ContentType
+from django.db import router
 from reversion.models import Version
 from reversion import revisions
 
 
-class CancelRevert(Exception):
+def _find_follow_field(model, name):
     """
-    An exception used to cause a rollback after reading data from the
-    reverted database state.
+    Finds the field or reverse relation of a model that a follow option refers
+    to. Reverse relations are referred to with their accessor names.
     """
 
+    for field in model._meta.get_fields():
+        if field.auto_created and not field.concrete:
+            if field.get_accessor_name() == name:
+                return field
+        elif field.name == name:
+            return field
+    raise ValueError(f"{model.__name__} has no relation {name}")
+
+
+def _sort_archived(objects, model):
+    """
+    Sorts archived objects the same way a query would with the model's default
+    ordering. Only orderings by the model's own fields are supported, objects
+    are otherwise kept in primary key order.
+    """
+
+    objects.sort(key=lambda obj: obj.pk)
+    for field_name in reversed(model._meta.ordering or []):
+        if not isinstance(field_name, str) or "__" in field_name or field_name == "?":
+            continue
+        descending = field_name.startswith("-")
+        field_name = field_name.lstrip("-")
+        objects.sort(
+            key=lambda obj: (getattr(obj, field_name) is None, getattr(obj, field_name)),
+            reverse=descending,
+        )
+    return objects
+
 
-# TODO: add support to use prefetch_related on followed sets.
 def get_archived_instances(main_obj, revision_id):
     """
     Gets archived instances of a model and any models listed in its follow
-    options. This approach is modeled after how reversion's version history
-    admin fetches history information: it reverts the database to a given
-    revision, reads all there model instances into memory, and finally causes a
-    rollback to restore the database to the most recent state.
+    options. The instances are built from the serialized data of the versions
+    in the revision without touching the live rows: the versions of all the
+    followed models are loaded with one query, and reverse relations are
+    resolved by matching the archived foreign keys to the parent object.
+    Related objects that are missing from the revision are read from their
+    current state, same as reverting would leave them.
 
     Returns a dictionary that contains each related set as a list (using the
     set's attribute name as the key), and the archived version of the parent
     object (using "self" as the key)
     """
 
-    by_model = defaultdict(list)
-    version = Version.objects.get_for_object(main_obj).get(revision=revision_id)
+    model = main_obj.__class__
+    db = router.db_for_write(model)
+    follow = revisions._get_options(model).follow
+    fields = {name: _find_follow_field(model, name) for name in follow}
+    content_types = ContentType.objects.get_for_models(
+        model, *(field.related_model for field in fields.values())
+    )
+
+    versions = defaultdict(dict)
+    for version in Version.objects.filter(
+        revision_id=revision_id,
+        db=db,
+        content_type__in=content_types.values(),
+    ).select_related("content_type"):
+        versions[version.content_type_id][version.object_id] = version
+
     try:
-        with transaction.atomic(using=version.db):
-            version.revision.revert(delete=True)
-            by_model["self"] = version._object_version.object
-            follow = revisions._get_options(main_obj).follow
-            for field in follow:
-                try:
-                    follow_obj = getattr(main_obj, field)
-                except ObjectDoesNotExist:
-                    by_model[field] = None
-                    continue
-                if isinstance(follow_obj, models.Model):
-                    by_model[field] = follow_obj
-                elif isinstance(follow_obj, (models.Manager, QuerySet)):
-                    by_model[field] = list(follow_obj.get_queryset().all())
-            raise CancelRevert
-    except CancelRevert:
-        pass
+        version = versions[content_types[model].id][str(main_obj.pk)]
+    except KeyError:
+        raise Version.DoesNotExist(
+            f"{model.__name__} {main_obj.pk} has no version in revision {revision_id}"
+        )
+
+    def archived_objects(related_model):
+        return [
+            related.object
+            for related in (
+                related_version._object_version
+                for related_version in versions[content_types[related_model].id].values()
+            )
+        ]
+
+    def archived_or_current(related_model, pks):
+        archived = {
+            obj.pk: obj for obj in archived_objects(related_model) if obj.pk in pks
+        }
+        missing = [pk for pk in pks if pk not in archived]
+        if missing:
+            archived.update(related_model._default_manager.using(db).in_bulk(missing))
+        return [archived[pk] for pk in pks if pk in archived]
+
+    by_model = defaultdict(list)
+    by_model["self"] = version._object_version.object
+    for name, field in fields.items():
+        related_model = field.related_model
+        if field.auto_created and not field.concrete:
+            related = [
+                obj for obj in archived_objects(related_model)
+                if getattr(obj, field.field.attname) == main_obj.pk
+            ]
+            if field.one_to_one:
+                by_model[name] = related[0] if related else None
+            elif field.one_to_many:
+                by_model[name] = _sort_archived(related, related_model)
+            else:
+                raise ValueError(f"Following {name} of {model.__name__} is not supported")
+        elif field.many_to_many:
+            pks = version.field_dict.get(field.attname, [])
+            by_model[name] = _sort_archived(
+                archived_or_current(related_model, pks), related_model
+            )
+        else:
+            pk = version.field_dict.get(field.attname)
+            related = archived_or_current(related_model, [pk]) if pk is not None else []
+            by_model[name] = related[0] if related else None
 
     return by_model
 
@@ -0,0 +1,276 @@
+"""
+Utils for caching data within a single process, and for caching rendered
+content in the shared cache with generation counters and render locks.
+"""
+
+import pickle
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache as shared_cache
+
+
+class LRUCache:
+    """
+    A bounded least recently used cache that lives in the process memory. Use
+    this for data that is expensive to produce and safe to keep around in each
+    worker process. The cache is thread safe.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Rendered content in the shared cache
+# |
+# v
+
+# Seconds that a render lock is held at most, and seconds that a request waits
+# for another request to finish rendering before rendering by itself.
+RENDER_LOCK_TIMEOUT = 60
+RENDER_LOCK_WAIT = 10
+
+# Version of the packed format. Values packed in another format are treated as
+# missing and rendered again.
+PACK_VERSION = 1
+
+# Rendered values that have been read or rendered in this process, as
+# (stamp, tag, value) tuples. Every value stored to the shared cache gets a
+# new stamp, so a value kept here is only used while the stamp in the shared
+# cache still matches. The values are shared by all requests of the process
+# and must not be modified.
+_local_renders = LRUCache(getattr(settings, "RENDER_LOCAL_CACHE_SIZE", 256))
+
+
+def generation_key(instance, kind):
+    return f"{instance.slug}_{kind}_generation"
+
+
+def _new_generation():
+    # Generations start from the current time so that they don't repeat when a
+    # generation key has been evicted and is started again
+    return time.time_ns()
+
+
+def current_generation(key):
+    """
+    Gets the generation stored in a generation key, starting a new generation
+    if the key is missing. Values are current only if they were stored with
+    exactly this generation.
+    """
+
+    return shared_cache.get_or_set(key, _new_generation, timeout=None)
+
+
+def bump_generation_key(key):
+    """
+    Moves a generation key to its next generation, or starts a new generation
+    if the key is missing.
+    """
+
+    try:
+        shared_cache.incr(key)
+    except ValueError:
+        if not shared_cache.add(key, _new_generation(), timeout=None):
+            shared_cache.incr(key)
+
+
+def bump_generation(instance, kind):
+    """
+    Marks everything of the given kind (e.g. "content" or "tree") that has been
+    cached for the course instance as stale. Stale values are still served
+    until they have been rendered again, so that a change doesn't cause every
+    request to render the same content at once.
+    """
+
+    bump_generation_key(generation_key(instance, kind))
+
+
+def _canonical(value, seen):
+    """
+    Returns a copy of value where equal strings of the same type are replaced
+    with one shared object, so that pickle only stores each of them once.
+    Dictionaries and lists are copied rather than shared, so that they are
+    still separate objects after unpacking.
+    """
+
+    value_type = type(value)
+    if isinstance(value, str):
+        return seen.setdefault((value_type, value), value)
+    if value_type is list:
+        return [_canonical(item, seen) for item in value]
+    if value_type is tuple:
+        return tuple(_canonical(item, seen) for item in value)
+    if value_type is dict:
+        return {_canonical(key, seen): _canonical(item, seen) for key, item in value.items()}
+    return value
+
+
+def pack(tag, value):
+    """
+    Packs a value into the compact format that is used for rendered content in
+    the shared cache. The tag (e.g. a generation number) is kept outside of the
+    compressed data so that it can be checked cheaply.
+    """
+
+    data = pickle.dumps(_canonical(value, {}), protocol=pickle.HIGHEST_PROTOCOL)
+    return (PACK_VERSION, tag, zlib.compress(data))
+
+
+def unpack(cached):
+    """
+    Unpacks a value packed with pack. Returns a (tag, value) tuple, or None if
+    cached is None or was packed in another format.
+    """
+
+    if isinstance(cached, tuple) and len(cached) == 3 and cached[0] == PACK_VERSION:
+        return cached[1], pickle.loads(zlib.decompress(cached[2]))
+    return None
+
+
+def _stamp_key(key):
+    return f"{key}_stamp"
+
+
+def store_rendered(values, tag, timeout=None):
+    """
+    Packs and stores rendered values to the shared cache with the given tag,
+    values being a dictionary of cache keys and values. Each key is given a
+    new stamp so that copies of the previous values kept in other processes
+    are no longer used.
+    """
+
+    stored = {}
+    for key, value in values.items():
+        stamp = uuid.uuid4().hex
+        stored[key] = pack(tag, value)
+        stored[_stamp_key(key)] = stamp
+        _local_renders.set(key, (stamp, tag, value))
+    shared_cache.set_many(stored, timeout=timeout)
+
+
+def delete_rendered(keys):
+    """
+    Deletes rendered values stored with store_rendered from the shared cache.
+    """
+
+    keys = list(keys)
+    shared_cache.delete_many(keys + [_stamp_key(key) for key in keys])
+
+
+def _get_rendered(key, gen_key):
+    """
+    Gets the current generation and the (tag, value) tuple of a rendered value,
+    using the copy kept in this process if it's still current. Only the small
+    generation and stamp keys are read from the shared cache in that case.
+    """
+
+    stamp_key = _stamp_key(key)
+    local = _local_renders.get(key)
+    if local is None:
+        values = shared_cache.get_many([key, gen_key, stamp_key])
+        cached = unpack(values.get(key))
+    else:
+        values = shared_cache.get_many([gen_key, stamp_key])
+        if values.get(stamp_key) is not None and local[0] == values[stamp_key]:
+            cached = local[1:]
+        else:
+            cached = unpack(shared_cache.get(key))
+
+    stamp = values.get(stamp_key)
+    if cached is not None and stamp is not None:
+        _local_renders.set(key, (stamp, *cached))
+
+    generation = values.get(gen_key)
+    if generation is None:
+        generation = current_generation(gen_key)
+    return generation, cached
+
+
+def _render_and_store(key, generation, render, timeout):
+    value = render(generation)
+    store_rendered({key: value}, generation, timeout)
+    return value
+
+
+def cached_render(key, instance, kind, render, timeout=None):
+    """
+    Gets a rendered value of the given kind from the shared cache. If the value
+    is missing or was not stored with the instance's current generation of the
+    kind, it's rendered again by calling render with the current generation
+    and stored. Only one request renders a key at a time. Others are given the
+    stale value meanwhile, or wait for the render to finish if there is none.
+
+    Values are also kept in a bounded cache in the process memory, so that a
+    value that has not changed is not transferred and unpacked again.
+    """
+
+    gen_key = generation_key(instance, kind)
+    generation, cached = _get_rendered(key, gen_key)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+
+    lock_key = f"{key}_lock"
+    if not shared_cache.add(lock_key, 1, timeout=RENDER_LOCK_TIMEOUT):
+        if cached is not None:
+            return cached[1]
+
+        deadline = time.monotonic() + RENDER_LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(0.1)
+            cached = unpack(shared_cache.get(key))
+            if cached is not None and cached[0] == generation:
+                return cached[1]
+
+        return _render_and_store(key, generation, render, timeout)
+
+    try:
+        return _render_and_store(key, generation, render, timeout)
+    finally:
+        shared_cache.delete(lock_key)
+
+
+def refresh_render(key, instance, kind, render, timeout=None):
+    """
+    Renders a value of the given kind again and stores it to the shared cache
+    with the instance's current generation of the kind. The previous value is
+    served to other requests until the new one has been stored.
+    """
+
+    generation = current_generation(generation_key(instance, kind))
+    return _render_and_store(key, generation, render, timeout)
@@ -4,6 +4,8 @@ from collections import defaultdict
 from functools import wraps
 import django.conf
 from django.contrib import messages
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Count, IntegerField, Value
 from django.http import HttpResponseNotFound
 from django.template import engines, loader
 from django.utils.safestring import mark_safe
@@ -13,6 +15,7 @@ from reversion.models import Version, Revision
 from courses import markupparser
 import courses.models as cm
 from utils.access import is_course_staff
+from utils.base import get_deadline_urgency
 from utils.exercise import best_result
 from utils.notify import get_notifications
 
@@ -33,16 +36,6 @@ def first_title_from_content(content_text):
 
     return title, anchor
 
-def _parent_ordinal_sort(pair):
-    node = pair[0]
-    ordinals = [node.ordinal_number]
-    parent_node = node.parentnode
-    while parent_node is not None:
-        ordinals.insert(0, parent_node.ordinal_number)
-        parent_node = parent_node.parentnode
-    return ordinals
-
-
 def get_answer_count_meta(answer_count):
     t = engines["django"].from_string(
         "{% load i18n %}{% blocktrans count counter=answer_count %}<span class='answer-count'>"
@@ -88,22 +81,26 @@ def get_course_instance_tasks(instance, deadline_before=None):
         if page_task_links:
             task_pages.append((content_link, page_task_links))
 
-    task_pages.sort(key=_parent_ordinal_sort)
+    paths = cm.ContentGraph.objects.ordinal_paths(instance)
+    task_pages.sort(key=lambda pair: paths[pair[0].id])
     return task_pages
 
 
-def regenerate_nearest_cache(content):
+def regenerate_nearest_cache(content, incremental=False):
     """
     Executes a cache regen for content. As caching is done by actual page, this means either
     regenerating cache of the content itself if it is a top-level page, or its embed parent if
-    it's an embedded page.
+    it's an embedded page. Set incremental to True after editing the markup of the content to
+    only render the blocks that were changed.
     """
 
     for cg in cm.ContentGraph.objects.filter(content=content, revision=None):
-        content.regenerate_cache(cg.instance, active_only=True)
+        content.regenerate_cache(cg.instance, active_only=True, incremental=incremental)
     else:
         for embed in cm.EmbeddedLink.objects.filter(embedded_page=content):
-            embed.parent.regenerate_cache(embed.instance, active_only=True)
+            embed.parent.regenerate_cache(
+                embed.instance, active_only=True, incremental=incremental
+            )
 
 
 def get_embedded_parent(content, instance):
@@ -121,6 +118,119 @@ def get_embedded_parent(content, instance):
         return link.parent, True
 
 
+def preload_embedded_pages(slugs, instance, parent):
+    """
+    Resolves the embedded pages of a parent page with a constant number of
+    queries. Returns a dictionary with page slugs as keys and (page, revision,
+    choices) tuples as values, where page is the archived version of the page
+    if the embedded link points to a revision. Slugs that don't match any page
+    are left out. Will accept None as parent, in which case the current
+    version of each page is returned.
+    """
+
+    slugs = set(slugs)
+    pages = {}
+    revisions = {}
+    if parent is not None:
+        links = cm.EmbeddedLink.objects.filter(
+            embedded_page__slug__in=slugs, instance=instance, parent=parent
+        ).select_related("embedded_page")
+        for link in links:
+            pages[link.embedded_page.slug] = link.embedded_page
+            revisions[link.embedded_page.slug] = link.revision
+
+    missing = slugs.difference(pages)
+    if missing:
+        for page in cm.ContentPage.objects.filter(slug__in=missing):
+            pages[page.slug] = page
+            revisions[page.slug] = None
+
+    archived = {}
+    archived_ids = {
+        str(page.id): revisions[slug]
+        for slug, page in pages.items() if revisions[slug] is not None
+    }
+    if archived_ids:
+        versions = Version.objects.get_for_model(cm.ContentPage).filter(
+            object_id__in=archived_ids.keys(), revision_id__in=archived_ids.values()
+        )
+        for version in versions:
+            archived[(version.object_id, version.revision_id)] = version._object_version.object
+
+    choice_sets = {
+        "MULTIPLE_CHOICE_EXERCISE": cm.MultipleChoiceExerciseAnswer,
+        "CHECKBOX_EXERCISE": cm.CheckboxExerciseAnswer,
+    }
+    choice_page_ids = defaultdict(list)
+    for slug, page in pages.items():
+        if revisions[slug] is None and page.content_type in choice_sets:
+            choice_page_ids[page.content_type].append(page.id)
+
+    current_choices = defaultdict(list)
+    for content_type, page_ids in choice_page_ids.items():
+        choice_model = choice_sets[content_type]
+        for choice in choice_model.objects.filter(exercise__in=page_ids).order_by("ordinal"):
+            current_choices[choice.exercise_id].append(choice)
+
+    resolved = {}
+    for slug, page in pages.items():
+        revision = revisions[slug]
+        if revision is None:
+            if page.content_type in choice_sets:
+                choices = current_choices[page.id]
+            else:
+                choices = page.get_choices(page)
+        else:
+            # Same as get_single_archived, the current version is used if the
+            # revision is missing
+            page = archived.get((str(page.id), revision), page)
+            choices = page.get_choices(page, revision=revision)
+        resolved[slug] = (page, revision, choices)
+    return resolved
+
+
+def preload_embedded_progress(pages, user, instance):
+    """
+    Loads the answer counts and evaluations of a user in the given embedded
+    pages with two queries, so that the embed_frame tag doesn't need to query
+    them for each page separately. The answer counts of all pages are counted
+    in one query that combines the answer querysets of the pages' content
+    types. Returns a dictionary with page slugs as keys and (answer count,
+    evaluation, quotient) tuples as values.
+    """
+
+    pages = [page for page in pages if page.is_answerable()]
+    if not pages:
+        return {}
+
+    answer_counts = [
+        page.get_user_answers(page, user, instance)
+        .prefetch_related(None)
+        .order_by()
+        .annotate(page_id=Value(page.id, output_field=IntegerField()))
+        .values("page_id")
+        .annotate(answer_count=Count("pk"))
+        .values_list("page_id", "answer_count")
+        for page in pages
+    ]
+    answer_counts = dict(answer_counts[0].union(*answer_counts[1:], all=True))
+
+    completions = cm.UserTaskCompletion.objects.filter(
+        user=user, instance=instance, exercise__in=pages
+    ).values_list("exercise_id", "state", "points")
+    evaluations = {
+        exercise_id: (state, points) for exercise_id, state, points in completions
+    }
+
+    return {
+        page.slug: (
+            answer_counts.get(page.id, 0),
+            *evaluations.get(page.id, ("unanswered", 0)),
+        )
+        for page in pages
+    }
+
+
 # Modified from reversion.models.Revision.revert
 # NOTE: Outdated, functions in utils.archive should be used.
 def get_archived_instances(main_obj, revision_id):
@@ -214,6 +324,73 @@ def get_embedded_media_image(name, instance, parent):
     return image_object
 
 
+def preload_embedded_media(names, instance, parent):
+    """
+    Resolves embedded media of a parent page with a constant number of
+    queries. Returns a dictionary with "file", "image" and "video" keys, each
+    containing a dictionary of media objects by name. Files and images are
+    chosen the same way as in get_embedded_media_file and
+    get_embedded_media_image, while video links are always the current version.
+    Names that are ambiguous or don't match any media are left out, so that
+    resolving them individually gives the same result as before.
+    """
+
+    names = set(names)
+    media = {"file": {}, "image": {}, "video": {}}
+    if not names:
+        return media
+
+    links = defaultdict(list)
+    for link in cm.CourseMediaLink.objects.filter(
+        media__name__in=names, instance=instance, parent=parent
+    ).select_related("media__file", "media__image"):
+        links[link.media.name].append(link)
+
+    archived = defaultdict(dict)
+    for name, name_links in links.items():
+        if len(name_links) > 1:
+            continue
+        link = name_links[0]
+        for kind in ("file", "image"):
+            try:
+                media_object = getattr(link.media, kind)
+            except ObjectDoesNotExist:
+                continue
+            if link.revision is None:
+                media[kind][name] = media_object
+            else:
+                archived[type(media_object)][(str(media_object.id), link.revision)] = (kind, name)
+
+    for model, wanted in archived.items():
+        versions = Version.objects.get_for_model(model).filter(
+            object_id__in={object_id for object_id, __ in wanted},
+            revision_id__in={revision for __, revision in wanted},
+        )
+        for version in versions:
+            try:
+                kind, name = wanted[(version.object_id, version.revision_id)]
+            except KeyError:
+                continue
+            media_object = version._object_version.object
+            media_object.name = version.field_dict["name"]
+            media[kind][name] = media_object
+
+    unlinked = names.difference(links)
+    for kind, model in (("file", cm.File), ("image", cm.Image), ("video", cm.VideoLink)):
+        if kind == "video":
+            queryset = model.objects.filter(name__in=names)
+        else:
+            queryset = model.objects.filter(name__in=unlinked)
+        by_name = defaultdict(list)
+        for media_object in queryset:
+            by_name[media_object.name].append(media_object)
+        for name, objects in by_name.items():
+            if len(objects) == 1:
+                media[kind][name] = objects[0]
+
+    return media
+
+
 def system_messages(view_func):
     """
     Retrieves messages that should be shown to the user. This includes the cookie
@@ -345,7 +522,7 @@ def course_tree(tree, node, user, instance_obj, enrolled=False, staff=False):
         "require_enroll": node.require_enroll,
         "page_count": page_count,
         "deadline": deadline,
-        "urgency": get_deadline_urgency(deadline),
+        "urgency": get_deadline_urgency(deadline, datetime.datetime.now()),
     }
 
     if list_item not in tree:
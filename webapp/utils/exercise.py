@@ -1,11 +1,21 @@
 import base64
+import hashlib
 import json
 import logging
+from django.conf import settings
+from django.core.cache import cache
 from django.template import loader
 from django.urls import reverse
+from django.utils import translation
 from courses import markupparser
 from utils.archive import get_single_archived, get_archived_instances
-from utils.files import get_file_contents_b64
+from utils.cache import bump_generation_key, current_generation
+from utils.files import (
+    get_checker_cache,
+    get_file_contents_b64,
+    store_checker_file,
+    touch_checker_files,
+)
 import courses.models as cm
 
 INCORRECT = 0
@@ -20,9 +30,34 @@ LINT_E = 13  # 13
 
 logger = logging.getLogger(__name__)
 
+
+def _test_plan_generation_key(exercise_id):
+    return f"{exercise_id}_testplan_generation"
+
+
+def invalidate_test_plans(exercise_id):
+    """
+    Marks the compiled test plans of a file upload exercise as stale in all
+    revisions, instances and languages. Call this after the exercise, its
+    tests or the files it uses have been changed.
+    """
+
+    bump_generation_key(_test_plan_generation_key(exercise_id))
+
+
 # NOTE: the amount of reverts caused by this is disgusting.
-def file_upload_payload(exercise, student_files, instance, revision=None):
-    payload = {"resources": {"files_to_check": {}, "checker_files": {}}, "tests": []}
+def compile_test_plan(exercise, instance, revision=None, include_contents=False):
+    """
+    Compiles the tests of a file upload exercise into the part of the checker
+    payload that is the same for every submission: the tests with their
+    stages and commands, and the checker files referred to by their hashes
+    in the checker file store. With include_contents the contents of the
+    checker files are also included, for when the store has dropped them. They
+    are always included if there is no checker cache to store them in.
+    """
+
+    include_contents = include_contents or get_checker_cache() is None
+    plan = {"checker_files": {}, "tests": []}
     if revision is not None:
         archived = get_archived_instances(exercise, revision)
         exercise = archived["self"]
@@ -32,16 +67,13 @@ def file_upload_payload(exercise, student_files, instance, revision=None):
         if not instance_file_links:
             instance_file_links = exercise.instanceincludefiletoexerciselink_set.get_queryset()
     else:
-        tests = exercise.fileexercisetest_set.get_queryset()
+        tests = exercise.fileexercisetest_set.prefetch_related(
+            "fileexerciseteststage_set__fileexercisetestcommand_set",
+            "required_files__file_settings",
+            "required_instance_files",
+        )
         instance_file_links = exercise.instanceincludefiletoexerciselink_set.get_queryset()
 
-    # Resources
-    for a_file in student_files:
-        a_file.seek(0)
-        payload["resources"]["files_to_check"][a_file.name] = base64.b64encode(
-            a_file.read()
-        ).decode("utf-8")
-
     all_required_exercise = set()
     all_required_instance = set()
 
@@ -89,6 +121,7 @@ def file_upload_payload(exercise, student_files, instance, revision=None):
                         "ordinal": command.ordinal_number,
                         "timeout": command.timeout.total_seconds(),
                         "json_output": command.json_output,
+                        "deterministic": command.deterministic,
                         "stdout": command.significant_stdout,
                         "stderr": command.significant_stderr,
                     }
@@ -103,15 +136,17 @@ def file_upload_payload(exercise, student_files, instance, revision=None):
                 }
             )
 
-        payload["tests"].append(test_payload)
+        plan["tests"].append(test_payload)
 
     for ex_file in all_required_exercise:
-        payload["resources"]["checker_files"][f"ex-{ex_file.id}"] = {
-            "content": get_file_contents_b64(ex_file),
+        plan["checker_files"][f"ex-{ex_file.id}"] = {
+            "hash": store_checker_file(ex_file),
             "purpose": ex_file.file_settings.purpose,
             "name": ex_file.file_settings.name,
             "chmod": ex_file.file_settings.chmod_settings,
         }
+        if include_contents:
+            plan["checker_files"][f"ex-{ex_file.id}"]["contents"] = get_file_contents_b64(ex_file)
 
     instance_links = instance.instanceincludefiletoinstancelink_set.get_queryset()
     for if_link in instance_file_links:
@@ -122,12 +157,90 @@ def file_upload_payload(exercise, student_files, instance, revision=None):
             i_file = if_link.include_file
 
         if i_file.id in all_required_instance:
-            payload["resources"]["checker_files"][f"in-{i_file.id}"] = {
-                "content": get_file_contents_b64(i_file),
+            plan["checker_files"][f"in-{i_file.id}"] = {
+                "hash": store_checker_file(i_file),
                 "purpose": if_link.file_settings.purpose,
                 "name": if_link.file_settings.name,
                 "chmod": if_link.file_settings.chmod_settings,
             }
+            if include_contents:
+                plan["checker_files"][f"in-{i_file.id}"]["contents"] = get_file_contents_b64(i_file)
+
+    return plan
+
+
+def get_test_plan(exercise, instance, revision=None):
+    """
+    Gets the compiled test plan of a file upload exercise from the cache, or
+    compiles it if it is missing, stale, or refers to checker files that have
+    been dropped from the checker file store.
+    """
+
+    revision_key = "head" if revision is None else revision
+    plan_key = (
+        f"{exercise.id}_testplan_{instance.id}_{revision_key}_{translation.get_language()}"
+    )
+    generation_key = _test_plan_generation_key(exercise.id)
+    cached = cache.get_many([plan_key, generation_key])
+    generation = cached.get(generation_key)
+    if generation is None:
+        generation = current_generation(generation_key)
+    if plan_key in cached:
+        plan_generation, plan = cached[plan_key]
+        if plan_generation == generation and touch_checker_files(
+            file_info["hash"] for file_info in plan["checker_files"].values()
+        ):
+            return plan
+
+    plan = compile_test_plan(exercise, instance, revision)
+    cache.set(
+        plan_key,
+        (generation, plan),
+        timeout=getattr(settings, "TEST_PLAN_TIMEOUT", 60 * 60 * 24),
+    )
+    return plan
+
+
+def schedule_reference_warmup(exercise):
+    """
+    Sends the current test plans of a file upload exercise to the checker to
+    have their reference results cached before answers come in. A plan is
+    sent for each unfrozen instance embedding the exercise and each language,
+    skipping plans that are identical to one already sent.
+    """
+
+    from courses.tasks import warm_reference_results
+
+    instances = cm.CourseInstance.objects.filter(
+        frozen=False, embeddedlink__embedded_page=exercise
+    ).distinct()
+    sent = set()
+    for instance in instances:
+        for lang_code, __ in settings.LANGUAGES:
+            with translation.override(lang_code):
+                plan = get_test_plan(exercise, instance)
+            digest = hashlib.sha256(json.dumps(plan, sort_keys=True).encode("utf-8")).digest()
+            if digest not in sent:
+                sent.add(digest)
+                warm_reference_results.delay(plan)
+
+
+def file_upload_payload(exercise, student_files, instance, revision=None, include_contents=False):
+    if include_contents:
+        plan = compile_test_plan(exercise, instance, revision, include_contents=True)
+    else:
+        plan = get_test_plan(exercise, instance, revision)
+    payload = {
+        "resources": {"files_to_check": {}, "checker_files": plan["checker_files"]},
+        "tests": plan["tests"],
+    }
+
+    # Resources
+    for a_file in student_files:
+        a_file.seek(0)
+        payload["resources"]["files_to_check"][a_file.name] = base64.b64encode(
+            a_file.read()
+        ).decode("utf-8")
 
     logger.debug(json.dumps(payload, indent=4))
     return payload
@@ -1,17 +1,40 @@
 import base64
+import hashlib
+import logging
 import os
 import re
+import stat
+import tempfile
 import magic
 
+from django.core.cache import caches
 from django.core.files.storage import FileSystemStorage
 from django.conf import settings
 from django.http import HttpResponse
 
+from utils.cache import LRUCache
+
 mod_pat = re.compile("[wrx]")
 
 PRIVATE_UPLOAD = getattr(settings, "PRIVATE_STORAGE_FS_PATH", settings.MEDIA_ROOT)
 upload_storage = FileSystemStorage(location=PRIVATE_UPLOAD)
 
+logger = logging.getLogger(__name__)
+
+# Checker files (exercise and instance files needed by the tests) are sent to
+# workers by the SHA-256 hash of their contents. The contents are kept in the
+# checker cache for this many seconds after they were last needed, and each
+# worker keeps copies of them in its own directory, which must be owned by the
+# worker and not accessible to anyone else. The least recently used copies are
+# removed when the directory grows over CHECKER_FILE_DIR_SIZE bytes.
+CHECKER_FILE_TIMEOUT = getattr(settings, "CHECKER_FILE_TIMEOUT", 60 * 60 * 24 * 7)
+CHECKER_FILE_DIR = getattr(settings, "CHECKER_FILE_DIR", "/var/cache/lovelace/checker-files")
+CHECKER_FILE_DIR_SIZE = getattr(settings, "CHECKER_FILE_DIR_SIZE", 512 * 1024 ** 2)
+
+# Hashes of checker files by (path, modification time, size), so that files
+# are only read when they have changed or have been dropped from the store
+_checker_file_hashes = LRUCache(1024)
+
 
 def generate_download_response(fs_path, dl_name=None):
     """
@@ -79,6 +102,196 @@ def get_file_contents_b64(model_instance):
     return base64.b64encode(bytestring).decode("utf-8")
 
 
+def get_checker_cache():
+    """
+    Returns the cache that is shared with the checker workers, or None if it
+    has not been configured. Checker files must then be sent with their
+    contents included.
+    """
+
+    if "checker" in settings.CACHES:
+        return caches["checker"]
+    return None
+
+
+def _checker_file_key(digest):
+    return f"checker_file_{digest}"
+
+
+def store_checker_file(model_instance):
+    """
+    Makes sure the contents of an exercise or instance file are in the shared
+    checker file store and returns their SHA-256 hash, which is what the
+    checker payload refers to the file with. Files that are already in the
+    store are neither read nor sent again. Without a checker cache only the
+    hash is computed.
+    """
+
+    checker_cache = get_checker_cache()
+    path = model_instance.fileinfo.path
+    file_stat = os.stat(path)
+    file_key = (path, file_stat.st_mtime_ns, file_stat.st_size)
+    digest = _checker_file_hashes.get(file_key)
+    if digest is not None and (
+        checker_cache is None
+        or checker_cache.touch(_checker_file_key(digest), CHECKER_FILE_TIMEOUT)
+    ):
+        return digest
+
+    contents = get_file_contents(model_instance)
+    digest = hashlib.sha256(contents).hexdigest()
+    if checker_cache is not None:
+        checker_cache.set(_checker_file_key(digest), contents, timeout=CHECKER_FILE_TIMEOUT)
+    _checker_file_hashes.set(file_key, digest)
+    return digest
+
+
+def touch_checker_files(digests):
+    """
+    Keeps checker files in the shared checker file store for another
+    CHECKER_FILE_TIMEOUT seconds. Returns False if any of them has already
+    been dropped from the store.
+    """
+
+    checker_cache = get_checker_cache()
+    if checker_cache is None:
+        return True
+
+    return all(
+        checker_cache.touch(_checker_file_key(digest), CHECKER_FILE_TIMEOUT)
+        for digest in digests
+    )
+
+
+class CheckerFileMissing(FileNotFoundError):
+    """
+    Raised by the checker when a checker file is neither in its own checker
+    file directory nor in the shared checker file store.
+    """
+
+    def __init__(self, digest):
+        super().__init__(f"Checker file {digest} is missing from the shared store")
+        self.digest = digest
+
+
+def _checker_file_dir():
+    """
+    Returns the worker's local checker file directory, creating it if needed.
+    Returns None if the directory can't be created, or if it is not a real
+    directory that is owned by the worker and closed to everyone else, in
+    which case checker files are always read from the shared store.
+    """
+
+    try:
+        os.makedirs(CHECKER_FILE_DIR, mode=0o700, exist_ok=True)
+        dir_stat = os.lstat(CHECKER_FILE_DIR)
+    except OSError as e:
+        logger.warning(f"Checker file directory {CHECKER_FILE_DIR} is not usable: {e}")
+        return None
+
+    if (
+        not stat.S_ISDIR(dir_stat.st_mode)
+        or dir_stat.st_uid != os.getuid()
+        or stat.S_IMODE(dir_stat.st_mode) != 0o700
+    ):
+        logger.warning(
+            f"Refusing to use checker file directory {CHECKER_FILE_DIR}, it must be a "
+            f"directory owned by uid {os.getuid()} with mode 0700"
+        )
+        return None
+    return CHECKER_FILE_DIR
+
+
+def _read_local_checker_file(checker_dir, digest):
+    fpath = os.path.join(checker_dir, digest)
+    try:
+        fd = os.open(fpath, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+
+    with os.fdopen(fd, "rb") as f:
+        file_stat = os.fstat(f.fileno())
+        if not stat.S_ISREG(file_stat.st_mode) or file_stat.st_uid != os.getuid():
+            return None
+        contents = f.read()
+
+    if hashlib.sha256(contents).hexdigest() != digest:
+        logger.warning(f"Local copy of checker file {digest} has been changed")
+        return None
+
+    # The modification time tells which copies have been used least recently
+    os.utime(fpath)
+    return contents
+
+
+def _save_local_checker_file(checker_dir, digest, contents):
+    # Temporary files start with a dot so that eviction leaves them alone
+    fd, temp_path = tempfile.mkstemp(dir=checker_dir, prefix=".")
+    with os.fdopen(fd, "wb") as f:
+        f.write(contents)
+    os.replace(temp_path, os.path.join(checker_dir, digest))
+    evict_checker_files(checker_dir)
+
+
+def evict_checker_files(checker_dir, max_size=None):
+    """
+    Removes the least recently used copies from a local checker file
+    directory until the total size of the copies is at most max_size bytes
+    (CHECKER_FILE_DIR_SIZE by default).
+    """
+
+    if max_size is None:
+        max_size = CHECKER_FILE_DIR_SIZE
+
+    copies = []
+    with os.scandir(checker_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                continue
+            try:
+                entry_stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            copies.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+
+    total_size = sum(size for __, size, __ in copies)
+    for __, size, path in sorted(copies):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+def get_checker_file(digest):
+    """
+    Gets the contents of a checker file from the worker's local checker file
+    directory, or from the shared checker file store if this worker doesn't
+    have an intact copy of it, in which case a copy is saved for next time.
+    Raises CheckerFileMissing if the file has been dropped from the store.
+    """
+
+    checker_dir = _checker_file_dir()
+    if checker_dir is not None:
+        contents = _read_local_checker_file(checker_dir, digest)
+        if contents is not None:
+            return contents
+
+    checker_cache = get_checker_cache()
+    if checker_cache is None:
+        raise CheckerFileMissing(digest)
+
+    contents = checker_cache.get(_checker_file_key(digest))
+    if contents is None or hashlib.sha256(contents).hexdigest() != digest:
+        raise CheckerFileMissing(digest)
+
+    if checker_dir is not None:
+        _save_local_checker_file(checker_dir, digest, contents)
+    return contents
+
+
 def get_testfile_path(instance, filename):
     """
     Gets the path for exercise files.
@@ -0,0 +1,154 @@
+"""
+Cached syntax highlighting for code blocks and embedded files.
+
+Highlighted HTML is cached by the lexer name (or file name) and a hash of the
+source code. The first tier is a bounded LRU cache in the process memory. If
+the HIGHLIGHT_SHARED_CACHE setting names a Django cache, that cache is used as
+a second tier that is shared between processes. The shared tier is off by
+default, and its entries expire like other long lived cache entries.
+"""
+
+import functools
+import hashlib
+import os
+import re
+from collections import defaultdict
+from fnmatch import fnmatchcase
+
+import pygments
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import (
+    find_lexer_class,
+    get_all_lexers,
+    get_lexer_by_name,
+    guess_lexer_for_filename,
+)
+from pygments.util import ClassNotFound
+
+from django.conf import settings
+from django.core.cache import caches
+
+from utils.cache import LRUCache
+
+_formatter = HtmlFormatter(nowrap=True)
+_highlighted = LRUCache(getattr(settings, "HIGHLIGHT_CACHE_SIZE", 256))
+_EXTENSION_PATTERN_RE = re.compile(r"^\*\.[^*?\[\]]+$")
+
+
+def _shared_cache():
+    alias = getattr(settings, "HIGHLIGHT_SHARED_CACHE", None)
+    if alias:
+        return caches[alias]
+    return None
+
+
+def _cached_highlight(lexer_key, code, get_lexer):
+    digest = hashlib.sha256(f"{lexer_key}\0{code}".encode("utf-8")).hexdigest()
+    highlighted = _highlighted.get(digest)
+    if highlighted is not None:
+        return highlighted
+
+    shared = _shared_cache()
+    if shared is not None:
+        highlighted = shared.get(f"highlight_{digest}")
+
+    if highlighted is None:
+        highlighted = pygments.highlight(code, get_lexer(), _formatter)
+        if shared is not None:
+            shared.set(f"highlight_{digest}", highlighted, timeout=settings.REDIS_LONG_EXPIRE)
+
+    _highlighted.set(digest, highlighted)
+    return highlighted
+
+
+@functools.lru_cache(maxsize=None)
+def lexer_by_name(name):
+    """
+    Cached version of pygments' get_lexer_by_name. Raises ClassNotFound if
+    there is no lexer with the given name.
+    """
+
+    return get_lexer_by_name(name)
+
+
+@functools.lru_cache(maxsize=1)
+def _filename_index():
+    """
+    Builds an index of lexer classes by the file name patterns they accept.
+    Simple "*.ext" patterns are indexed by the extension, other patterns are
+    kept in a list because they need to be matched one by one.
+    """
+
+    by_extension = defaultdict(set)
+    other_patterns = []
+    for name, __, __, __ in get_all_lexers():
+        lexer_cls = find_lexer_class(name)
+        if lexer_cls is None:
+            continue
+        for pattern in list(lexer_cls.filenames) + list(lexer_cls.alias_filenames):
+            if _EXTENSION_PATTERN_RE.match(pattern):
+                by_extension[pattern[2:]].add(lexer_cls)
+            else:
+                other_patterns.append((pattern, lexer_cls))
+    return by_extension, other_patterns
+
+
+@functools.lru_cache(maxsize=1024)
+def _lexer_class_for_filename(filename):
+    """
+    Finds the lexer class for a file name using the extension index. Returns
+    None if the file name matches more than one lexer, because in that case
+    the lexer needs to be chosen based on the file contents.
+    """
+
+    by_extension, other_patterns = _filename_index()
+    candidates = set()
+    extension = filename
+    while "." in extension:
+        extension = extension.split(".", 1)[1]
+        candidates.update(by_extension.get(extension, ()))
+
+    for pattern, lexer_cls in other_patterns:
+        if fnmatchcase(filename, pattern):
+            candidates.add(lexer_cls)
+
+    if not candidates:
+        raise ClassNotFound(f"no lexer for filename {filename!r} found")
+    if len(candidates) == 1:
+        return candidates.pop()
+    return None
+
+
+def lexer_for_filename(path, contents):
+    """
+    Cached replacement for pygments' guess_lexer_for_filename. File names that
+    only match one lexer are resolved from the cached extension index, and
+    only ambiguous file names are resolved by analysing the contents. Raises
+    ClassNotFound if no lexer matches the file name.
+    """
+
+    lexer_cls = _lexer_class_for_filename(os.path.basename(path))
+    if lexer_cls is None:
+        return guess_lexer_for_filename(path, contents)
+    return lexer_cls()
+
+
+def highlight_code(code, lexer_name):
+    """
+    Highlights code with the lexer of the given name, using cached results
+    when available. Raises ClassNotFound if there is no such lexer.
+    """
+
+    return _cached_highlight(f"name:{lexer_name}", code, lambda: lexer_by_name(lexer_name))
+
+
+def highlight_file(path, contents):
+    """
+    Highlights file contents with a lexer chosen by the file name, using
+    cached results when available. Raises ClassNotFound if no lexer matches
+    the file name.
+    """
+
+    return _cached_highlight(
+        f"file:{os.path.basename(path)}", contents, lambda: lexer_for_filename(path, contents)
+    )
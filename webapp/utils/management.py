@@ -10,7 +10,7 @@ from reversion.models import Version
 from modeltranslation.translator import translator
 import courses.models as cm
 from courses.widgets import ContentPreviewWidget, AdminFileWidget
-from utils.access import determine_access, determine_media_access
+from utils.access import access_filter, determine_access, determine_media_access
 from utils.archive import find_latest_version
 from utils.data import serialize_single_python, export_json
 
@@ -58,25 +58,10 @@ class CourseContentAdmin(admin.ModelAdmin):
         if request.user.is_superuser:
             return qs
 
-        edited = (
-            Version.objects.get_for_model(model)
-            .filter(revision__user=request.user)
-            .values_list("object_id", flat=True)
+        accessible = cm.ContentAccess.objects.filter(access_filter(request.user)).values(
+            "content_id"
         )
-
-        qs = qs.filter(
-            Q(id__in=list(edited))
-            | Q(contentgraph__instance__course__staff_group__user=request.user)
-            | Q(
-                emb_embedded__parent__contentgraph__instance__course__staff_group__user=request.user
-            )
-            | Q(contentgraph__instance__course__main_responsible=request.user)
-            | Q(
-                emb_embedded__parent__contentgraph__instance__course__main_responsible=request.user
-            )
-        ).distinct()
-
-        return qs
+        return qs.filter(id__in=accessible)
 
     def get_queryset(self, request):
         return CourseContentAdmin.content_access_list(request, self.model, self.content_type).defer(
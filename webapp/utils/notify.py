@@ -1,5 +1,7 @@
 import datetime
+import time
 import uuid
+from contextlib import contextmanager
 from django.conf import settings
 from django.core.cache import caches
 from django.core.mail import get_connection, EmailMessage, send_mass_mail
@@ -116,32 +118,107 @@ def send_bcc_email(instance, recipients, sender, title, body):
     )
     mail.send()
 
+# Seconds that an index update may hold the lock before other updates take over
+NOTIFICATION_LOCK_TIMEOUT = 10
+
+
+def _notification_index_key(instance):
+    return f"{instance}_notifications"
+
+
+@contextmanager
+def _locked_index(cache, instance):
+    """
+    Serializes updates to the notification index of an instance (or "system")
+    so that concurrent updates don't overwrite each other. The lock is a cache
+    entry added with cache.add, which is atomic, and it expires on its own if
+    the process holding it dies.
+    """
+
+    lock_key = f"{_notification_index_key(instance)}_lock"
+    token = uuid.uuid4().hex
+    while not cache.add(lock_key, token, NOTIFICATION_LOCK_TIMEOUT):
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+def _load_notifications(cache, instance, now):
+    """
+    Reads the notification index of an instance (or "system") from the cache
+    and drops notifications that have expired. The index is a dictionary with
+    timestamps as keys and (expiry, contents by language) tuples as values.
+    """
+
+    notifications = cache.get(_notification_index_key(instance), {})
+    return {
+        timestamp: (expiry, contents)
+        for timestamp, (expiry, contents) in notifications.items()
+        if expiry > now
+    }
+
+
+def _store_notifications(cache, instance, notifications, now):
+    """
+    Writes the notification index of an instance (or "system") to the cache.
+    The index expires together with its last notification.
+    """
+
+    if notifications:
+        timeout = max((expiry - now).total_seconds() for expiry, __ in notifications.values())
+        cache.set(_notification_index_key(instance), notifications, timeout)
+    else:
+        cache.delete(_notification_index_key(instance))
+
+
 def create_notifications(content_dict, expiry, instance="system", timestamp=None):
+    """
+    Creates a notification that is shown until the expiry time. The contents
+    of each language are stored with the notification, using the default
+    language's content for languages that don't have content. All
+    notifications of an instance are kept in one index entry so that they can
+    be read without scanning the cache for keys.
+    """
+
     cache = caches["notify"]
     now = datetime.datetime.now()
-    to_expiry = (expiry - now).total_seconds()
     if timestamp is None:
         timestamp = now.isoformat()
+
+    contents = {}
     for lang_code, _ in settings.LANGUAGES:
-        key = f"{instance}_{timestamp}_{lang_code}"
         if content := content_dict.get(f"content_{lang_code}", ""):
-            cache.set(key, content, to_expiry)
+            contents[lang_code] = content
         else:
-            cache.set(key, content_dict[f"content_{settings.LANGUAGE_CODE}"], to_expiry)
+            contents[lang_code] = content_dict[f"content_{settings.LANGUAGE_CODE}"]
+
+    with _locked_index(cache, instance):
+        notifications = _load_notifications(cache, instance, now)
+        notifications[timestamp] = (expiry, contents)
+        _store_notifications(cache, instance, notifications, now)
 
 
 def get_notifications(instance, last_seen, lang, return_keys=False):
+    """
+    Gets the contents of notifications in the given language that were created
+    after last_seen, in creation order. If return_keys is set, returns (key,
+    content) pairs instead, where the key identifies the notification for
+    remove_system_message.
+    """
+
     messages = []
+    keys = []
     cache = caches["notify"]
-    keys = cache.keys(
-        f"{instance}*"
-    )
-    keys.sort()
-    for key in keys:
-        _, timestamp, lang_code = key.split("_")
+    notifications = _load_notifications(cache, instance, datetime.datetime.now())
+    for timestamp in sorted(notifications):
+        __, contents = notifications[timestamp]
         if not last_seen or timestamp > last_seen:
-            if key.endswith(lang):
-                messages.append(cache.get(key))
+            if lang in contents:
+                keys.append(f"{instance}_{timestamp}_{lang}")
+                messages.append(contents[lang])
 
     if return_keys:
         return zip(keys, messages)
@@ -149,4 +226,8 @@ def get_notifications(instance, last_seen, lang, return_keys=False):
 
 def delete_notification(instance, timestamp):
     cache = caches["notify"]
-    cache.delete_pattern(f"{instance}_{timestamp}*")
+    now = datetime.datetime.now()
+    with _locked_index(cache, instance):
+        notifications = _load_notifications(cache, instance, now)
+        if notifications.pop(timestamp, None) is not None:
+            _store_notifications(cache, instance, notifications, now)
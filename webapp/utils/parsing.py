@@ -1,3 +1,4 @@
+from collections import defaultdict
 from django.urls import reverse
 from django.utils.text import slugify
 import courses.models as cm
@@ -9,7 +10,104 @@ class BrokenLinkWarning(Exception):
     pass
 
 
+class LinkResolver:
+    """
+    Resolves the files and pages that inline links refer to within one
+    rendering context. Addresses given to prefetch are loaded with one query
+    per model, and resolved link addresses are memoized. Files and pages that
+    were not prefetched are looked up individually.
+    """
+
+    def __init__(self, course, instance):
+        self.course = course
+        self.instance = instance
+        self.resolved = {}
+        self._files = {}
+        self._pages = {}
+
+    def prefetch(self, addresses):
+        file_names = set()
+        slugs = set()
+        for address in addresses:
+            server_side = address.split("#", 1)[0]
+            if server_side.strip() == "":
+                continue
+            if server_side.startswith("file:"):
+                file_names.add(server_side.split("file:", 1)[1])
+            elif server_side == slugify(server_side, allow_unicode=True):
+                slugs.add(server_side)
+
+        file_names.difference_update(self._files)
+        slugs.difference_update(self._pages)
+        if file_names:
+            files = defaultdict(list)
+            for mediafile in cm.File.objects.filter(name__in=file_names):
+                files[mediafile.name].append(mediafile)
+            for name in file_names:
+                # Ambiguous names are left for get_file to fail on
+                if len(files[name]) <= 1:
+                    self._files[name] = files[name][0] if files[name] else None
+        if slugs:
+            pages = {page.slug: page for page in cm.ContentPage.objects.filter(slug__in=slugs)}
+            for slug in slugs:
+                self._pages[slug] = pages.get(slug)
+
+    def get_file(self, name):
+        try:
+            mediafile = self._files[name]
+        except KeyError:
+            try:
+                mediafile = cm.File.objects.get(name=name)
+            except cm.File.DoesNotExist:
+                mediafile = None
+            self._files[name] = mediafile
+
+        if mediafile is None:
+            raise cm.File.DoesNotExist(f"File matching query does not exist: {name}")
+        return mediafile
+
+    def get_page(self, slug):
+        try:
+            page = self._pages[slug]
+        except KeyError:
+            try:
+                page = cm.ContentPage.objects.get(slug=slug)
+            except cm.ContentPage.DoesNotExist:
+                page = None
+            self._pages[slug] = page
+
+        if page is None:
+            raise cm.ContentPage.DoesNotExist(f"ContentPage matching query does not exist: {slug}")
+        return page
+
+
+def get_link_resolver(context):
+    """
+    Gets the link resolver of a rendering context, or creates one and stores
+    it in the context. A new resolver is created if the course or instance of
+    the context has changed. If context is None, the returned resolver is not
+    stored anywhere.
+    """
+
+    if context is None:
+        return LinkResolver(None, None)
+
+    resolver = context.get("link_resolver")
+    if (
+        resolver is None
+        or resolver.course != context.get("course")
+        or resolver.instance != context.get("instance")
+    ):
+        resolver = LinkResolver(context.get("course"), context.get("instance"))
+        context["link_resolver"] = resolver
+    return resolver
+
+
 def parse_link_url(address, context=None):
+    resolver = get_link_resolver(context)
+    if address in resolver.resolved:
+        return resolver.resolved[address]
+
     try:
         server_side, client_side = address.split("#", 1)
     except ValueError:
@@ -25,7 +123,7 @@ def parse_link_url(address, context=None):
         if server_side.startswith("file:"):
             file_slug = server_side.split("file:", 1)[1]
             try:
-                mediafile = cm.File.objects.get(name=file_slug)
+                mediafile = resolver.get_file(file_slug)
             except cm.File.DoesNotExist as e:
                 raise BrokenLinkWarning from e
             else:
@@ -45,7 +143,7 @@ def parse_link_url(address, context=None):
             if server_side == slugified and context is not None:
                 # internal address
                 try:
-                    content = cm.ContentPage.objects.get(slug=slugified)
+                    content = resolver.get_page(slugified)
                 except cm.ContentPage.DoesNotExist as e:
                     logger.warning(f"Found broken link reference: {slugified}")
                     raise BrokenLinkWarning(slugified) from e
@@ -63,4 +161,5 @@ def parse_link_url(address, context=None):
                 # external address
                 final_address = address
 
+    resolver.resolved[address] = (final_address, target)
     return final_address, target
@@ -0,0 +1,234 @@
+"""
+Regeneration of cached content for whole course instances.
+
+Regenerating an instance is split into jobs that each regenerate one page in
+one language. The jobs are run in two stages: first the FAQ panels of the
+embedded pages, and then the content graph pages that embed them. Jobs within
+a stage don't depend on each other, so they can be run in parallel, either in
+Celery workers or in a local process pool. Progress is counted in the cache
+and can be read with regeneration_progress. Jobs that fail are logged and
+counted as finished, so that one broken page doesn't stop the regeneration.
+"""
+
+import concurrent.futures
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+import courses.models as cm
+from utils.cache import bump_generation
+from faq.utils import regenerate_cache as regenerate_faq_cache
+
+logger = logging.getLogger(__name__)
+
+
+def _progress_keys(instance_id):
+    return (
+        f"{instance_id}_regen_done",
+        f"{instance_id}_regen_failed",
+        f"{instance_id}_regen_total",
+    )
+
+
+def _running_key(instance_id):
+    return f"{instance_id}_regen_running"
+
+
+def _pending_key(instance_id):
+    return f"{instance_id}_regen_pending"
+
+
+def _start_progress(instance, stages):
+    done_key, failed_key, total_key = _progress_keys(instance.id)
+    total = sum(len(stage) for stage in stages)
+    cache.set_many(
+        {done_key: 0, failed_key: 0, total_key: total}, timeout=settings.REDIS_LONG_EXPIRE
+    )
+
+
+def regeneration_progress(instance):
+    """
+    Returns the progress of the latest regeneration of the instance as a
+    dictionary with the numbers of finished, failed and total jobs, or None if
+    the instance has not been regenerated recently. Failed jobs are included
+    in the finished jobs.
+    """
+
+    done_key, failed_key, total_key = _progress_keys(instance.id)
+    progress = cache.get_many([done_key, failed_key, total_key])
+    if total_key not in progress:
+        return None
+    return {
+        "current": progress.get(done_key, 0),
+        "failed": progress.get(failed_key, 0),
+        "total": progress[total_key],
+    }
+
+
+def regeneration_running(instance):
+    """
+    Tells whether a regeneration scheduled with schedule_regeneration is still
+    running for the instance. A regeneration that hasn't finished within
+    REGENERATION_TIMEOUT seconds is no longer considered to be running.
+    """
+
+    return cache.get(_running_key(instance.id)) is not None
+
+
+def regeneration_jobs(instance, nodes=None):
+    """
+    Builds the regeneration jobs of a course instance, limited to the given
+    content graph nodes if nodes is given. Returns a list of stages that need
+    to be run in order, each stage being a list of (instance id, content id,
+    language code, embedded) tuples.
+    """
+
+    if nodes is None:
+        nodes = cm.ContentGraph.objects.filter(instance=instance)
+
+    content_ids = sorted(set(node.content_id for node in nodes))
+    embedded_ids = sorted(set(
+        cm.EmbeddedLink.objects.filter(
+            instance=instance, parent_id__in=content_ids
+        ).values_list("embedded_page_id", flat=True)
+    ))
+    lang_codes = [lang_code for lang_code, __ in settings.LANGUAGES]
+
+    return [
+        [
+            (instance.id, content_id, lang_code, True)
+            for content_id in embedded_ids
+            for lang_code in lang_codes
+        ],
+        [
+            (instance.id, content_id, lang_code, False)
+            for content_id in content_ids
+            for lang_code in lang_codes
+        ],
+    ]
+
+
+def run_regeneration_job(instance_id, content_id, lang_code, embedded):
+    """
+    Runs one regeneration job. Embedded pages only have their FAQ panel
+    regenerated because their content is rendered as part of the parent page.
+    """
+
+    done_key, failed_key, total_key = _progress_keys(instance_id)
+    try:
+        instance = cm.CourseInstance.objects.get(id=instance_id)
+        content = cm.ContentPage.objects.get(id=content_id)
+        if embedded:
+            regenerate_faq_cache(instance, content, [lang_code])
+        else:
+            content.regenerate_cache(instance, lang_codes=[lang_code])
+    except Exception:
+        logger.exception(
+            f"Regenerating content {content_id} ({lang_code}) of instance {instance_id} failed"
+        )
+        try:
+            cache.incr(failed_key)
+        except ValueError:
+            pass
+    finally:
+        try:
+            done = cache.incr(done_key)
+        except ValueError:
+            pass
+        else:
+            if done >= cache.get(total_key, 0):
+                finish_regeneration(instance_id)
+
+
+def invalidate_instance_cache(instance):
+    """
+    Marks the rendered content of the instance's pages as stale without
+    rendering it again. Stale pages are served until they have been
+    regenerated or rendered again on their next view.
+    """
+
+    bump_generation(instance, "content")
+
+
+def finish_regeneration(instance_id):
+    """
+    Marks the regeneration of an instance as no longer running, and schedules
+    the regeneration that was requested while it was running, if there was
+    one. Called when the last job has finished, or when a task of the Celery
+    chain fails.
+    """
+
+    cache.delete(_running_key(instance_id))
+    if cache.get(_pending_key(instance_id)):
+        cache.delete(_pending_key(instance_id))
+        instance = cm.CourseInstance.objects.get(id=instance_id)
+        logger.info(f"Starting the pending regeneration of instance {instance_id}")
+        schedule_regeneration(instance)
+
+
+def schedule_regeneration(instance, nodes=None):
+    """
+    Regenerates the cache of a course instance in Celery workers, limited to
+    the given content graph nodes if nodes is given. Returns the result of the
+    Celery chain, or None if there was nothing to regenerate or if a previous
+    regeneration of the instance is still running. In the latter case the
+    whole instance is regenerated once the previous regeneration finishes.
+    """
+
+    from celery import chain, group
+    from courses.tasks import finish_regeneration_task, regenerate_content_cache
+
+    running_key = _running_key(instance.id)
+    timeout = getattr(settings, "REGENERATION_TIMEOUT", 60 * 60)
+    if not cache.add(running_key, True, timeout=timeout):
+        cache.set(_pending_key(instance.id), True, timeout=timeout * 2)
+        logger.info(
+            f"Regeneration of instance {instance.id} is already running, "
+            "scheduling another one after it"
+        )
+        return None
+
+    stages = [stage for stage in regeneration_jobs(instance, nodes) if stage]
+    _start_progress(instance, stages)
+    if not stages:
+        finish_regeneration(instance.id)
+        return None
+
+    return chain(*[
+        group([regenerate_content_cache.si(*job) for job in stage]) for stage in stages
+    ]).on_error(finish_regeneration_task.si(instance.id)).delay()
+
+
+def regenerate_locally(instance, nodes=None, workers=1, report=None):
+    """
+    Regenerates the cache of a course instance in a pool of worker processes,
+    or in the current process if workers is 1. If report is given, it is
+    called with the numbers of finished and total jobs after each job.
+    """
+
+    stages = regeneration_jobs(instance, nodes)
+    _start_progress(instance, stages)
+    total = sum(len(stage) for stage in stages)
+    done = 0
+
+    if workers <= 1:
+        for stage in stages:
+            for job in stage:
+                run_regeneration_job(*job)
+                done += 1
+                if report is not None:
+                    report(done, total)
+        return
+
+    # Worker processes must not share the database connections of this one
+    connections.close_all()
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for stage in stages:
+            futures = [executor.submit(run_regeneration_job, *job) for job in stage]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+                done += 1
+                if report is not None:
+                    report(done, total)
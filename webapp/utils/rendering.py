@@ -1,186 +1,208 @@
+from django.conf import settings
 from django.core.cache import cache
 from django.urls import reverse
 from django.utils import translation
 from django.utils.text import slugify
 from reversion.models import Version
-from courses import markupparser
+from courses import blockparser, markupparser
 import courses.models as cm
-from utils.archive import get_single_archived
-from utils.parsing import parse_link_url, BrokenLinkWarning
+from utils.cache import cached_render, current_generation, generation_key
+from utils.parsing import get_link_resolver, parse_link_url, BrokenLinkWarning
 
 
 def render_content(content, request=None, context=None, revision=None, lang_code=None, page=None):
-    blocks = []
-    embedded_pages = []
-    instance = context["instance"]
+    return content.rendered_markup(request, context, revision, lang_code, page)
 
-    if lang_code is None:
-        lang_code = translation.get_language()
 
-    # Check cache
-    if page is not None:
-        cached_content = cache.get(f"{content.slug}_contents_{instance.slug}_{lang_code}_{page}")
-    else:
-        cached_content = cache.get(f"{content.slug}_contents_{instance.slug}_{lang_code}")
+def _term_cache_key(instance, term_id, revision, lang):
+    if revision is None:
+        revision = "current"
+    return f"termbank_term_{instance.slug}_{term_id}_{revision}_{lang}"
 
-    if cached_content is not None:
-        return cached_content
 
-    if revision is None:
-        body = content.content
-    else:
-        body = get_single_archived(content, revision).content
-
-    # Render the page
-    parser = markupparser.MarkupParser()
-    context["content"] = content
-    context["lang_code"] = lang_code
-    markup_gen = parser.parse(body, request, context, embedded_pages)
-    segment = ""
-    pages = []
-    for chunk in markup_gen:
-        if isinstance(chunk, markupparser.PageBreak):
-            pages.append(blocks)
-            blocks = []
-        else:
-            blocks.append(chunk)
+def clear_term_cache(instance, term):
+    """
+    Removes the rendered current version of a term from the course instance's
+    termbank cache in all languages. Call this together with bumping the
+    termbank generation when a term has been changed, so that only the changed
+    term is rendered again when the termbank is rebuilt.
+    """
 
-    pages.append(blocks)
+    cache.delete_many([
+        _term_cache_key(instance, term.id, None, lang_code)
+        for lang_code, __ in settings.LANGUAGES
+    ])
 
-    if len(pages) > 1:
-        for i, blocks in enumerate(pages, start=1):
-            cache.set(
-                f"{content.slug}_contents_{instance.slug}_{lang_code}_{i}",
-                blocks,
-                timeout=None,
-            )
 
-    full = [block for page in pages for block in page]
-    cache.set(
-        f"{content.slug}_contents_{instance.slug}_{lang_code}",
-        full,
-        timeout=None,
-    )
+def _get_term_initial(name):
+    try:
+        first_char = name.upper()[0]
+    except IndexError:
+        first_char = "#"
+    else:
+        if not first_char.isalpha():
+            first_char = "#"
+    return first_char
+
+
+def _render_term(term, parser, request, term_context, context):
+    """
+    Renders one term for the termbank. Returns a dictionary with the term's
+    name, the data of its description div, and the (initial, entry) pairs of
+    the term and its aliases in the termbank list.
+    """
+
+    slug = slugify(term.name, allow_unicode=True)
+    description = "".join(
+        block[1] for block in parser.parse(
+            term.description, request, term_context
+        )
+    ).strip()
+    tabs = [
+        (
+            tab.title,
+            "".join(
+                block[1] for block in parser.parse(
+                    tab.description, request, term_context
+                )
+            ).strip(),
+        )
+        for tab in term.termtab_set.all().order_by("id")
+    ]
+
+    final_links = []
+    for link in term.termlink_set.all():
+        try:
+            final_address, __ = parse_link_url(link.url, context)
+        except BrokenLinkWarning:
+            final_links.append({"url": "", "text": "-- WARNING: BROKEN LINK --"})
+        else:
+            final_links.append({"url": final_address, "text": link.link_text})
+
+    entries = [(
+        _get_term_initial(term.name),
+        {
+            "slug": slug,
+            "name": term.name,
+            "tags": list(term.tags.values_list("name", flat=True)),
+            "alias": False,
+        }
+    )]
+    for alias in cm.TermAlias.objects.filter(term=term):
+        entries.append((
+            _get_term_initial(alias.name),
+            {
+                "slug": slug,
+                "name": term.name,
+                "alias": alias.name,
+            }
+        ))
 
-    if page is not None:
-        return pages[page - 1]
-    return full
+    return {
+        "name": term.name,
+        "div": {
+            "slug": slug,
+            "description": description,
+            "tabs": tabs,
+            "links": final_links,
+            "edit_url": reverse(f"admin:courses_term_change", args=(term.id,))
+        },
+        "entries": entries,
+    }
 
 
 def render_terms(request, instance, context):
+    """
+    Returns the termbank of a course instance as a (termbank_contents,
+    term_div_data) tuple, where termbank_contents maps initials to the terms
+    and aliases listed under them.
+
+    Each term is also cached separately, so when the termbank generation is
+    bumped, only terms that have been cleared with clear_term_cache or have
+    had their revision changed are rendered again.
+    """
+
     lang = translation.get_language()
-    termbank_contents = cache.get(f"termbank_contents_{instance.slug}_{lang}")
-    term_div_data = cache.get(f"term_div_data_{instance.slug}_{lang}")
 
-    if termbank_contents is None or term_div_data is None:
+    def render(generation):
         term_context = context.copy()
         term_context["tooltip"] = True
-        term_links = cm.TermToInstanceLink.objects.filter(instance__slug=instance.slug)
-        term_div_data = []
-        termbank_contents = {}
+        term_links = list(
+            cm.TermToInstanceLink.objects.filter(instance=instance).order_by("id")
+        )
+        keys = {
+            link.id: _term_cache_key(instance, link.term_id, link.revision, lang)
+            for link in term_links
+        }
+        rendered = cache.get_many(list(keys.values()))
+
+        missing = [link for link in term_links if keys[link.id] not in rendered]
+        current_terms = cm.Term.objects.in_bulk(
+            [link.term_id for link in missing if link.revision is None]
+        )
         terms = []
-        for link in term_links:
+        for link in missing:
             if link.revision is None:
-                term = link.term
+                term = current_terms[link.term_id]
             else:
                 term = (
-                    Version.objects.get_for_object(link.term)
+                    Version.objects.get_for_object_reference(cm.Term, link.term_id)
                     .get(revision=link.revision)
                     ._object_version.object
                 )
+            terms.append((link, term))
+
+        # Resolve the inline links of all descriptions at once instead of per term
+        anchor_re = blockparser.BlockParser.tags["anchor"].regexp
+        get_link_resolver(term_context).prefetch(
+            match.group("address")
+            for link, term in terms
+            for match in anchor_re.finditer(term.description)
+        )
 
+        parser = markupparser.MarkupParser()
+        new_terms = {}
+        for link, term in terms:
             if term.description:
-                terms.append(term)
+                new_terms[keys[link.id]] = _render_term(
+                    term, parser, request, term_context, context
+                )
+            else:
+                new_terms[keys[link.id]] = {"name": term.name, "div": None, "entries": []}
+        if new_terms:
+            cache.set_many(new_terms, timeout=settings.REDIS_LONG_EXPIRE)
+            rendered.update(new_terms)
 
         def sort_by_name(item):
-            return item.name
-
-        terms.sort(key=sort_by_name)
-        parser = markupparser.MarkupParser()
-        for term in terms:
-            slug = slugify(term.name, allow_unicode=True)
-            description = "".join(
-                block[1] for block in parser.parse(
-                    term.description, request, term_context
-                )
-            ).strip()
-            tabs = [
-                (
-                    tab.title,
-                    "".join(
-                        block[1] for block in parser.parse(
-                            tab.description, request, term_context
-                        )
-                    ).strip(),
-                )
-                for tab in term.termtab_set.all().order_by("id")
-            ]
-            tags = term.tags
-
-            final_links = []
-            for link in term.termlink_set.all():
-                try:
-                    final_address, __ = parse_link_url(link.url, context)
-                except BrokenLinkWarning:
-                    final_links.append({"url": "", "text": "-- WARNING: BROKEN LINK --"})
-                else:
-                    final_links.append({"url": final_address, "text": link.link_text})
-
-            term_div_data.append(
-                {
-                    "slug": slug,
-                    "description": description,
-                    "tabs": tabs,
-                    "links": final_links,
-                    "edit_url": reverse(f"admin:courses_term_change", args=(term.id,))
-                }
-            )
-            term_data = {
-                "slug": slug,
-                "name": term.name,
-                "tags": tags.values_list("name", flat=True),
-                "alias": False,
-            }
+            return item["name"]
 
-            def get_term_initial(term):
-                try:
-                    first_char = term.upper()[0]
-                except IndexError:
-                    first_char = "#"
-                else:
-                    if not first_char.isalpha():
-                        first_char = "#"
-                return first_char
-
-            first_char = get_term_initial(term.name)
-            if first_char in termbank_contents:
-                termbank_contents[first_char].append(term_data)
-            else:
-                termbank_contents[first_char] = [term_data]
-
-            aliases = cm.TermAlias.objects.filter(term=term)
-            for alias in aliases:
-                alias_data = {
-                    "slug": slug,
-                    "name": term.name,
-                    "alias": alias.name,
-                }
-                first_char = get_term_initial(alias.name)
-
-                if first_char in termbank_contents:
-                    termbank_contents[first_char].append(alias_data)
-                else:
-                    termbank_contents[first_char] = [alias_data]
-
-        cache.set(
-            f"termbank_contents_{instance.slug}_{lang}",
-            termbank_contents,
-            timeout=None,
-        )
+        shown = [rendered[keys[link.id]] for link in term_links]
+        shown = [item for item in shown if item["div"] is not None]
+        shown.sort(key=sort_by_name)
 
-        cache.set(
-            f"term_div_data_{instance.slug}_{lang}",
-            term_div_data,
-            timeout=None,
-        )
-    return termbank_contents, term_div_data
+        term_div_data = []
+        termbank_contents = {}
+        for item in shown:
+            term_div_data.append(item["div"])
+            for first_char, entry in item["entries"]:
+                termbank_contents.setdefault(first_char, []).append(entry)
+
+        return termbank_contents, term_div_data
+
+    return cached_render(f"termbank_contents_{instance.slug}_{lang}", instance, "termbank", render)
+
+
+def termbank_version(instance, staff=False):
+    """
+    Returns a token that changes whenever the termbank of the course instance
+    as shown to the current user changes. Tokens don't repeat, even if the
+    generation key has been evicted from the cache. The token is used as the
+    ETag of the termbank and as a parameter of its URL, so that browsers can
+    keep the termbank until it changes.
+    """
+
+    generation = current_generation(generation_key(instance, "termbank"))
+    version = f"{generation}.{translation.get_language()}"
+    if staff:
+        version += ".staff"
+    return version